@@ -0,0 +1,793 @@
+#
+# bench/fakes.py
+#
+# Servidores falsos de Google Drive (API v2 y v3), Google Sheets y Telegram
+# para la suite de benchmarks (run.py).
+#
+# Se ejecutan en hilos del propio proceso de benchmark, sobre HTTP en
+# 127.0.0.1, y guardan todo su estado en memoria. Cada servidor puede añadir
+# una latencia fija más un jitter aleatorio a cada respuesta y devolver
+# errores de cuota con la probabilidad indicada, con el mismo formato que los
+# servicios reales (403 userRateLimitExceeded o 429 en Drive, 429
+# RESOURCE_EXHAUSTED en Sheets, 429 con retry_after en Telegram). Los errores
+# solo se simulan en las peticiones de metadatos, listados y mensajes, no en
+# la transferencia del contenido de los archivos.
+#
+# Los scripts del sistema se conectan a estos servidores con las variables de
+# entorno GOOGLE_API_ROOT, GOOGLE_SHEETS_API_ROOT y TELEGRAM_API_URL y con
+# unas credenciales de cuenta de servicio (write_credentials) cuyo token_uri
+# apunta al servidor falso de Drive.
+#
+
+import collections
+import email.parser
+import hashlib
+import json
+import operator
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
+SPREADSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+GOOGLE_API_URL = "https://www.googleapis.com/"  # las URLs que devuelve el Drive falso son las reales
+
+ID_SEGMENT_RE = re.compile(r"^[A-Za-z0-9_-]{20,}$")
+
+
+def rfc3339(moment):
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class FakeRequest:
+    """
+    Petición recibida por un servidor falso.
+    """
+
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b"{}")
+
+    def params(self):
+        """
+        Parámetros de la petición: consulta, formulario o JSON.
+        """
+        params = dict(self.query)
+        content_type = self.headers.get("Content-Type", "")
+        if self.body and "json" in content_type:
+            params.update(self.json())
+        elif self.body and "x-www-form-urlencoded" in content_type:
+            params.update(parse_qsl(self.body.decode()))
+        return params
+
+
+class FakeResponse:
+    def __init__(self, status, body=b"", headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+def json_response(status, data, headers=None):
+    headers = dict(headers or {})
+    headers["Content-Type"] = "application/json; charset=UTF-8"
+    return FakeResponse(status, json.dumps(data).encode(), headers)
+
+
+class FakeServer:
+    """
+    Servidor HTTP falso que atiende cada petición en su propio hilo.
+
+    Las subclases implementan route(request) y, si lo necesitan,
+    is_transient(request) para indicar qué peticiones pueden fallar por cuota.
+
+    Argumentos:
+        latency (float): Segundos que se añaden a cada respuesta.
+        jitter (float): Segundos aleatorios adicionales, como máximo.
+        error_rate (float): Probabilidad de responder con un error de cuota.
+        seed (int): Semilla de los valores aleatorios, para repetir una ejecución.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.stats = collections.Counter()  # peticiones por ruta y errores simulados
+        self.lock = threading.RLock()
+        self.httpd = None
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_request(self):
+                server.handle(self)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            def handle_error(self, request, client_address):
+                if not isinstance(sys.exc_info()[1], ConnectionError):
+                    super().handle_error(request, client_address)  # los clientes que se cierran no son errores
+
+        self.httpd = Server(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}/"
+
+    def snapshot_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def handle(self, handler):
+        parts = urlsplit(handler.path)
+        if handler.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = read_chunked(handler.rfile)
+        else:
+            body = handler.rfile.read(int(handler.headers.get("Content-Length") or 0))
+        request = FakeRequest(handler.command, unquote(parts.path), dict(parse_qsl(parts.query)), handler.headers, body)
+        response = self.dispatch(request)
+        handler.send_response(response.status)
+        for name, value in response.headers.items():
+            handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(response.body)))
+        handler.end_headers()
+        if request.method != "HEAD":
+            handler.wfile.write(response.body)
+
+    def dispatch(self, request, delay=True):
+        """
+        Atiende una petición aplicando la latencia y los errores simulados.
+        """
+        if delay and (self.latency or self.jitter):
+            time.sleep(self.latency + self.random.uniform(0, self.jitter))
+        label = f"{request.method} {self.label(request)}"
+        self.count(label)
+        if self.error_rate and self.is_transient(request):
+            with self.lock:
+                failed = self.random.random() < self.error_rate
+            if failed:
+                self.count("errores_simulados")
+                return self.quota_error(request)
+        try:
+            return self.route(request)
+        except KeyError as e:
+            return json_response(404, {"error": {"code": 404, "message": f"Not found: {e}"}})
+        except ValueError as e:
+            return json_response(400, {"error": {"code": 400, "message": str(e)}})
+
+    def label(self, request):
+        # Ruta con los identificadores sustituidos, para agrupar las estadísticas
+        return "/".join(":id" if ID_SEGMENT_RE.match(segment) else segment for segment in request.path.split("/"))
+
+    def is_transient(self, request):
+        return True
+
+    def quota_error(self, request):
+        return json_response(429, {"error": {"code": 429, "message": "Rate limit exceeded", "status": "RESOURCE_EXHAUSTED"}})
+
+    def route(self, request):
+        raise NotImplementedError
+
+
+def read_chunked(stream):
+    body = bytearray()
+    while True:
+        size = int(stream.readline().split(b";")[0], 16)
+        if size == 0:
+            stream.readline()
+            return bytes(body)
+        body += stream.read(size)
+        stream.readline()
+
+
+# --- Consultas de Google Drive ----------------------------------------------
+
+QUERY_TOKEN_RE = re.compile(r"\s*(?:(?P<string>'(?:\\.|[^'\\])*')|(?P<op>>=|<=|!=|=|<|>|\(|\))|(?P<word>[A-Za-z_]+))")
+QUERY_OPERATORS = {"=": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+QUERY_FIELDS = {
+    "name": "name", "title": "name", "mimeType": "mimeType", "trashed": "trashed",
+    "modifiedTime": "modified", "modifiedDate": "modified", "createdTime": "created", "createdDate": "created",
+}
+
+
+class DriveQuery:
+    """
+    Intérprete del subconjunto del lenguaje de consultas de Drive que usan los
+    scripts: comparaciones, "contains", "'id' in parents", and, or, not y paréntesis.
+    """
+
+    def __init__(self, query):
+        self.tokens = []
+        position = 0
+        query = query.strip()
+        while position < len(query):
+            match = QUERY_TOKEN_RE.match(query, position)
+            if not match or match.end() == position:
+                raise ValueError(f"Invalid query: {query}")
+            if match.group("string") is not None:
+                self.tokens.append(("string", re.sub(r"\\(.)", r"\1", match.group("string")[1:-1])))
+            elif match.group("op") is not None:
+                self.tokens.append(("op", match.group("op")))
+            else:
+                self.tokens.append(("word", match.group("word")))
+            position = match.end()
+        self.position = 0
+        self.predicate = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Invalid query: {query}")
+
+    def __call__(self, drive_file):
+        return self.predicate(drive_file)
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token == (None, None) or (expected and token != expected):
+            raise ValueError(f"Unexpected token in query: {token[1]}")
+        self.position += 1
+        return token
+
+    def parse_or(self):
+        predicates = [self.parse_and()]
+        while self.peek() == ("word", "or"):
+            self.take()
+            predicates.append(self.parse_and())
+        return lambda f: any(predicate(f) for predicate in predicates)
+
+    def parse_and(self):
+        predicates = [self.parse_factor()]
+        while self.peek() == ("word", "and"):
+            self.take()
+            predicates.append(self.parse_factor())
+        return lambda f: all(predicate(f) for predicate in predicates)
+
+    def parse_factor(self):
+        kind, value = self.take()
+        if (kind, value) == ("op", "("):
+            predicate = self.parse_or()
+            self.take(("op", ")"))
+            return predicate
+        if (kind, value) == ("word", "not"):
+            predicate = self.parse_factor()
+            return lambda f: not predicate(f)
+        if kind == "string":
+            self.take(("word", "in"))
+            self.take(("word", "parents"))
+            return lambda f: value in f["parents"]
+        if value not in QUERY_FIELDS:
+            raise ValueError(f"Invalid query field: {value}")
+        field = QUERY_FIELDS[value]
+        kind, op = self.take()
+        if (kind, op) == ("word", "contains"):
+            needle = self.take()[1].lower()
+            return lambda f: needle in f[field].lower()
+        compare = QUERY_OPERATORS[op]
+        kind, raw = self.take()
+        if field == "trashed":
+            expected = raw == "true"
+            return lambda f: compare(f["trashed"], expected)
+        if field in ("modified", "created"):
+            moment = parse_time(raw)
+            return lambda f: compare(f[field], moment)
+        return lambda f: compare(f[field], raw)
+
+
+def sort_files(files, order_by):
+    for key in reversed([part.strip() for part in (order_by or "").split(",") if part.strip()]):
+        field, _, direction = key.partition(" ")
+        files.sort(key=lambda f: f[QUERY_FIELDS[field]], reverse=direction.strip() == "desc")
+    return files
+
+
+# --- Google Drive -------------------------------------------------------------
+
+class FakeDrive(FakeServer):
+    """
+    Google Drive falso con las API v2 (PyDrive) y v3 (googleapiclient y
+    requests), las subidas reanudables, las peticiones agrupadas (batch) y el
+    endpoint de tokens OAuth de las cuentas de servicio.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.files = {}
+        self.uploads = {}  # upload_id -> sesión de subida reanudable
+
+    def new_id(self):
+        return secrets.token_hex(14)
+
+    def add_file(self, name, content=None, parent=None, mime_type="application/octet-stream",
+                 modified=None, file_id=None):
+        """
+        Crea un archivo (o una carpeta, sin contenido) y devuelve su ID.
+        """
+        file_id = file_id or self.new_id()
+        now = modified or datetime.now(timezone.utc)
+        with self.lock:
+            self.files[file_id] = {
+                "id": file_id, "name": name, "mimeType": mime_type, "parents": [parent] if parent else [],
+                "trashed": False, "created": now, "modified": now, "content": None, "md5": None,
+            }
+            if content is not None:
+                self.set_content(self.files[file_id], content, now)
+        return file_id
+
+    def add_folder(self, name):
+        return self.add_file(name, mime_type=FOLDER_MIME_TYPE)
+
+    def set_content(self, drive_file, content, modified=None):
+        drive_file["content"] = bytes(content)
+        drive_file["md5"] = hashlib.md5(drive_file["content"]).hexdigest()
+        drive_file["modified"] = modified or datetime.now(timezone.utc)
+
+    def folder_id(self, name):
+        with self.lock:
+            return next(f["id"] for f in self.files.values() if f["name"] == name and f["mimeType"] == FOLDER_MIME_TYPE)
+
+    def children(self, folder_name, trashed=False):
+        folder = self.folder_id(folder_name)
+        with self.lock:
+            return [dict(f) for f in self.files.values() if folder in f["parents"] and f["trashed"] == trashed]
+
+    def as_v3(self, f):
+        data = {
+            "kind": "drive#file", "id": f["id"], "name": f["name"], "mimeType": f["mimeType"],
+            "parents": list(f["parents"]), "trashed": f["trashed"],
+            "createdTime": rfc3339(f["created"]), "modifiedTime": rfc3339(f["modified"]),
+        }
+        if f["content"] is not None:
+            data.update(size=str(len(f["content"])), md5Checksum=f["md5"])
+        return data
+
+    def as_v2(self, f):
+        data = {
+            "kind": "drive#file", "id": f["id"], "title": f["name"], "mimeType": f["mimeType"],
+            "parents": [{"id": parent, "isRoot": False} for parent in f["parents"]],
+            "labels": {"trashed": f["trashed"]},
+            "createdDate": rfc3339(f["created"]), "modifiedDate": rfc3339(f["modified"]),
+        }
+        if f["content"] is not None:
+            data.update(
+                fileSize=str(len(f["content"])), md5Checksum=f["md5"],
+                downloadUrl=f"{GOOGLE_API_URL}drive/v2/files/{f['id']}?alt=media",
+            )
+        return data
+
+    def is_transient(self, request):
+        if request.path in ("/token", "/batch/drive/v2", "/batch") or request.query.get("alt") == "media":
+            return False
+        # Solo falla la petición que abre una subida, no el envío de sus trozos
+        return not (request.path.startswith("/upload/") and "upload_id" in request.query)
+
+    def quota_error(self, request):
+        if self.random.random() < 0.5:
+            return json_response(429, {"error": {"code": 429, "message": "Rate Limit Exceeded",
+                                                 "errors": [{"reason": "rateLimitExceeded"}]}})
+        return json_response(403, {"error": {"code": 403, "message": "User Rate Limit Exceeded",
+                                             "errors": [{"reason": "userRateLimitExceeded"}]}})
+
+    def route(self, request):
+        path, method = request.path, request.method
+        if path == "/token":
+            return json_response(200, {"access_token": secrets.token_hex(16), "expires_in": 3600, "token_type": "Bearer"})
+        if path in ("/batch/drive/v2", "/batch"):
+            return self.batch(request)
+        if path.startswith("/upload/") and "upload_id" in request.query:
+            return self.upload_chunk(request)
+        match = re.match(r"^/(upload/)?drive/(v2|v3)/files(?:/([^/]+))?(?:/(trash|untrash))?$", path)
+        if not match:
+            raise KeyError(path)
+        upload, version, file_id, action = match.groups()
+        render = self.as_v2 if version == "v2" else self.as_v3
+        if upload:
+            return self.start_upload(request, version, file_id)
+        if file_id is None and method == "GET":
+            return self.list_files(request, version)
+        if file_id is None and method == "POST":
+            return json_response(200, render(self.files[self.create_from_metadata(request.json(), version)]))
+        with self.lock:
+            drive_file = self.files[file_id]
+            if method == "GET" and request.query.get("alt") == "media":
+                return self.media(request, drive_file)
+            if method == "GET":
+                return json_response(200, render(drive_file))
+            if method == "DELETE":
+                del self.files[file_id]
+                return FakeResponse(204)
+            if action:
+                drive_file["trashed"] = action == "trash"
+                return json_response(200, render(drive_file))
+            if method in ("PATCH", "PUT"):
+                self.apply_metadata(drive_file, request.json(), version)
+                return json_response(200, render(drive_file))
+        raise KeyError(path)
+
+    def list_files(self, request, version):
+        query = request.query.get("q")
+        predicate = DriveQuery(query) if query else (lambda f: True)
+        if version == "v2":
+            page_size = min(int(request.query.get("maxResults", 100)), 1000)
+        else:
+            page_size = min(int(request.query.get("pageSize", 100)), 1000)
+        token = request.query.get("pageToken") or "0"
+        if not token.isdigit():
+            raise ValueError("Invalid pageToken")
+        start = int(token)
+        with self.lock:
+            matches = sort_files([f for f in self.files.values() if predicate(f)], request.query.get("orderBy"))
+            page = matches[start:start + page_size]
+            render = self.as_v2 if version == "v2" else self.as_v3
+            data = {"kind": "drive#fileList", ("items" if version == "v2" else "files"): [render(f) for f in page]}
+        if start + page_size < len(matches):
+            data["nextPageToken"] = str(start + page_size)
+        return json_response(200, data)
+
+    def media(self, request, drive_file):
+        content = drive_file["content"]
+        if content is None:
+            return json_response(403, {"error": {"code": 403, "message": "Only files with binary content can be downloaded"}})
+        headers = {"Content-Type": drive_file["mimeType"], "Accept-Ranges": "bytes"}
+        match = re.match(r"^bytes=(\d*)-(\d*)$", request.headers.get("Range", ""))
+        if match and match.group(0) != "bytes=-":
+            size = len(content)
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start, end = max(0, size - int(match.group(2))), size - 1
+            if start >= size:
+                return FakeResponse(416, headers={"Content-Range": f"bytes */{size}"})
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return FakeResponse(206, content[start:end + 1], headers)
+        return FakeResponse(200, content, headers)
+
+    def apply_metadata(self, drive_file, metadata, version):
+        if "name" in metadata or "title" in metadata:
+            drive_file["name"] = metadata.get("name", metadata.get("title"))
+        if "mimeType" in metadata:
+            drive_file["mimeType"] = metadata["mimeType"]
+        if "trashed" in metadata:
+            drive_file["trashed"] = bool(metadata["trashed"])
+        parents = metadata.get("parents")
+        if parents:
+            drive_file["parents"] = [parent["id"] if isinstance(parent, dict) else parent for parent in parents]
+
+    def create_from_metadata(self, metadata, version):
+        file_id = self.add_file(metadata.get("name") or metadata.get("title") or "Untitled",
+                                mime_type=metadata.get("mimeType", "application/octet-stream"))
+        with self.lock:
+            self.apply_metadata(self.files[file_id], metadata, version)
+        return file_id
+
+    def start_upload(self, request, version, file_id):
+        upload_type = request.query.get("uploadType", "media")
+        if upload_type == "multipart":
+            message = email.parser.BytesParser().parsebytes(
+                b"Content-Type: " + request.headers["Content-Type"].encode() + b"\r\n\r\n" + request.body
+            )
+            metadata_part, media_part = message.get_payload()
+            metadata, content = json.loads(metadata_part.get_payload()), media_part.get_payload(decode=True)
+        elif upload_type == "resumable":
+            upload_id = secrets.token_hex(16)
+            with self.lock:
+                self.uploads[upload_id] = {
+                    "version": version, "file_id": file_id, "metadata": request.json() if request.body else {},
+                    "size": int(request.headers.get("X-Upload-Content-Length") or -1), "data": bytearray(),
+                }
+            path = request.path if file_id is None else request.path.rsplit("/", 1)[0]
+            location = f"{GOOGLE_API_URL}{path.lstrip('/')}?uploadType=resumable&upload_id={upload_id}"
+            return FakeResponse(200, headers={"Location": location})
+        else:
+            metadata, content = {}, request.body
+        return self.finish_upload(version, file_id, metadata, content)
+
+    def finish_upload(self, version, file_id, metadata, content):
+        with self.lock:
+            if file_id is None:
+                file_id = self.create_from_metadata(metadata, version)
+            drive_file = self.files[file_id]
+            self.apply_metadata(drive_file, metadata, version)
+            self.set_content(drive_file, content)
+            render = self.as_v2 if version == "v2" else self.as_v3
+            return json_response(200, render(drive_file))
+
+    def upload_chunk(self, request):
+        with self.lock:
+            session = self.uploads[request.query["upload_id"]]
+            content_range = request.headers.get("Content-Range", "")
+            match = re.match(r"^bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)$", content_range)
+            if match and match.group(3) != "*":
+                session["size"] = int(match.group(3))
+            if match and match.group(1) is not None and int(match.group(1)) == len(session["data"]):
+                session["data"] += request.body
+            elif not match and request.body:
+                session["data"] += request.body  # subida en una sola petición, sin Content-Range
+                session["size"] = len(session["data"])
+            if len(session["data"]) == session["size"]:
+                del self.uploads[request.query["upload_id"]]
+                return self.finish_upload(session["version"], session["file_id"], session["metadata"], session["data"])
+            headers = {"Range": f"bytes=0-{len(session['data']) - 1}"} if session["data"] else {}
+            return FakeResponse(308, headers=headers)
+
+    def batch(self, request):
+        content_type = request.headers["Content-Type"]
+        message = email.parser.BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + request.body)
+        boundary = "batch_" + secrets.token_hex(8)
+        parts = []
+        for part in message.get_payload():
+            raw = part.get_payload(decode=True) or part.get_payload().encode()
+            head, _, body = raw.replace(b"\r\n", b"\n").partition(b"\n\n")
+            request_line, *header_lines = head.decode().split("\n")
+            method, url, _ = request_line.split(" ", 2)
+            url_parts = urlsplit(url)
+            headers = dict(line.split(": ", 1) for line in header_lines if ": " in line)
+            inner = FakeRequest(method, unquote(url_parts.path), dict(parse_qsl(url_parts.query)), headers, body)
+            response = self.dispatch(inner, delay=False)
+            reason = {200: "OK", 204: "No Content", 403: "Forbidden", 404: "Not Found", 429: "Too Many Requests"}.get(response.status, "Error")
+            response_headers = "".join(f"{name}: {value}\r\n" for name, value in response.headers.items())
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'].strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {response.status} {reason}\r\n{response_headers}\r\n".encode() + response.body + b"\r\n"
+            )
+        body = b"".join(parts) + f"--{boundary}--\r\n".encode()
+        return FakeResponse(200, body, {"Content-Type": f"multipart/mixed; boundary={boundary}"})
+
+
+# --- Google Sheets ------------------------------------------------------------
+
+class FakeSheets(FakeServer):
+    """
+    Google Sheets falso (API v4) con las llamadas que hace gspread para leer
+    una hoja. Cada hoja de cálculo se registra también en el Drive falso, del
+    que gspread obtiene su fecha de modificación.
+
+    Argumentos:
+        drive (FakeDrive): Drive falso donde registrar las hojas de cálculo.
+    """
+
+    def __init__(self, drive, **kwargs):
+        super().__init__(**kwargs)
+        self.drive = drive
+        self.spreadsheets = {}
+
+    def add_spreadsheet(self, spreadsheet_id, rows, title="Tareas", sheet_title="Hoja 1"):
+        """
+        Crea o sustituye una hoja de cálculo con una fila de cabecera y los registros indicados.
+
+        Argumentos:
+            rows (list): Diccionarios con los valores de cada fila; las claves del primero son la cabecera.
+        """
+        header = list(rows[0]) if rows else []
+        values = [header] + [[str(row.get(column, "")) for column in header] for row in rows]
+        with self.lock:
+            self.spreadsheets[spreadsheet_id] = {"title": title, "sheet_title": sheet_title, "values": values}
+        with self.drive.lock:
+            if spreadsheet_id in self.drive.files:
+                self.drive.files[spreadsheet_id]["modified"] = datetime.now(timezone.utc)
+            else:
+                self.drive.add_file(title, mime_type=SPREADSHEET_MIME_TYPE, file_id=spreadsheet_id)
+
+    def route(self, request):
+        match = re.match(r"^/v4/spreadsheets/([^/]+?)(?:/values/(.+))?$", request.path)
+        if not match or request.method != "GET":
+            raise KeyError(request.path)
+        with self.lock:
+            spreadsheet = self.spreadsheets[match.group(1)]
+            values = spreadsheet["values"]
+            columns = max((len(row) for row in values), default=0)
+            if match.group(2) is None:
+                return json_response(200, {
+                    "spreadsheetId": match.group(1),
+                    "properties": {"title": spreadsheet["title"], "locale": "es_ES", "timeZone": "Europe/Madrid"},
+                    "sheets": [{"properties": {
+                        "sheetId": 0, "title": spreadsheet["sheet_title"], "index": 0, "sheetType": "GRID",
+                        "gridProperties": {"rowCount": max(len(values), 1), "columnCount": max(columns, 1)},
+                    }}],
+                })
+            last_column = chr(ord("A") + max(columns, 1) - 1)
+            return json_response(200, {
+                "range": f"'{spreadsheet['sheet_title']}'!A1:{last_column}{max(len(values), 1)}",
+                "majorDimension": "ROWS",
+                "values": values,
+            })
+
+    def label(self, request):
+        return "/v4/spreadsheets/:id" + ("/values/:rango" if "/values/" in request.path else "")
+
+
+# --- Telegram -----------------------------------------------------------------
+
+class FakeTelegram(FakeServer):
+    """
+    API de bots de Telegram falsa.
+
+    Entrega a getUpdates los mensajes creados con send_user_message() y
+    guarda los mensajes que envían el bot y los scripts de notificaciones,
+    con el instante en que llegan, para medir la latencia de respuesta.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.updates = []
+        self.sent = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.condition = threading.Condition(self.lock)
+        self.polling = threading.Event()  # el bot ha pedido actualizaciones al menos una vez
+
+    def is_transient(self, request):
+        return request.path.endswith("/sendMessage")
+
+    def quota_error(self, request):
+        return json_response(429, {"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                   "parameters": {"retry_after": 1}})
+
+    def label(self, request):
+        return request.path.rsplit("/", 1)[-1]
+
+    def send_user_message(self, chat_id, text):
+        """
+        Simula un mensaje de un usuario al bot.
+
+        Returns:
+            int: ID del mensaje, con el que se reconoce la respuesta del bot.
+        """
+        with self.condition:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+            self.updates.append({
+                "update_id": self.next_update_id,
+                "message": {
+                    "message_id": message_id, "date": int(time.time()), "text": text,
+                    "chat": {"id": chat_id, "type": "private", "first_name": "bench"},
+                    "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+                },
+            })
+            self.next_update_id += 1
+            self.condition.notify_all()
+        return message_id
+
+    def wait_reply(self, message_id, timeout):
+        """
+        Espera la respuesta del bot a un mensaje.
+
+        Returns:
+            float: Instante (time.monotonic) en que llegó la respuesta, o None si no ha llegado.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for message in self.sent:
+                    if message["reply_to"] == message_id:
+                        return message["recibido"]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def messages(self):
+        with self.lock:
+            return list(self.sent)
+
+    def route(self, request):
+        match = re.match(r"^/bot[^/]+/(\w+)$", request.path)
+        if not match:
+            raise KeyError(request.path)
+        method, params = match.group(1), request.params()
+        if method == "getUpdates":
+            return self.get_updates(params)
+        if method in ("sendMessage", "editMessageText"):
+            return self.record_message(method, params)
+        if method == "getMe":
+            return json_response(200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}})
+        return json_response(200, {"ok": True, "result": True})
+
+    def get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + min(float(params.get("timeout") or 0), 30)
+        with self.condition:
+            while True:
+                pending = [update for update in self.updates if update["update_id"] >= offset]
+                remaining = deadline - time.monotonic()
+                if pending or remaining <= 0:
+                    return json_response(200, {"ok": True, "result": pending[:int(params.get("limit") or 100)]})
+                self.condition.wait(remaining)
+
+    def record_message(self, method, params):
+        reply_to = params.get("reply_to_message_id")
+        if params.get("reply_parameters"):
+            reply_parameters = params["reply_parameters"]
+            if isinstance(reply_parameters, str):
+                reply_parameters = json.loads(reply_parameters)
+            reply_to = reply_parameters.get("message_id")
+        chat_id = int(params["chat_id"]) if str(params.get("chat_id", "")).lstrip("-").isdigit() else params.get("chat_id")
+        with self.condition:
+            message_id = int(params.get("message_id") or 0) or self.next_message_id
+            if method == "sendMessage":
+                self.next_message_id += 1
+            self.sent.append({
+                "metodo": method, "chat_id": chat_id, "texto": params.get("text", ""),
+                "reply_to": int(reply_to) if reply_to else None, "recibido": time.monotonic(),
+            })
+            self.condition.notify_all()
+        return json_response(200, {"ok": True, "result": {
+            "message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+            "chat": {"id": chat_id, "type": "private"},
+        }})
+
+
+# --- Credenciales ---------------------------------------------------------------
+
+def private_key_pem():
+    """
+    Clave RSA nueva en formato PEM para firmar los tokens de la cuenta de servicio falsa.
+    """
+    try:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+    except ImportError:
+        import rsa as rsa_module  # dependencia de oauth2client y de versiones antiguas de google-auth
+        return rsa_module.newkeys(2048)[1].save_pkcs1().decode()
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+
+
+def write_credentials(path, token_uri, key_pem=None):
+    """
+    Escribe un archivo de credenciales de cuenta de servicio que obtiene sus tokens de token_uri.
+    """
+    credentials = {
+        "type": "service_account",
+        "project_id": "bench",
+        "private_key_id": secrets.token_hex(20),
+        "private_key": key_pem or private_key_pem(),
+        "client_email": "bench@bench.iam.gserviceaccount.com",
+        "client_id": "100000000000000000000",
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": token_uri,
+    }
+    with open(path, "w") as f:
+        json.dump(credentials, f)
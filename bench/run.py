@@ -0,0 +1,560 @@
+#
+# bench/run.py
+#
+# Suite de benchmarks sin conexión del sistema de gestión de scripts.
+#
+# Levanta los servidores falsos de fakes.py, prepara una instalación completa
+# en un directorio temporal (OPT_ROOT) y mide:
+#
+#   cron  cron_job.py de principio a fin con 10, 100 y 1000 filas en la hoja,
+#         en frío (primera ejecución) y en caliente (segunda ejecución, con la
+#         instantánea de la hoja y el caché de scripts ya llenos);
+#   api   el rendimiento de descarga y subida de fastapi-web.py (servido con
+#         uvicorn) y su memoria con varios clientes simultáneos;
+#   bot   la latencia de respuesta de config_telebot.py a los comandos, desde
+#         que el mensaje está disponible en getUpdates hasta que llega la
+#         respuesta a sendMessage.
+#
+# Los scripts se ejecutan en procesos aparte, como en producción. El
+# resultado es un JSON con una entrada por escenario y parámetros, que
+# "compare" enfrenta con el de otra ejecución.
+#
+# Uso:
+#     python bench/run.py [cron] [api] [bot] --salida resultados.json
+#     python bench/run.py compare base.json nuevo.json
+#
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+import fakes
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPREADSHEET_ID = "AQUI_VA_TU_ID_DE_GOOGLE_SHEET"  # el que lee cron_job.py
+BOT_SPREADSHEET_ID = "id_de_tu_google_sheet"  # el que lee config_telebot.py
+
+PERIODICITIES = ["diario", "semana laboral", "semanal", "mensual", "trimestral", "anual"]
+BOT_COMMANDS = ["/list_all", "/list_active", "/help", "hola"]
+
+# Variables de entorno de producción que no deben llegar a la instalación de pruebas
+ISOLATED_VARIABLES = (
+    "METRICS_DIR", "GOOGLE_API_QUOTA_FILE", "DOWNLOAD_CACHE_DIR", "JOB_SLOTS_DIR",
+    "WEBHOOK_URL", "TELEGRAM_WEBHOOK",
+)
+
+
+def percentile(values, fraction):
+    """
+    Percentil por el método del rango más cercano, o None si no hay valores.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def latency_summary(values):
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+        "media": sum(values) / len(values) if values else None,
+    }
+
+
+def stats_delta(before, after):
+    return {key: value - before.get(key, 0) for key, value in after.items() if value - before.get(key, 0)}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def read_rss_kib(pid, field="VmRSS"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """
+    Muestrea periódicamente la memoria residente de un proceso y guarda el máximo.
+    """
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            rss = read_rss_kib(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            if self._stop.wait(self.interval):
+                return
+
+
+class Installation:
+    """
+    Instalación de pruebas: directorio OPT_ROOT temporal, servidores falsos y
+    el entorno con el que se lanzan los scripts del sistema.
+    """
+
+    def __init__(self, args, key_pem):
+        self.root = tempfile.mkdtemp(prefix="bench-", dir=args.directorio)
+        fake_options = dict(latency=args.latencia, jitter=args.jitter, seed=args.semilla)
+        self.drive = fakes.FakeDrive(error_rate=args.errores, **fake_options).start()
+        self.sheets = fakes.FakeSheets(self.drive, error_rate=args.errores, **fake_options).start()
+        self.telegram = fakes.FakeTelegram(error_rate=args.errores_telegram, **fake_options).start()
+        for directory in ("admin", "log", "output"):
+            os.makedirs(os.path.join(self.root, directory))
+        credentials = os.path.join(self.root, "admin", "credentials.json")
+        fakes.write_credentials(credentials, self.drive.url + "token", key_pem)
+        shutil.copy(credentials, os.path.join(self.root, "credentials.json"))  # ruta que usa config_telebot.py
+        self.crontab = os.path.join(self.root, "crontab")
+        open(self.crontab, "w").close()
+        self.scripts_folder = self.drive.add_folder("Scrips_download")
+        self.output_folder = self.drive.add_folder("Output_scrips")
+
+        self.env = {key: value for key, value in os.environ.items() if key not in ISOLATED_VARIABLES}
+        self.env.update(
+            OPT_ROOT=self.root,
+            GOOGLE_API_ROOT=self.drive.url,
+            GOOGLE_SHEETS_API_ROOT=self.sheets.url,
+            TELEGRAM_API_URL=self.telegram.url.rstrip("/"),
+            TELEGRAM_BOT_TOKEN="123456:bench",
+            CRONTAB_FILE=self.crontab,
+            OUTPUT_RETENTION_DAYS="30",  # la retención está desactivada por defecto; el escenario cron la mide
+            OUTPUT_KEEP_VERSIONS="1",
+            PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])),
+        )
+        if args.google_rate is not None:
+            self.env["GOOGLE_API_RATE"] = str(args.google_rate)
+        self.keep = args.conservar
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def stats(self):
+        return {
+            "drive": self.drive.snapshot_stats(),
+            "sheets": self.sheets.snapshot_stats(),
+            "telegram": self.telegram.snapshot_stats(),
+        }
+
+    def close(self):
+        for server in (self.drive, self.sheets, self.telegram):
+            server.stop()
+        if not self.keep:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def sheet_rows(count, scripts):
+    rows = []
+    for i in range(count):
+        rows.append({
+            "IDENTIFICADOR": f"T{i:05d}",
+            "NOMBRE_SCRIPT": scripts[i % len(scripts)],
+            "LENGUAJE": "python",
+            "NOMBRE_SALIDA": f"salida_{i:05d}.txt",
+            "PERIOCIDAD": PERIODICITIES[i % len(PERIODICITIES)],
+            "HORA": f"{i % 24:02d}:{(i * 7) % 60:02d}",
+            "ACTIVA": "TRUE" if i % 10 else "FALSE",
+        })
+    return rows
+
+
+# --- cron_job.py ----------------------------------------------------------------
+
+def run_cron_job(installation):
+    """
+    Ejecuta cron_job.py en un proceso aparte y devuelve sus medidas.
+    """
+    before = installation.stats()
+    start = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_DIR, "cron_job.py")], cwd=REPO_DIR, env=installation.env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    duration = time.monotonic() - start
+    stderr = process.stderr.read().decode(errors="replace")
+    process.stderr.close()
+    try:
+        with open(installation.path("log", "cron_job_summary.json")) as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        summary = {}
+    with open(installation.crontab) as f:
+        scheduled = sum(1 for line in f if line.strip() and not line.startswith("#"))
+    result = {
+        "duracion": round(duration, 4),
+        "codigo_salida": process.returncode,
+        "resultado": summary.get("resultado"),
+        "rss_max_kib": rusage.ru_maxrss,
+        "cpu_usuario": round(rusage.ru_utime, 4),
+        "cpu_sistema": round(rusage.ru_stime, 4),
+        "etapas": {span["etapa"]: span["duracion"] for span in summary.get("etapas", [])},
+        "google_api": summary.get("google_api"),
+        "tareas_crontab": scheduled,
+        "peticiones": {name: stats_delta(before[name], after) for name, after in installation.stats().items()},
+    }
+    if summary.get("error") or process.returncode:
+        result["error"] = summary.get("error") or stderr.strip().splitlines()[-1:]
+    return result
+
+
+def bench_cron(args, key_pem):
+    results = []
+    for rows in args.filas:
+        with Installation(args, key_pem) as installation:
+            scripts = [f"tarea_{i:05d}.py" for i in range(rows)]
+            for script in scripts:
+                installation.drive.add_file(script, f"print({script!r})\n".encode(), installation.scripts_folder)
+            installation.sheets.add_spreadsheet(SPREADSHEET_ID, sheet_rows(rows, scripts))
+
+            # Salidas pendientes de subir y salidas antiguas en Drive para la política de retención
+            now = datetime.now(timezone.utc)
+            payload = random.Random(args.semilla).randbytes(64 * 1024)
+            for i in range(rows, rows + max(1, rows // 10)):
+                with open(installation.path("output", f"salida_{i:05d}.txt"), "wb") as f:
+                    f.write(payload)
+            for i in range(rows):
+                age = timedelta(days=40 if i % 10 == 0 else 1, minutes=i)
+                installation.drive.add_file(f"salida_{i:05d}.txt.gz", payload[:4096], installation.output_folder,
+                                            modified=now - age)
+
+            for run in ("fria", "caliente"):
+                result = run_cron_job(installation)
+                results.append({"escenario": "cron_job", "parametros": {"filas": rows, "ejecucion": run}, "metricas": result})
+                print(f"cron_job filas={rows} {run}: {result['duracion']:.2f} s, "
+                      f"{result['rss_max_kib'] // 1024} MiB, resultado={result['resultado']}", file=sys.stderr)
+    return results
+
+
+# --- fastapi-web.py -------------------------------------------------------------
+
+def start_api(installation, port):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fastapi-web:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=REPO_DIR, env=installation.env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"fastapi-web.py ha terminado al arrancar (código {process.returncode})")
+        try:
+            if requests.get(f"{base_url}/metrics", timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("fastapi-web.py no ha arrancado a tiempo")
+
+
+def run_clients(clients, requests_per_client, operation):
+    """
+    Ejecuta la operación con varios clientes simultáneos.
+
+    Returns:
+        tuple: (latencias, bytes transferidos, errores, segundos totales)
+    """
+    latencies, transferred, errors = [], [0], [0]
+    lock = threading.Lock()
+
+    def client(index):
+        with requests.Session() as session:
+            for i in range(requests_per_client):
+                start = time.monotonic()
+                try:
+                    size = operation(session, index, i)
+                except Exception:
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.monotonic() - start)
+                    transferred[0] += size
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    return latencies, transferred[0], errors[0], time.monotonic() - start
+
+
+def bench_api(args, key_pem):
+    results = []
+    size = args.tamano * 1024 * 1024
+    with Installation(args, key_pem) as installation:
+        content = random.Random(args.semilla).randbytes(size)
+        names = [f"salida_{i:03d}.bin" for i in range(args.archivos)]
+        for name in names:
+            installation.drive.add_file(name, content, installation.output_folder)
+        process, base_url = start_api(installation, free_port())
+        try:
+            def download(session, client, i):
+                name = names[(client + i) % len(names)]
+                received = 0
+                with session.get(f"{base_url}/download_from_Output_scrips/", params={"file_name": name},
+                                 headers={"Accept-Encoding": "identity"}, stream=True, timeout=300) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(1024 * 1024):
+                        received += len(chunk)
+                if received != size:
+                    raise ValueError(f"{name}: {received} bytes de {size}")
+                return received
+
+            def upload(session, client, i):
+                response = session.post(f"{base_url}/upload_to_Scrips_download/",
+                                        files={"file": (f"subida_{client}_{i}.bin", content, "application/octet-stream")},
+                                        timeout=300)
+                response.raise_for_status()
+                return size
+
+            # Primera descarga de cada archivo, con la caché de disco vacía
+            phases = [("descarga_fria", 1, 1, lambda session, client, i: download(session, 0, i), len(names))]
+            for clients in args.clientes:
+                phases.append(("descarga", clients, args.peticiones, download, None))
+                phases.append(("subida", clients, max(1, args.peticiones // 4), upload, None))
+            for operation_name, clients, per_client, operation, total in phases:
+                before = installation.stats()
+                with RssSampler(process.pid) as sampler:
+                    latencies, transferred, errors, duration = run_clients(clients, total or per_client, operation)
+                metrics = {
+                    "peticiones": len(latencies) + errors,
+                    "errores": errors,
+                    "duracion": round(duration, 4),
+                    "mib_por_segundo": round(transferred / duration / 1024 / 1024, 3) if duration else None,
+                    "peticiones_por_segundo": round(len(latencies) / duration, 3) if duration else None,
+                    "latencia": latency_summary(latencies),
+                    "rss_max_kib": sampler.peak,
+                    "peticiones_falsas": {name: stats_delta(before[name], after) for name, after in installation.stats().items()},
+                }
+                results.append({
+                    "escenario": "fastapi",
+                    "parametros": {"operacion": operation_name, "clientes": clients, "tamano_mib": args.tamano},
+                    "metricas": metrics,
+                })
+                print(f"fastapi {operation_name} clientes={clients}: {metrics['mib_por_segundo']} MiB/s, "
+                      f"p95 {metrics['latencia']['p95']}, {metrics['rss_max_kib']} KiB, errores={errors}", file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+# --- config_telebot.py ----------------------------------------------------------
+
+def bench_bot(args, key_pem):
+    with Installation(args, key_pem) as installation:
+        scripts = [f"tarea_{i:05d}.py" for i in range(args.filas_bot)]
+        installation.sheets.add_spreadsheet(BOT_SPREADSHEET_ID, sheet_rows(args.filas_bot, scripts))
+        env = dict(installation.env, LONG_POLLING_TIMEOUT="5", POLLING_TIMEOUT="5")
+        process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "config_telebot.py")], cwd=REPO_DIR, env=env)
+        try:
+            if not installation.telegram.polling.wait(60):
+                raise RuntimeError("config_telebot.py no ha empezado a pedir actualizaciones")
+            # Primer mensaje: espera a que el bot tenga la instantánea de la hoja
+            warmup = installation.telegram.send_user_message(1, "/start")
+            if installation.telegram.wait_reply(warmup, 60) is None:
+                raise RuntimeError("config_telebot.py no responde")
+
+            before = installation.stats()
+            sent = []
+            interval = 1.0 / args.mensajes_por_segundo if args.mensajes_por_segundo else 0
+            with RssSampler(process.pid) as sampler:
+                start = time.monotonic()
+                for i in range(args.mensajes):
+                    chat_id = 1000 + i % args.chats
+                    sent_at = time.monotonic()
+                    sent.append((installation.telegram.send_user_message(chat_id, BOT_COMMANDS[i % len(BOT_COMMANDS)]), sent_at))
+                    if interval:
+                        time.sleep(max(0.0, start + (i + 1) * interval - time.monotonic()))
+                latencies, lost = [], 0
+                for message_id, sent_at in sent:
+                    received = installation.telegram.wait_reply(message_id, max(1.0, 60 - (time.monotonic() - start)))
+                    if received is None:
+                        lost += 1
+                    else:
+                        latencies.append(received - sent_at)
+                duration = time.monotonic() - start
+        finally:
+            process.terminate()
+            process.wait()
+
+    metrics = {
+        "mensajes": args.mensajes,
+        "sin_respuesta": lost,
+        "duracion": round(duration, 4),
+        "latencia": latency_summary(latencies),
+        "rss_max_kib": sampler.peak,
+        "peticiones": {name: stats_delta(before[name], after) for name, after in installation.stats().items()},
+    }
+    print(f"bot mensajes={args.mensajes} chats={args.chats}: p50 {metrics['latencia']['p50']}, "
+          f"p95 {metrics['latencia']['p95']}, sin respuesta {lost}", file=sys.stderr)
+    return [{
+        "escenario": "bot",
+        "parametros": {"filas": args.filas_bot, "chats": args.chats, "mensajes_por_segundo": args.mensajes_por_segundo},
+        "metricas": metrics,
+    }]
+
+
+# --- Informe y comparación --------------------------------------------------------
+
+def environment_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "commit": commit or None,
+    }
+
+
+def flatten(metrics, prefix=""):
+    values = {}
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(base_path, new_path):
+    """
+    Muestra la variación de cada métrica numérica entre dos informes.
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def index(report):
+        return {(r["escenario"], json.dumps(r["parametros"], sort_keys=True)): r["metricas"] for r in report["resultados"]}
+
+    base_results, new_results = index(base), index(new)
+    for key in new_results:
+        if key not in base_results:
+            continue
+        print(f"{key[0]} {key[1]}")
+        old_values, new_values = flatten(base_results[key]), flatten(new_results[key])
+        for name in sorted(set(old_values) & set(new_values)):
+            if name.startswith(("peticiones.", "peticiones_falsas.")):
+                continue
+            old, current = old_values[name], new_values[name]
+            change = f"{(current - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"    {name:<32} {old:>14.4f} {current:>14.4f} {change:>9}")
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        parser = argparse.ArgumentParser(description="Compara dos informes de benchmarks.")
+        parser.add_argument("base", help="Informe de referencia.")
+        parser.add_argument("nuevo", help="Informe a comparar.")
+        args = parser.parse_args(sys.argv[2:])
+        compare(args.base, args.nuevo)
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmarks sin conexión con servidores falsos de Drive, Sheets y Telegram.")
+    parser.add_argument("escenarios", nargs="*", metavar="escenario",
+                        help="Escenarios a ejecutar: cron, api o bot (por defecto, todos).")
+    parser.add_argument("--salida", help="Fichero JSON de resultados (por defecto, la salida estándar).")
+    parser.add_argument("--filas", type=parse_list, default=[10, 100, 1000], help="Filas de la hoja en el escenario cron.")
+    parser.add_argument("--clientes", type=parse_list, default=[1, 8, 32], help="Clientes simultáneos en el escenario api.")
+    parser.add_argument("--peticiones", type=int, default=20, help="Descargas por cliente en el escenario api.")
+    parser.add_argument("--archivos", type=int, default=8, help="Archivos distintos que se descargan en el escenario api.")
+    parser.add_argument("--tamano", type=int, default=4, help="Tamaño en MiB de cada archivo del escenario api.")
+    parser.add_argument("--filas-bot", type=int, default=200, help="Filas de la hoja en el escenario bot.")
+    parser.add_argument("--mensajes", type=int, default=200, help="Mensajes enviados al bot.")
+    parser.add_argument("--chats", type=int, default=20, help="Chats distintos desde los que se envían los mensajes.")
+    parser.add_argument("--mensajes-por-segundo", type=float, default=50, help="Ritmo de envío de mensajes al bot (0 de golpe).")
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia de cada respuesta de los servidores falsos (s).")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Latencia aleatoria adicional máxima (s).")
+    parser.add_argument("--errores", type=float, default=0.01, help="Probabilidad de error de cuota en Drive y Sheets.")
+    parser.add_argument("--errores-telegram", type=float, default=0.0, help="Probabilidad de error 429 en sendMessage.")
+    parser.add_argument("--google-rate", type=float, default=None,
+                        help="Llamadas por segundo a Google (GOOGLE_API_RATE); por defecto, la de producción.")
+    parser.add_argument("--semilla", type=int, default=1, help="Semilla de los valores aleatorios.")
+    parser.add_argument("--directorio", default=None, help="Directorio donde crear las instalaciones temporales.")
+    parser.add_argument("--conservar", action="store_true", help="No borra las instalaciones temporales al terminar.")
+    args = parser.parse_args()
+
+    runners = {"cron": bench_cron, "api": bench_api, "bot": bench_bot}
+    scenarios = args.escenarios or list(runners)
+    for scenario in scenarios:
+        if scenario not in runners:
+            parser.error(f"escenario desconocido: {scenario}")
+    key_pem = fakes.private_key_pem()  # una sola clave para todas las instalaciones
+    report = {
+        "suite": "bench",
+        "version": 1,
+        "fecha": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "entorno": environment_info(),
+        "configuracion": {key: value for key, value in vars(args).items() if key not in ("salida", "escenarios")},
+        "resultados": [],
+    }
+    for scenario in scenarios:
+        report["resultados"].extend(runners[scenario](args, key_pem))
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+#
+# cluster.py
+#
+# Reparto de las tareas programadas entre varias máquinas (modo multinodo).
+#
+# Es opcional: se activa con CLUSTER_DIR, un directorio compartido por todos
+# los nodos (por ejemplo, un montaje NFS). En cada ejecución de cron_job.py,
+# cada nodo:
+#
+#   - publica un latido en CLUSTER_DIR/nodes/<nodo>.json; los nodos con un
+#     latido más reciente que NODE_TTL se consideran vivos;
+#   - calcula el mismo reparto que los demás: hashing consistente sobre el
+#     IDENTIFICADOR de cada fila, con nodos virtuales proporcionales al peso
+#     de cada nodo y una carga máxima por nodo según la columna PESO de las
+#     filas. La columna NODO fija una fila a un nodo mientras esté vivo;
+#   - actualiza en CLUSTER_DIR/leases.json, con un fichero de bloqueo, la
+#     concesión de cada tarea. Un nodo solo instala en su crontab las tareas
+#     cuya concesión tiene. Si una tarea pasa a otro nodo, el antiguo la cede
+#     y la mantiene hasta que el nuevo la reclama, así que no queda ningún
+#     hueco sin programar.
+#
+# job_runner.py comprueba la concesión antes de ejecutar cada tarea, de modo
+# que nunca corre en dos nodos aunque durante un cambio de reparto esté en
+# los dos crontabs. Si un nodo deja de ejecutar cron_job.py, su latido y sus
+# concesiones caducan y los demás se quedan con sus tareas.
+#
+# Formato de leases.json:
+#     {"<IDENTIFICADOR>": {"nodo": "a", "expira": 1700000000.0, "cedida": "b"}}
+#
+
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+import metrics
+
+# Directorio compartido por los nodos; sin él, cron_job.py programa todas las tareas en esta máquina
+CLUSTER_DIR = os.environ.get("CLUSTER_DIR") or None
+NODE_NAME = os.environ.get("CLUSTER_NODE") or socket.gethostname()  # nombre de este nodo
+NODE_WEIGHT = float(os.environ.get("CLUSTER_NODE_WEIGHT", 1))  # capacidad relativa de este nodo
+
+# Programación de cron_job.py en modo multinodo: el reparto se revisa con esta frecuencia
+CLUSTER_SCHEDULE = os.environ.get("CLUSTER_SCHEDULE", "*/15 * * * *")
+NODE_TTL = int(os.environ.get("CLUSTER_NODE_TTL", 45 * 60))  # segundos sin latido para dar un nodo por caído
+LEASE_TTL = int(os.environ.get("CLUSTER_LEASE_TTL", NODE_TTL))  # segundos de validez de cada concesión
+
+VIRTUAL_NODES = 64  # puntos del anillo por unidad de peso de un nodo
+LOAD_FACTOR = 1.25  # carga máxima de un nodo respecto a la que le corresponde por su peso
+LOCK_TIMEOUT = 30  # segundos esperando el bloqueo de leases.json
+LOCK_STALE = 120  # segundos tras los que un bloqueo abandonado se elimina
+LOCK_REFRESH = LOCK_STALE / 4  # segundos entre renovaciones del bloqueo mientras se tiene
+READ_ATTEMPTS = 3  # lecturas de leases.json antes de darlo por ilegible
+READ_RETRY_DELAY = 1.0  # segundos entre lecturas
+
+
+def enabled():
+    """
+    Indica si el modo multinodo está activado.
+    """
+    return CLUSTER_DIR is not None
+
+
+def ring_hash(value):
+    """
+    Posición de un valor en el anillo de hashing consistente.
+    """
+    return int.from_bytes(hashlib.sha1(str(value).encode("utf-8")).digest()[:8], "big")
+
+
+def heartbeat(node=NODE_NAME, weight=NODE_WEIGHT, cluster_dir=CLUSTER_DIR):
+    """
+    Publica el latido de este nodo.
+    """
+    metrics.write_json(os.path.join(cluster_dir, "nodes", f"{node}.json"),
+                       {"nodo": node, "peso": weight, "latido": time.time()})
+
+
+def leave(node=NODE_NAME, cluster_dir=CLUSTER_DIR):
+    """
+    Retira el latido de este nodo para que los demás se queden con sus tareas en su siguiente ejecución.
+    """
+    try:
+        os.remove(os.path.join(cluster_dir, "nodes", f"{node}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def alive_nodes(cluster_dir=CLUSTER_DIR, ttl=NODE_TTL, now=None):
+    """
+    Nodos con un latido reciente.
+
+    Returns:
+        dict: Peso de cada nodo vivo, indexado por su nombre.
+    """
+    now = now or time.time()
+    nodes = {}
+    directory = os.path.join(cluster_dir, "nodes")
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return nodes
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if now - data.get("latido", 0) <= ttl and data.get("peso", 1) > 0:
+            nodes[data["nodo"]] = float(data.get("peso", 1))
+    return nodes
+
+
+def assign(rows, nodes, load_factor=LOAD_FACTOR):
+    """
+    Reparte las filas entre los nodos con hashing consistente de carga acotada.
+
+    Cada fila va al primer nodo del anillo, a partir del hash de su
+    identificador, que todavía tiene capacidad para su peso. La capacidad de
+    cada nodo es load_factor veces la parte del peso total que le corresponde
+    según su propio peso. Todos los nodos obtienen el mismo resultado con las
+    mismas entradas, y al entrar o salir un nodo solo cambian de sitio las
+    filas que le corresponden.
+
+    Argumentos:
+        rows (list): Tuplas (identificador, peso, nodo fijado o None).
+        nodes (dict): Peso de cada nodo vivo.
+        load_factor (float): Holgura de la capacidad de cada nodo.
+
+    Returns:
+        dict: Nodo asignado a cada identificador.
+    """
+    if not nodes:
+        return {}
+    ring = sorted((ring_hash(f"{node}#{i}"), node)
+                  for node, weight in nodes.items()
+                  for i in range(max(1, round(VIRTUAL_NODES * weight))))
+    positions = [position for position, _ in ring]
+    total_rows = sum(weight for _, weight, _ in rows)
+    total_nodes = sum(nodes.values())
+    capacity = {node: load_factor * total_rows * weight / total_nodes for node, weight in nodes.items()}
+    load = dict.fromkeys(nodes, 0.0)
+    assignment = {}
+
+    # Primero las filas fijadas a un nodo vivo y después el resto, de las más pesadas a las más ligeras
+    for job_id, weight, pinned in rows:
+        if pinned in nodes:
+            assignment[job_id] = pinned
+            load[pinned] += weight
+    pending = sorted((row for row in rows if row[0] not in assignment), key=lambda row: (-row[1], row[0]))
+    for job_id, weight, _ in pending:
+        start = bisect.bisect(positions, ring_hash(job_id))
+        chosen = None
+        tried = set()
+        for i in range(len(ring)):
+            node = ring[(start + i) % len(ring)][1]
+            if node in tried:
+                continue
+            tried.add(node)
+            chosen = chosen or node  # si ningún nodo tiene sitio, el primero del anillo
+            if load[node] + weight <= capacity[node]:
+                chosen = node
+                break
+            if len(tried) == len(nodes):
+                break
+        assignment[job_id] = chosen
+        load[chosen] += weight
+    return assignment
+
+
+def read_lock_token(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def remove_lock(path, token):
+    """
+    Elimina el fichero de bloqueo solo si todavía contiene token.
+
+    El fichero se aparta primero con un renombrado atómico; si resulta que
+    otro proceso lo había tomado entretanto, se vuelve a poner en su sitio.
+
+    Returns:
+        bool: True si se ha eliminado el bloqueo con ese token.
+    """
+    aside = f"{path}.{uuid.uuid4().hex}"
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        return False
+    if read_lock_token(aside) != token:
+        try:
+            os.link(aside, path)  # no sobrescribe un bloqueo creado después
+        except OSError:
+            pass
+        os.remove(aside)
+        return False
+    os.remove(aside)
+    return True
+
+
+class ClusterLock:
+    """
+    Bloqueo exclusivo de leases.json entre nodos, con un fichero creado de forma atómica.
+
+    El fichero contiene un token único de quien lo tiene. Mientras se tiene,
+    un hilo renueva su fecha de modificación cada LOCK_REFRESH segundos para
+    que los demás nodos no lo den por abandonado, y al liberarlo solo se
+    elimina si el token sigue siendo el propio. Si otro proceso lo ha
+    tomado entretanto, lost queda activado.
+
+    Argumentos:
+        cluster_dir (str): Directorio compartido por los nodos.
+        timeout (float): Segundos esperando el bloqueo.
+    """
+
+    def __init__(self, cluster_dir=CLUSTER_DIR, timeout=LOCK_TIMEOUT):
+        self.path = os.path.join(cluster_dir, "leases.lock")
+        self.timeout = timeout
+        self.token = f"{NODE_NAME} {os.getpid()} {uuid.uuid4().hex}\n"
+        self.lost = threading.Event()
+        self._released = threading.Event()
+        self._refresher = None
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                break
+            except FileExistsError:
+                token = read_lock_token(self.path)
+                try:
+                    stale = time.time() - os.path.getmtime(self.path) > LOCK_STALE
+                except FileNotFoundError:
+                    continue
+                if stale and token is not None:
+                    remove_lock(self.path, token)  # bloqueo de un proceso que murió sin liberarlo
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"No se pudo bloquear {self.path}")
+                time.sleep(0.1)
+        try:
+            os.write(fd, self.token.encode())
+        finally:
+            os.close(fd)
+        self._refresher = threading.Thread(target=self._refresh, daemon=True)
+        self._refresher.start()
+
+    def release(self):
+        self._released.set()
+        self._refresher.join()
+        if not remove_lock(self.path, self.token):
+            self.lost.set()
+
+    def _refresh(self):
+        while not self._released.wait(LOCK_REFRESH):
+            if read_lock_token(self.path) != self.token:
+                self.lost.set()
+                return
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def read_leases(cluster_dir=CLUSTER_DIR, attempts=READ_ATTEMPTS):
+    """
+    Lee las concesiones, reintentando los fallos transitorios (por ejemplo, del montaje compartido).
+
+    Returns:
+        dict: Concesiones indexadas por identificador; vacío si todavía no se ha creado leases.json.
+
+    Raises:
+        OSError, ValueError: Si el fichero sigue sin poder leerse tras todos los intentos.
+    """
+    path = os.path.join(cluster_dir, "leases.json")
+    for attempt in range(attempts):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            if os.path.isdir(cluster_dir):
+                return {}
+            if attempt == attempts - 1:
+                raise
+        except (OSError, ValueError):
+            if attempt == attempts - 1:
+                raise
+        time.sleep(READ_RETRY_DELAY)
+
+
+def update_leases(assignment, alive, node=NODE_NAME, cluster_dir=CLUSTER_DIR, ttl=LEASE_TTL,
+                  dry_run=False, now=None):
+    """
+    Renueva, reclama, cede y libera las concesiones de este nodo según el reparto.
+
+    - Las tareas asignadas a este nodo se reclaman si no tienen concesión, si
+      ha caducado, si su dueño ya no está vivo o si su dueño se la ha cedido.
+    - Las tareas de este nodo asignadas ahora a otro se ceden: siguen siendo
+      de este nodo hasta que el nuevo las reclama.
+    - Las tareas de este nodo que ya no existen se liberan.
+
+    Argumentos:
+        assignment (dict): Nodo asignado a cada tarea activa.
+        alive (dict): Nodos vivos.
+        dry_run (bool): Calcula el resultado sin bloquear leases.json ni guardar los cambios.
+
+    Returns:
+        tuple: (tareas cuya concesión tiene este nodo, {tarea: nodo que la tiene}
+            para las asignadas a este nodo que todavía no se han podido reclamar).
+    """
+    now = now or time.time()
+    with (nullcontext() if dry_run else ClusterLock(cluster_dir)) as lock:
+        leases = read_leases(cluster_dir)
+        owned = set()
+        blocked = {}
+        for job_id, assigned in assignment.items():
+            lease = leases.get(job_id)
+            valid = lease is not None and lease["expira"] > now and lease["nodo"] in alive
+            if assigned == node:
+                if not valid or lease["nodo"] == node or lease.get("cedida") == node:
+                    leases[job_id] = {"nodo": node, "expira": now + ttl}
+                    owned.add(job_id)
+                else:
+                    blocked[job_id] = lease["nodo"]
+            elif valid and lease["nodo"] == node:
+                leases[job_id] = {"nodo": node, "expira": now + ttl, "cedida": assigned}
+                owned.add(job_id)
+        for job_id in [job_id for job_id, lease in leases.items()
+                       if job_id not in assignment and (lease["nodo"] == node or lease["expira"] <= now)]:
+            del leases[job_id]
+        if not dry_run:
+            if lock.lost.is_set():
+                raise TimeoutError(f"Se ha perdido el bloqueo {lock.path}; no se guardan las concesiones")
+            metrics.write_json(os.path.join(cluster_dir, "leases.json"), leases)
+    return owned, blocked
+
+
+def renew_leases(node=NODE_NAME, cluster_dir=CLUSTER_DIR, ttl=LEASE_TTL, now=None):
+    """
+    Extiende las concesiones vigentes de este nodo sin recalcular el reparto.
+
+    cron_job.py la llama al empezar, antes de leer la hoja: si la lectura o
+    el reparto fallan, las tareas de este nodo siguen teniendo concesión.
+
+    Returns:
+        int: Concesiones renovadas.
+    """
+    now = now or time.time()
+    with ClusterLock(cluster_dir) as lock:
+        leases = read_leases(cluster_dir)
+        renewed = 0
+        for lease in leases.values():
+            if lease["nodo"] == node and lease["expira"] > now:
+                lease["expira"] = now + ttl
+                renewed += 1
+        if renewed:
+            if lock.lost.is_set():
+                raise TimeoutError(f"Se ha perdido el bloqueo {lock.path}; no se guardan las concesiones")
+            metrics.write_json(os.path.join(cluster_dir, "leases.json"), leases)
+    return renewed
+
+
+def lease_state(job_id, node=NODE_NAME, cluster_dir=CLUSTER_DIR, now=None):
+    """
+    Estado de la concesión de una tarea para este nodo.
+
+    Returns:
+        str: "propia" si este nodo la tiene vigente, "ajena" si la tiene otro
+            nodo y "caducada" si no existe o ha caducado.
+
+    Raises:
+        OSError, ValueError: Si leases.json no se puede leer.
+    """
+    lease = read_leases(cluster_dir).get(str(job_id))
+    if lease is None or lease["expira"] <= (now or time.time()):
+        return "caducada"
+    return "propia" if lease["nodo"] == node else "ajena"
+
+
+def is_leader(alive, node=NODE_NAME):
+    """
+    Indica si este nodo hace las tareas comunes a todo el clúster (el primero de los vivos por nombre).
+    """
+    return not alive or node == min(alive)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estado del reparto de tareas entre nodos.")
+    parser.add_argument("--salir", action="store_true", help="Retira este nodo del reparto.")
+    args = parser.parse_args()
+    if not enabled():
+        parser.error("El modo multinodo no está activado (CLUSTER_DIR).")
+    if args.salir:
+        leave()
+        print(f"Nodo {NODE_NAME} retirado; los demás se quedarán con sus tareas en su siguiente ejecución.")
+    else:
+        alive = alive_nodes()
+        leases = read_leases()
+        now = time.time()
+        for node, weight in sorted(alive.items()):
+            count = sum(1 for lease in leases.values() if lease["nodo"] == node and lease["expira"] > now)
+            ceded = sum(1 for lease in leases.values() if lease["nodo"] == node and lease.get("cedida"))
+            print(f"{node}\tpeso {weight:g}\t{count} tareas\t{ceded} cedidas")
+        orphans = sum(1 for lease in leases.values() if lease["nodo"] not in alive or lease["expira"] <= now)
+        if orphans:
+            print(f"Concesiones caducadas o de nodos caídos: {orphans}")
@@ -0,0 +1,101 @@
+#
+# compression.py
+#
+# Compresión de los archivos de salida que se suben a Google Drive.
+#
+# La comparten output_uploader.py (que comprime al subir) y fastapi-web.py
+# (que descomprime al descargar si el cliente no admite la codificación). Los
+# archivos comprimidos se guardan en Drive con la extensión del método (.gz o
+# .zst) añadida a su nombre original. zstd solo está disponible si el paquete
+# zstandard está instalado; gzip usa únicamente la biblioteca estándar.
+#
+
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd es opcional
+    zstandard = None
+
+CHUNK_SIZE = 1024 * 1024
+
+# Extensión y codificación HTTP (Content-Encoding) de cada método
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+MIME_TYPES = {"gzip": "application/gzip", "zstd": "application/zstd"}
+
+
+def available_methods():
+    """
+    Métodos de compresión que se pueden usar en esta máquina.
+    """
+    return [method for method in SUFFIXES if method != "zstd" or zstandard is not None]
+
+
+def check_method(method):
+    """
+    Comprueba que el método de compresión es conocido y está disponible.
+
+    Argumentos:
+        method (str): "gzip", "zstd" o None (sin compresión).
+
+    Raises:
+        ValueError: Si el método no existe o falta su dependencia.
+    """
+    if method and method not in available_methods():
+        raise ValueError(f"Método de compresión no disponible: {method}")
+
+
+def compressed_name(file_name, method):
+    """
+    Nombre con el que se guarda en Drive un archivo comprimido con el método indicado.
+    """
+    return f"{file_name}{SUFFIXES[method]}" if method else file_name
+
+
+def compress_file(source_path, destination, method):
+    """
+    Comprime un archivo trozo a trozo, sin cargarlo entero en memoria.
+
+    Argumentos:
+        source_path (str): Archivo a comprimir.
+        destination (file): Archivo binario abierto donde escribir el resultado.
+        method (str): "gzip" o "zstd".
+    """
+    check_method(method)
+    with open(source_path, "rb") as source:
+        if method == "gzip":
+            with gzip.GzipFile(fileobj=destination, mode="wb") as writer:
+                while chunk := source.read(CHUNK_SIZE):
+                    writer.write(chunk)
+        else:
+            writer = zstandard.ZstdCompressor().stream_writer(destination, closefd=False)
+            with writer:
+                while chunk := source.read(CHUNK_SIZE):
+                    writer.write(chunk)
+
+
+def iter_decompressed(chunks, method):
+    """
+    Descomprime al vuelo una secuencia de trozos comprimidos.
+
+    Argumentos:
+        chunks (iterable): Trozos (bytes) del archivo comprimido.
+        method (str): "gzip" o "zstd".
+
+    Yields:
+        bytes: Trozos del contenido original.
+    """
+    check_method(method)
+    if method == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)  # cabecera gzip
+    else:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if method == "gzip":
+        data = decompressor.flush()
+        if data:
+            yield data
@@ -1,10 +1,66 @@
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+import requests
 import telebot
-from telebot.types import KeyboardButton, ReplyKeyboardMarkup
+from telebot import apihelper
+from telebot.apihelper import ApiTelegramException
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, Update
+from fastapi import FastAPI, Request, HTTPException
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from sheet_snapshot import SheetSnapshot, SNAPSHOT_PATH
+import schedule_forecast
+import run_history
+import google_api
+import metrics
+import paths
 
-# Token de acceso del bot de Telegram
-TOKEN = "tu_token"
+# Token de acceso del bot de Telegram (TELEGRAM_BOT_TOKEN lo sustituye, p. ej. en la suite de benchmarks)
+TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "tu_token")
+
+# URL de la API de Telegram; se puede apuntar a un servidor local falso para pruebas
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL.rstrip("/") + "/bot{0}/{1}"
+
+# Sesión HTTP de las llamadas del bot a Telegram, medidas por método en las métricas
+telegram_session = requests.Session()
+
+
+def send_telegram_request(method, url, **kwargs):
+    with metrics.timer("telegram_request_seconds", metodo=url.rsplit("/", 1)[-1]):
+        return telegram_session.request(method, url, **kwargs)
+
+
+apihelper.CUSTOM_REQUEST_SENDER = send_telegram_request
+
+# Configuración del procesamiento de actualizaciones
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", 8))  # hilos que atienden actualizaciones
+BOT_QUEUE_SIZE = int(os.environ.get("BOT_QUEUE_SIZE", 100))  # actualizaciones pendientes por hilo
+POLLING_TIMEOUT = int(os.environ.get("POLLING_TIMEOUT", 10))  # segundos de timeout de conexión
+LONG_POLLING_TIMEOUT = int(os.environ.get("LONG_POLLING_TIMEOUT", 50))  # segundos que Telegram retiene cada getUpdates
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # URL pública del webhook, p. ej. https://host/telegram/webhook
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")  # secreto que Telegram envía en cada petición
+
+# Configuración de los listados de /list_all y /list_active
+LIST_PAGE_ROWS = int(os.environ.get("BOT_LIST_PAGE_ROWS", 25))  # tareas por página
+LIST_PAGE_CHARS = 3500  # caracteres por página, por debajo del límite de 4096 de Telegram con la cabecera y el pie
+LIST_STATUSES = ("activas", "desactivadas")  # filtros de estado de /list_all
+LIST_CALLBACK_PREFIX = "lst|"  # prefijo del callback_data de los botones de página
+
+# Configuración del comando /forecast
+FORECAST_HOURS = 24  # horas consultadas si no se indican
+FORECAST_PEAKS = 5  # minutos con más carga mostrados
+FORECAST_RUNS = 20  # próximas ejecuciones mostradas
+
+# Configuración del comando /status
+STATUS_DAYS = 7  # días del histórico consultados
+STATUS_RUNS = 5  # últimas ejecuciones y fallos mostrados
 
 # Configura los alcances (scopes) para Google Sheets
 scopes_sheets = [
@@ -14,17 +70,32 @@ scopes_sheets = [
 
 # Configuramos las credenciales de Google Sheets API desde el archivo JSON
 creds_sheets = ServiceAccountCredentials.from_json_keyfile_name(
-    "/opt/credentials.json", scopes_sheets
+    os.path.join(paths.OPT_ROOT, "credentials.json"), scopes_sheets
 )
 
 # Autorizamos el cliente de Google Sheets
-client_sheets = gspread.authorize(creds_sheets)
+client_sheets = google_api.redirect_client(gspread.authorize(creds_sheets))
 
 # ID de la hoja de cálculo de Google Sheets
 spreadsheet_id = "id_de_tu_google_sheet"
 
+# Instantánea de la hoja refrescada en segundo plano; los comandos responden desde memoria
+sheet_snapshot = SheetSnapshot(client_sheets, spreadsheet_id, path=SNAPSHOT_PATH)
+
+
+# Función para indicar la antigüedad de los datos de la instantánea
+def snapshot_age_text():
+    """
+    Devuelve una línea indicando la antigüedad de los datos mostrados.
+    """
+    age = sheet_snapshot.age()
+    if age is None:
+        return "Datos sin confirmar con la hoja de cálculo"
+    return f"Datos actualizados hace {int(age)} s"
+
 # Inicializar el bot con el token de Telegram proporcionado
-bot = telebot.TeleBot(TOKEN)
+# Las actualizaciones se reparten con UpdateDispatcher, así que el bot no usa su propio pool de hilos
+bot = telebot.TeleBot(TOKEN, threaded=False)
 
 # Crear un teclado personalizado con los comandos disponibles
 commands_keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
@@ -32,6 +103,8 @@ commands_keyboard.add(KeyboardButton("/start"))
 commands_keyboard.add(KeyboardButton("/help"))
 commands_keyboard.add(KeyboardButton("/list_all"))
 commands_keyboard.add(KeyboardButton("/list_active"))
+commands_keyboard.add(KeyboardButton("/forecast"))
+commands_keyboard.add(KeyboardButton("/status"))
 
 
 # Función para manejar el comando /start
@@ -64,13 +137,183 @@ def help_command(message):
         """
         /start - Iniciar el bot
         /help - Mostrar esta ayuda
-        /list_all - Listar todas las tareas
-        /list_active - Listar todas las tareas activas
+        /list_all [periodicidad] [activas | desactivadas] - Listar todas las tareas
+        /list_active [periodicidad] - Listar todas las tareas activas
+        /forecast [horas | AAAA-MM-DD] - Previsión de ejecuciones y minutos con más carga
+        /status [identificador] - Duraciones y fallos recientes de una tarea o de todas
         """,
         reply_markup=commands_keyboard
     )
 
 
+class TaskListings:
+    """
+    Páginas ya compuestas de los listados de tareas.
+
+    Las líneas de cada fila se componen una sola vez por cada copia de la
+    hoja, y las páginas de cada combinación de listado y filtros la primera
+    vez que se piden; el refresco en segundo plano de la instantánea compone
+    además los listados sin filtros en cuanto cambia la hoja. Así cada
+    comando o cambio de página solo busca una página ya compuesta, tenga la
+    hoja las filas que tenga. Cada página cabe en un mensaje de Telegram.
+
+    Argumentos:
+        snapshot (SheetSnapshot): Instantánea de la hoja de cálculo.
+        page_rows (int): Tareas por página como máximo.
+        page_chars (int): Caracteres por página como máximo.
+    """
+
+    def __init__(self, snapshot, page_rows=LIST_PAGE_ROWS, page_chars=LIST_PAGE_CHARS):
+        self.snapshot = snapshot
+        self.page_rows = page_rows
+        self.page_chars = page_chars
+        self.records = None
+        self.rows = []
+        self.pages = {}
+        self._lock = threading.Lock()
+        snapshot.add_listener(self.update)
+
+    def update(self, records):
+        """
+        Compone las líneas de una nueva copia de la hoja y los listados sin filtros.
+        """
+        with self._lock:
+            if records is self.records:
+                return
+            rows = []
+            for row in records or []:
+                if not row["IDENTIFICADOR"]:  # Verifica que el identificador no esté vacío
+                    continue
+                active = row["ACTIVA"] == "TRUE"
+                line = f"{row['IDENTIFICADOR']}: {row['PERIOCIDAD']} a las {row['HORA']}"
+                rows.append((active, str(row["PERIOCIDAD"]).lower(), line))
+            self.records = records
+            self.rows = rows
+            self.pages = {}
+            for key in (("all", None, None), ("active", "activas", None)):
+                self.pages[key] = self._render(*key)
+
+    def get_pages(self, kind, status=None, periodicity=None):
+        """
+        Páginas de un listado.
+
+        Argumentos:
+            kind (str): "all" (con el estado de cada tarea) o "active".
+            status (str): "activas", "desactivadas" o None.
+            periodicity (str): Periodicidad en minúsculas o None.
+
+        Returns:
+            list: Texto de cada página; vacía si ninguna tarea cumple los filtros.
+        """
+        records = self.snapshot.get_records()
+        if records is not self.records:
+            self.update(records)
+        key = (kind, status, periodicity)
+        with self._lock:
+            pages = self.pages.get(key)
+            if pages is None:
+                pages = self.pages[key] = self._render(*key)
+            return pages
+
+    def _render(self, kind, status, periodicity):
+        pages, lines, size = [], [], 0
+        for active, row_periodicity, line in self.rows:
+            if status is not None and active != (status == "activas"):
+                continue
+            if periodicity is not None and row_periodicity != periodicity:
+                continue
+            if kind == "all":
+                line += " - Activado" if active else " - Desactivado"
+            line = line[:self.page_chars]
+            if lines and (len(lines) >= self.page_rows or size + len(line) + 1 > self.page_chars):
+                pages.append("\n".join(lines))
+                lines, size = [], 0
+            lines.append(line)
+            size += len(line) + 1
+        if lines:
+            pages.append("\n".join(lines))
+        return pages
+
+
+task_listings = TaskListings(sheet_snapshot)
+
+
+# Función para interpretar los filtros de los comandos de listado
+def parse_list_filters(text, kind):
+    """
+    Devuelve el estado y la periodicidad indicados tras el comando, p. ej.
+    "/list_all mensual" o "/list_all desactivadas".
+
+    Raises:
+        ValueError: Si el filtro no es un estado ni una periodicidad.
+    """
+    status = "activas" if kind == "active" else None
+    periodicity = None
+    argument = " ".join(text.split()[1:]).lower()
+    if not argument:
+        return status, periodicity
+    for word in LIST_STATUSES:
+        if kind == "all" and (argument == word or argument.endswith(" " + word)):
+            status = word
+            argument = argument[:-len(word)].strip()
+            break
+    if argument:
+        if argument not in schedule_forecast.PERIODICITY_SCHEDULES:
+            raise ValueError(argument)
+        periodicity = argument
+    return status, periodicity
+
+
+# Función para componer el mensaje y el teclado de una página de un listado
+def list_page_message(kind, status, periodicity, page):
+    """
+    Devuelve el texto y el teclado de una página, o (None, None) si no hay tareas.
+
+    Los botones de la página anterior y siguiente llevan el listado, los
+    filtros y la página en su callback_data, así que no hace falta guardar
+    ningún estado por chat.
+    """
+    pages = task_listings.get_pages(kind, status, periodicity)
+    if not pages:
+        return None, None
+    page = max(0, min(page, len(pages) - 1))  # la hoja puede haber cambiado desde que se envió el mensaje
+    filters = ", ".join(value for value in (periodicity, status if kind == "all" else None) if value)
+    title = ("Tareas" if kind == "all" else "Tareas activas") + (f" ({filters})" if filters else "")
+    text = f"{title} - página {page + 1}/{len(pages)}\n\n{pages[page]}\n\n{snapshot_age_text()}"
+    if len(pages) == 1:
+        return text, commands_keyboard
+    callback = f"{LIST_CALLBACK_PREFIX}{kind}|{status or ''}|{periodicity or ''}|"
+    keyboard = InlineKeyboardMarkup()
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("« Anterior", callback_data=f"{callback}{page - 1}"))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{len(pages)}", callback_data=f"{callback}{page}"))
+    if page < len(pages) - 1:
+        buttons.append(InlineKeyboardButton("Siguiente »", callback_data=f"{callback}{page + 1}"))
+    keyboard.row(*buttons)
+    return text, keyboard
+
+
+# Función común de los comandos /list_all y /list_active
+def send_listing(message, kind, empty_text):
+    """
+    Envía la primera página de un listado, con los filtros indicados tras el comando.
+    """
+    try:
+        status, periodicity = parse_list_filters(message.text, kind)
+    except ValueError as e:
+        options = ", ".join(list(LIST_STATUSES if kind == "all" else ()) + list(schedule_forecast.PERIODICITY_SCHEDULES))
+        bot.reply_to(message, f"Filtro no reconocido: {str(e)}. Opciones: {options}", reply_markup=commands_keyboard)
+        return
+    try:
+        text, keyboard = list_page_message(kind, status, periodicity, 0)
+        if text is None and len(message.text.split()) > 1:
+            empty_text = "Ninguna tarea cumple los filtros indicados"
+        bot.reply_to(message, text or empty_text, reply_markup=keyboard or commands_keyboard)
+    except Exception as e:
+        bot.reply_to(message, f"Error al consultar los registros: {str(e)}", reply_markup=commands_keyboard)
+
+
 # Función para manejar el comando /list_all
 @bot.message_handler(commands=["list_all"])
 def list_all(message):
@@ -78,36 +321,11 @@ def list_all(message):
     Gestor de mensajes para el comando /list_all.
 
     Lista todas las tareas almacenadas en la hoja de cálculo,
-    incluyendo las que están activas o desactivadas.
+    incluyendo las que están activas o desactivadas, por páginas.
+    Admite filtrar por estado y por periodicidad: /list_all mensual activas
 
     """
-    try:
-        # Abrir la hoja de cálculo y obtener todos los registros
-        sheet = client_sheets.open_by_key(spreadsheet_id).sheet1
-        data = sheet.get_all_records()
-
-        if not data:
-            bot.reply_to(message, "No existen registros")
-        else:
-            # Construir lista de información de programas con identificador no vacío
-            programs_info = []
-            for row in data:
-                if row["IDENTIFICADOR"]:  # Verifica que el identificador no esté vacío
-                    status = "Activado" if row["ACTIVA"] == "TRUE" else "Desactivado"
-                    program_info = f"{row['IDENTIFICADOR']}: {row['PERIOCIDAD']} a las {row['HORA']} - {status}"
-                    programs_info.append(program_info)
-
-            # Construir el mensaje final
-            if programs_info:
-                reply_message = "\n".join(programs_info)
-                bot.reply_to(message, reply_message, reply_markup=commands_keyboard)
-
-    except Exception as e:
-        bot.reply_to(
-            message,
-            f"Error al consultar los registros: {str(e)}",
-            reply_markup=commands_keyboard,
-        )
+    send_listing(message, "all", "No existen registros")
 
 
 # Función para manejar el comando /list_active
@@ -116,35 +334,160 @@ def list_active(message):
     """
     Gestor de mensajes para el comando /list_active.
 
-    Lista solo las tareas activas (ACTIVA='TRUE') almacenadas en la hoja de cálculo.
+    Lista solo las tareas activas (ACTIVA='TRUE') almacenadas en la hoja de cálculo,
+    por páginas. Admite filtrar por periodicidad: /list_active diario
+
+    """
+    send_listing(message, "active", "No hay filas activas")
+
 
+# Función para manejar los botones de cambio de página de los listados
+@bot.callback_query_handler(func=lambda call: (call.data or "").startswith(LIST_CALLBACK_PREFIX))
+def list_page_callback(call):
+    """
+    Gestor de los botones de los listados.
+
+    Sustituye el texto del mensaje por la página pedida en lugar de enviar
+    un mensaje nuevo.
     """
     try:
-        # Abrir la hoja de cálculo y obtener todos los registros
-        sheet = client_sheets.open_by_key(spreadsheet_id).sheet1
-        data = sheet.get_all_records()
+        kind, status, periodicity, page = call.data[len(LIST_CALLBACK_PREFIX):].split("|")
+        text, keyboard = list_page_message(kind, status or None, periodicity or None, int(page))
+        if text is None:
+            bot.answer_callback_query(call.id, "El listado ya no tiene tareas")
+            return
+        if text != call.message.text:
+            bot.edit_message_text(text, call.message.chat.id, call.message.message_id,
+                                  reply_markup=keyboard if isinstance(keyboard, InlineKeyboardMarkup) else None)
+        bot.answer_callback_query(call.id)
+    except ApiTelegramException as e:
+        if "message is not modified" not in str(e):
+            logging.error(f"Error al cambiar de página: {str(e)}")
+        bot.answer_callback_query(call.id)
+    except Exception as e:
+        logging.error(f"Error al cambiar de página: {str(e)}")
+        bot.answer_callback_query(call.id, "Error al consultar los registros")
 
-        if not data:
-            bot.reply_to(
-                message, "No existen registros activos", reply_markup=commands_keyboard
-            )
+
+# Función para obtener la previsión de ejecuciones
+def get_forecast():
+    """
+    Devuelve la previsión del índice guardado por cron_job.py o, si todavía
+    no existe, la calculada a partir de las filas activas de la instantánea.
+    """
+    forecast = schedule_forecast.load_forecast()
+    if forecast is None:
+        rows = [row for row in sheet_snapshot.get_records() if row["ACTIVA"] == "TRUE"]
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        forecast = schedule_forecast.ScheduleForecast(schedule_forecast.row_schedules(rows), start=today)
+    return forecast
+
+
+# Función para manejar el comando /forecast
+@bot.message_handler(commands=["forecast"])
+def forecast_command(message):
+    """
+    Gestor de mensajes para el comando /forecast.
+
+    Muestra cuántas tareas se ejecutarán en las próximas horas (o en un día
+    concreto), los minutos con más carga y las próximas ejecuciones.
+
+    """
+    try:
+        argument = message.text.split()[1] if len(message.text.split()) > 1 else None
+        if argument and "-" in argument:
+            start = datetime.strptime(argument, "%Y-%m-%d")
+            end = start + timedelta(days=1)
+            title = f"Previsión del {start.strftime('%d/%m/%Y')}"
         else:
-            # Filtramos por las filas donde 'ACTIVA' es 'TRUE' y validamos los campos
-            programs_active = []
-            for row in data:
-                if row["ACTIVA"] == "TRUE":
-                    program_info = f"{row['IDENTIFICADOR']}: {row['PERIOCIDAD']} a las {row['HORA']}"
-                    programs_active.append(program_info)
-
-            if programs_active:
-                # Construimos el mensaje final con todas las tareas activas
-                reply_message = "\n".join(programs_active)
-                bot.reply_to(message, reply_message, reply_markup=commands_keyboard)
+            hours = int(argument) if argument else FORECAST_HOURS
+            start = datetime.now().replace(second=0, microsecond=0)
+            end = start + timedelta(hours=max(1, hours))
+            title = f"Previsión de las próximas {max(1, hours)} h"
+    except ValueError:
+        bot.reply_to(message, "Uso: /forecast [horas | AAAA-MM-DD]", reply_markup=commands_keyboard)
+        return
+
+    try:
+        forecast = get_forecast()
+        start, end = max(start, forecast.start), min(end, forecast.end)
+        if end <= start:
+            bot.reply_to(message, f"La previsión solo cubre hasta el {forecast.end.strftime('%d/%m/%Y')}",
+                         reply_markup=commands_keyboard)
+            return
+
+        lines = [f"{title}: {forecast.count(start, end)} ejecuciones"]
+        peaks = forecast.peaks(start, end, FORECAST_PEAKS)
+        if peaks:
+            lines.append("\nMinutos con más carga:")
+            for moment, runs in peaks:
+                saturated = " (saturado)" if runs > schedule_forecast.STAGGER_MAX else ""
+                lines.append(f"{moment.strftime('%d/%m %H:%M')} - {runs} tareas{saturated}")
+            lines.append("\nPróximas ejecuciones:")
+            for moment, job_id in forecast.between(start, end, limit=FORECAST_RUNS):
+                lines.append(f"{moment.strftime('%d/%m %H:%M')} {job_id}")
+        bot.reply_to(message, "\n".join(lines), reply_markup=commands_keyboard)
+
+    except Exception as e:
+        bot.reply_to(message, f"Error al calcular la previsión: {str(e)}", reply_markup=commands_keyboard)
+
+
+# Función para describir una ejecución del histórico en una línea
+def run_line(run):
+    """
+    Devuelve el inicio, el código de salida, la duración y el tamaño de la salida de una ejecución.
+    """
+    line = f"{datetime.fromisoformat(run['inicio']).strftime('%d/%m %H:%M')} código {run['codigo_salida']}"
+    if run["duracion"] is not None:
+        line += f", {run['duracion']:.1f} s"
+    if run["tiempo_agotado"]:
+        line += " (tiempo agotado)"
+    if run["bytes_salida"] is not None:
+        line += f", {run['bytes_salida'] / 1024:.1f} KiB"
+    return line
+
+
+# Función para manejar el comando /status
+@bot.message_handler(commands=["status"])
+def status_command(message):
+    """
+    Gestor de mensajes para el comando /status.
+
+    Con un identificador, muestra las ejecuciones, fallos y duraciones p50 y
+    p95 de la tarea en los últimos días y sus últimas ejecuciones. Sin él,
+    muestra los últimos fallos de todas las tareas.
+
+    """
+    try:
+        arguments = message.text.split()
+        since = time.time() - STATUS_DAYS * 86400
+        if len(arguments) < 2:
+            failures = run_history.recent_failures(since, STATUS_RUNS)
+            if not failures:
+                reply_message = f"Ningún fallo en los últimos {STATUS_DAYS} días"
             else:
-                bot.reply_to(message, "No hay filas activas")
+                reply_message = "Últimos fallos:\n" + "\n".join(f"{run['job_id']}: {run_line(run)}" for run in failures)
+            bot.reply_to(message, reply_message, reply_markup=commands_keyboard)
+            return
+
+        stats = run_history.job_stats(arguments[1], since, STATUS_RUNS)
+        if not stats["ejecuciones"]:
+            bot.reply_to(message, f"La tarea {stats['id']} no tiene ejecuciones en los últimos {STATUS_DAYS} días",
+                         reply_markup=commands_keyboard)
+            return
+        lines = [
+            f"{stats['id']}: {stats['ejecuciones']} ejecuciones y {stats['fallos']} fallos en {STATUS_DAYS} días",
+            f"Duración p50 {stats['p50'] or 0:.1f} s, p95 {stats['p95'] or 0:.1f} s",
+            "\nÚltimas ejecuciones:",
+        ]
+        lines += [run_line(run) for run in stats["ultimas"]]
+        if stats["ultimos_fallos"]:
+            lines.append("\nÚltimos fallos:")
+            lines += [run_line(run) for run in stats["ultimos_fallos"]]
+        bot.reply_to(message, "\n".join(lines), reply_markup=commands_keyboard)
 
     except Exception as e:
-        bot.reply_to(message, f"Error al consultar los registros: {str(e)}")
+        bot.reply_to(message, f"Error al consultar el histórico: {str(e)}", reply_markup=commands_keyboard)
 
 
 # Función para manejar cualquier otro tipo de mensaje de texto
@@ -162,5 +505,140 @@ def handle_text(message):
     )
 
 
-# Empezar a recibir mensajes
-bot.polling()
+class UpdateDispatcher:
+    """
+    Reparte las actualizaciones de Telegram entre un número limitado de hilos.
+
+    Todas las actualizaciones de un mismo chat van siempre al mismo hilo, de
+    modo que se atienden en orden, mientras que chats distintos se atienden
+    en paralelo. Cada hilo tiene una cola acotada.
+
+    Argumentos:
+        workers (int): Número de hilos.
+        queue_size (int): Actualizaciones pendientes como máximo por hilo.
+    """
+
+    def __init__(self, workers=BOT_WORKERS, queue_size=BOT_QUEUE_SIZE):
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self.threads = []
+
+    def start(self):
+        if self.threads:
+            return
+        for i, updates in enumerate(self.queues):
+            thread = threading.Thread(target=self._run, args=(updates,), name=f"bot-worker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def dispatch(self, update, block=True):
+        """
+        Encola una actualización en el hilo de su chat.
+
+        Returns:
+            bool: False si la cola está llena y no se ha encolado (solo con block=False).
+        """
+        updates = self.queues[hash(update_chat_id(update)) % len(self.queues)]
+        try:
+            updates.put(update, block=block)
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self, updates):
+        while True:
+            update = updates.get()
+            try:
+                with metrics.timer("bot_update_seconds"):
+                    bot.process_new_updates([update])
+            except Exception as e:
+                logging.error(f"Error al procesar la actualización {update.update_id}: {str(e)}")
+
+
+# Función para obtener el chat al que pertenece una actualización
+def update_chat_id(update):
+    """
+    Devuelve el ID del chat de la actualización, o su update_id si no tiene chat.
+    """
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return update.update_id
+
+
+dispatcher = UpdateDispatcher()
+services_lock = threading.Lock()
+
+
+# Función para arrancar los servicios en segundo plano del bot
+def start_bot_services():
+    """
+    Arranca el refresco de la hoja y los hilos del bot. Se puede llamar varias veces.
+    """
+    with services_lock:
+        sheet_snapshot.start()
+        dispatcher.start()
+
+
+# Aplicación ASGI del webhook, ejecutable por sí sola o montada en fastapi-web.py
+webhook_app = FastAPI()
+
+
+@webhook_app.on_event("startup")
+def webhook_startup():
+    start_bot_services()
+
+
+# Endpoint que recibe las actualizaciones enviadas por Telegram
+@webhook_app.post("/webhook")
+async def telegram_webhook(request: Request):
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    start_bot_services()  # los sub-apps montados no reciben el evento de arranque
+    update = Update.de_json(await request.json())
+    if not dispatcher.dispatch(update, block=False):
+        # Telegram reintentará la entrega más tarde
+        raise HTTPException(status_code=503, detail="Bot busy")
+    return {"ok": True}
+
+
+# Función para recibir actualizaciones por long polling, como alternativa al webhook
+def poll_updates():
+    """
+    Pide actualizaciones a Telegram en bucle y las reparte entre los hilos del bot.
+    """
+    bot.remove_webhook()
+    offset = None
+    while True:
+        try:
+            updates = bot.get_updates(
+                offset=offset, timeout=POLLING_TIMEOUT + LONG_POLLING_TIMEOUT,
+                long_polling_timeout=LONG_POLLING_TIMEOUT
+            )
+        except Exception as e:
+            logging.error(f"Error al recibir actualizaciones: {str(e)}")
+            time.sleep(POLLING_TIMEOUT)
+            continue
+        for update in updates:
+            dispatcher.dispatch(update)
+            offset = update.update_id + 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bot de Telegram de gestión de tareas.")
+    parser.add_argument("--webhook", action="store_true", help="Recibe actualizaciones por webhook en lugar de polling.")
+    parser.add_argument("--host", default="0.0.0.0", help="Dirección del servidor del webhook.")
+    parser.add_argument("--port", type=int, default=8443, help="Puerto del servidor del webhook.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+    metrics.start_exporter("bot")
+
+    if args.webhook:
+        import uvicorn
+        if WEBHOOK_URL:
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, max_connections=BOT_WORKERS)
+        uvicorn.run(webhook_app, host=args.host, port=args.port)
+    else:
+        # Empezar a recibir mensajes
+        start_bot_services()
+        poll_updates()
@@ -1,16 +1,45 @@
-import subprocess
 import sys
+import argparse
 from datetime import datetime
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from crontab import CronTab
 import logging
 import shutil
+import shlex
+import json
 import os
+import sqlite3
+import uuid
+import drive_uploader_downloader
+import output_uploader
+from sheet_snapshot import SheetSnapshot, SNAPSHOT_PATH
+import telegram_notifications
+import google_api
+import metrics
+import paths
+import cluster
+import schedule_forecast
+import run_history
+
+# Ejecutor de las tareas programadas y retraso aleatorio máximo de su arranque (segundos)
+JOB_RUNNER = paths.admin_path("job_runner.py")
+JOB_JITTER = int(os.environ.get("JOB_JITTER", 0))
+
+# Resumen JSON de la última ejecución e histórico con un resumen por línea
+RUN_SUMMARY_PATH = paths.log_path("cron_job_summary.json")
+RUN_HISTORY_PATH = paths.log_path("cron_job_runs.jsonl")
+
+# Crontab que se gestiona: el del usuario o, si se indica CRONTAB_FILE, un fichero (para pruebas y benchmarks)
+CRONTAB_FILE = os.environ.get("CRONTAB_FILE")
+
+# Columnas de la hoja que pueden quedar vacías
+# NODO fija la tarea a un nodo y PESO es su carga relativa en el reparto entre nodos (ver cluster.py)
+OPTIONAL_COLUMNS = ("TIMEOUT", "NODO", "PESO")
 
 # Configuración del Logger
 def configure_logger():
-    log_directory = "/opt/log"
+    log_directory = paths.LOG_DIR
     if not os.path.exists(log_directory):
         os.makedirs(log_directory)
     logging.basicConfig(
@@ -20,42 +49,79 @@ def configure_logger():
     )
 
 # Función para enviar notificaciones
-def send_notification(message, status):
+# En una simulación (--dry-run) solo se registran: no se envía nada al chat de los operadores
+def send_notification(message, status, dry_run=False):
+    if dry_run:
+        logging.info(f"Simulación: notificación no enviada: {message} - {status}")
+        if status == "Error":
+            print(f"! {message}", file=sys.stderr)
+        return
     logging.info(f"Enviando notificación: {message} - {status}")
-    subprocess.run(["/opt/admin/telegram_notifications.sh", message, status])
+    try:
+        telegram_notifications.notify(message, status)
+    except Exception as e:
+        logging.error(f"Error al enviar la notificación: {str(e)}")
 
 # Configuración del cliente de Google Sheets
 def get_google_sheets_client(cred_path, scopes):
     logging.info("Configurando el cliente de Google Sheets.")
     creds = ServiceAccountCredentials.from_json_keyfile_name(cred_path, scopes)
-    return gspread.authorize(creds)
+    return google_api.redirect_client(gspread.authorize(creds))
 
 # Obtener datos de la hoja de cálculo de Google Sheets
+# Se reutiliza la instantánea compartida con el bot si la hoja no ha cambiado desde entonces
+# Si no se puede confirmar con Google Sheets que la copia está al día se lanza el error y el crontab no se toca
 def get_data_from_sheet(client, spreadsheet_id):
     logging.info("Obteniendo datos de la hoja de cálculo.")
-    sheet = client.open_by_key(spreadsheet_id).sheet1
-    return sheet.get_all_records()
-
-# Crear una tarea en el crontab
-def create_cron_job(command, schedule, comment=None):
-    logging.info(f"Creando tarea en crontab: {command} - {schedule}")
-    cron = CronTab(user=True)
-    job = cron.new(command=command, comment=comment)
-    job.setall(schedule)
-    cron.write()
-    return job
-
-# Eliminar todas las tareas del crontab
-def remove_all_cron_jobs():
-    logging.info("Eliminando todas las tareas del crontab.")
-    cron = CronTab(user=True)
-    cron.remove_all()
-    cron.write()
+    snapshot = SheetSnapshot(client, spreadsheet_id, path=SNAPSHOT_PATH)
+    return snapshot.get_records(strict=True)
+
+# Abrir el crontab gestionado
+def open_crontab():
+    if CRONTAB_FILE:
+        return CronTab(tabfile=CRONTAB_FILE)
+    return CronTab(user=True)
+
+# Reconciliar el crontab con las tareas deseadas ({comentario: (programación, comando)})
+# Solo se añaden, modifican o eliminan las tareas que cambian y se escribe una única vez
+def reconcile_cron_jobs(desired_jobs, dry_run=False):
+    logging.info(f"Reconciliando crontab con {len(desired_jobs)} tareas deseadas.")
+    cron = open_crontab()
+    existing = {}
+    changes = []
+    for job in list(cron):
+        if job.comment in desired_jobs and job.comment not in existing:
+            existing[job.comment] = job
+        else:
+            # Tareas que ya no están en la hoja o duplicadas con el mismo identificador
+            changes.append(("-", job.comment, str(job.slices), job.command))
+            cron.remove(job)
+
+    for comment, (schedule, command) in desired_jobs.items():
+        job = existing.get(comment)
+        if job is None:
+            job = cron.new(command=command, comment=comment)
+            job.setall(schedule)
+            changes.append(("+", comment, schedule, command))
+        elif str(job.slices) != schedule or job.command != command or not job.is_enabled():
+            job.set_command(command)
+            job.setall(schedule)
+            job.enable()
+            changes.append(("~", comment, schedule, command))
+
+    for action, comment, schedule, command in changes:
+        logging.info(f"Cambio en crontab: {action} {comment} {schedule} {command}")
+        if dry_run:
+            print(f"{action} [{comment}] {schedule} {command}")
+
+    if changes and not dry_run:
+        cron.write()  # Una única escritura atómica del crontab completo
+    return changes
 
 # Hacer una copia de seguridad del crontab actual
 def backup_crontab(filename):
     logging.info(f"Realizando copia de seguridad del crontab en {filename}.")
-    cron = CronTab(user=True)
+    cron = open_crontab()
     with open(filename, "w") as f:
         for job in cron:
             f.write(str(job))
@@ -64,60 +130,216 @@ def backup_crontab(filename):
 # Mapeo de periodicidad a programación crontab
 def map_periodicity_to_cron(periodicity, hour):
     logging.info(f"Mapeando periodicidad: {periodicity} a crontab con hora: {hour}.")
-    hour, minute = map(int, hour.split(":"))
-    periodicity_map = {
-        "diario": f"{minute} {hour} * * *",
-        "semana laboral": f"{minute} {hour} * * 1-5",
-        "semanal": f"{minute} {hour} * * 0",
-        "mensual": f"{minute} {hour} 1 * *",
-        "trimestral": f"{minute} {hour} 1 */3 *",
-        "cuatrimestral": f"{minute} {hour} 1 */4 *",
-        "semestral": f"{minute} {hour} 1 */6 *",
-        "anual": f"{minute} {hour} 1 1 *"
-    }
-    return periodicity_map.get(periodicity, None)
+    return schedule_forecast.periodicity_to_cron(periodicity, hour)
 
 # Mapeo de la ejecución del script al comando crontab
-def map_exec_to_cron(id, language, script, route_script, output):
-    logging.info(f"Mapeando ejecución de script: {script} para crontab.")
-    executable = f"python3 {route_script}" if language == "python" else f"{route_script}"
-    command = (
-        "{ "
-        + f"""/opt/admin/telegram_notifications.sh "{id}({route_script})" Starting && """
-        + f"{executable} > /opt/output/{output} && "
-        + f"""/opt/admin/telegram_notifications.sh "{id}({route_script})" Finished ;"""
-        + " } || "
-        + f"""/opt/admin/telegram_notifications.sh "{id}({route_script})" Error"""
-    )
-    return command
+# La tarea se lanza a través de job_runner.py, que limita las ejecuciones simultáneas,
+# aplica el tiempo máximo y envía las notificaciones de inicio, fin y error
+def map_exec_to_cron(id, language, route_script, output, timeout=None):
+    logging.info(f"Mapeando ejecución de script: {route_script} para crontab.")
+    arguments = ["python3", JOB_RUNNER, "--id", id, "--language", language, "--output", output]
+    if timeout:
+        arguments += ["--timeout", str(timeout)]
+    if JOB_JITTER:
+        arguments += ["--jitter", str(JOB_JITTER)]
+    arguments.append(route_script)
+    return " ".join(shlex.quote(argument) for argument in arguments)
 
 # Preparar el directorio para scripts
 def prepare_directory(directory):
     logging.info(f"Preparando directorio: {directory}.")
-    if os.path.exists(directory):
-        shutil.rmtree(directory)
-    os.makedirs(directory)
+    if os.path.exists(directory) and not os.path.isdir(directory):
+        os.remove(directory)
+    os.makedirs(directory, exist_ok=True)
 
 # Subir archivos a Google Drive y limpiar el directorio
+# Normalmente output_uploader.py ya ha subido cada salida al terminar su tarea; aquí se suben las que hayan quedado
 def upload_and_cleanup(directory, gdrive_folder):
     logging.info(f"Subiendo archivos del directorio: {directory} a Google Drive y limpiando.")
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        if os.path.isfile(filepath):
-            subprocess.run(["python3", "/opt/admin/drive_uploader_downloader.py", "subir", gdrive_folder, filepath])
-            os.remove(filepath)
+    filepaths = [
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if os.path.isfile(os.path.join(directory, filename))
+    ]
+    if not filepaths:
+        return
+    results = drive_uploader_downloader.transfer_batch(
+        "subir", gdrive_folder, filepaths, compression_method=output_uploader.OUTPUT_COMPRESSION,
+        upsert=output_uploader.OUTPUT_UPSERT
+    )
+    for result in results:
+        filename = os.path.basename(result["fichero"])
+        if result["ok"]:
+            os.remove(result["fichero"])
             logging.info(f"Archivo subido y eliminado: {filename}")
+        else:
+            logging.error(f"Error al subir el archivo {filename}: {result['error']}")
 
-def main():
+# Aplicar la política de retención a la carpeta de salidas de Google Drive
+# Se eliminan las salidas más antiguas que OUTPUT_RETENTION_DAYS y los duplicados de un mismo nombre
+# Sin ninguno de los dos límites configurados no se elimina nada
+def prune_outputs(gdrive_folder, dry_run=False):
+    if output_uploader.OUTPUT_RETENTION_DAYS is None and output_uploader.OUTPUT_KEEP_VERSIONS is None:
+        logging.info(f"Política de retención de {gdrive_folder} desactivada.")
+        return []
+    logging.info(f"Aplicando la política de retención a {gdrive_folder}.")
+    results = drive_uploader_downloader.prune_folder(
+        gdrive_folder,
+        max_age_days=output_uploader.OUTPUT_RETENTION_DAYS,
+        keep_versions=output_uploader.OUTPUT_KEEP_VERSIONS,
+        dry_run=dry_run,
+    )
+    for result in results:
+        if dry_run:
+            print(f"- [{gdrive_folder}] {result['fichero']}")
+        elif not result["ok"]:
+            logging.error(f"Error al eliminar la salida {result['fichero']}: {result['error']}")
+    removed = sum(1 for result in results if result["ok"])
+    logging.info(f"Salidas eliminadas de {gdrive_folder} por la política de retención: {removed}.")
+    return results
+
+# Sincronizar los scripts con el caché local, descargando solo los que han cambiado en Google Drive
+def sync_scripts(scripts, cache_directory, gdrive_folder):
+    logging.info(f"Sincronizando {len(scripts)} scripts de Google Drive con el caché {cache_directory}.")
+    results = drive_uploader_downloader.sync_to_cache(gdrive_folder, scripts, cache_directory)
+    cached = {}
+    missing = []
+    for result in results:
+        if result["ok"]:
+            cached[result["fichero"]] = result["ruta"]
+            if result["descargado"]:
+                logging.info(f"Script actualizado en el caché: {result['fichero']}")
+        elif result["error"].startswith("Archivo no encontrado"):
+            missing.append(result["fichero"])
+        else:
+            logging.error(f"Error al descargar el script {result['fichero']}: {result['error']}")
+
+    # Avisar de todos los scripts que faltan en Google Drive con un único mensaje
+    if missing:
+        mensagge = f"Scripts no encontrados en {gdrive_folder}: {', '.join(missing)}"
+        logging.error(mensagge)
+        send_notification(mensagge, "Error")
+    downloaded = sum(1 for result in results if result.get("descargado"))
+    logging.info(f"Scripts descargados: {downloaded}. Sin cambios: {len(cached) - downloaded}.")
+    return cached
+
+# Instalar los scripts del caché en el directorio de ejecución mediante enlaces simbólicos
+# Cada enlace se sustituye de forma atómica, así que una tarea en ejecución nunca ve un script a medias
+def install_scripts(cached, scripts, directory):
+    logging.info(f"Instalando {len(cached)} scripts en {directory}.")
+    for script, cache_path in cached.items():
+        target = os.path.join(directory, script)
+        if os.path.islink(target) and os.readlink(target) == cache_path:
+            continue
+        tmp_link = f"{target}.{os.getpid()}.tmp"
+        os.symlink(cache_path, tmp_link)
+        os.replace(tmp_link, target)
+
+    # Eliminar los scripts que ya no usa ninguna fila activa; si un script no se ha
+    # podido descargar se conserva su versión anterior
+    for entry in os.listdir(directory):
+        if entry not in scripts:
+            path = os.path.join(directory, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+# Eliminar del caché las versiones de scripts que ya no están instaladas
+def prune_script_cache(cache_directory, directory):
+    in_use = {
+        os.readlink(os.path.join(directory, entry))
+        for entry in os.listdir(directory)
+        if os.path.islink(os.path.join(directory, entry))
+    }
+    for entry in os.listdir(cache_directory):
+        path = os.path.join(cache_directory, entry)
+        if path not in in_use and os.path.isfile(path):
+            os.remove(path)
+            logging.info(f"Versión eliminada del caché de scripts: {entry}")
+
+# Quedarse con las filas de este nodo en el modo multinodo
+# Todos los nodos calculan el mismo reparto; cada uno solo programa las tareas cuya concesión tiene,
+# incluidas las que ha cedido a otro nodo y todavía no ha reclamado
+def filter_cluster_rows(rows, alive, dry_run=False):
+    shard = []
+    for row in rows:
+        try:
+            weight = float(row.get("PESO") or 1)
+        except ValueError:
+            logging.warning(f"Peso no válido para el identificador {row['IDENTIFICADOR']}: {row.get('PESO')}")
+            weight = 1.0
+        pinned = str(row.get("NODO") or "") or None
+        if pinned and pinned not in alive:
+            logging.warning(f"El nodo {pinned} del identificador {row['IDENTIFICADOR']} no está activo; se reparte entre los demás.")
+        shard.append((str(row["IDENTIFICADOR"]), weight, pinned))
+    assignment = cluster.assign(shard, alive)
+    owned, blocked = cluster.update_leases(assignment, alive, dry_run=dry_run)
+    for identificador, nodo in sorted(blocked.items()):
+        logging.info(f"Tarea {identificador} asignada a este nodo, pendiente de que {nodo} la ceda.")
+    cedidas = sum(1 for identificador in owned if assignment[identificador] != cluster.NODE_NAME)
+    logging.info(f"Reparto entre {len(alive)} nodos: {len(owned)} tareas en {cluster.NODE_NAME} ({cedidas} cedidas), {len(blocked)} pendientes.")
+    if dry_run:
+        for identificador in sorted(assignment):
+            print(f"= [{identificador}] {assignment[identificador]}")
+    return [row for row in rows if str(row["IDENTIFICADOR"]) in owned], len(blocked)
+
+# Guardar el resumen de la ejecución y volcar sus métricas para /metrics de fastapi-web.py
+def write_run_summary(trace, **extra):
+    summary = trace.summary(
+        google_api=google_api.counters(),
+        bytes_descargados=metrics.registry.get("drive_bytes_total", direccion="descarga"),
+        bytes_subidos=metrics.registry.get("drive_bytes_total", direccion="subida"),
+        **extra,
+    )
+    try:
+        metrics.write_json(RUN_SUMMARY_PATH, summary)
+        with open(RUN_HISTORY_PATH, "a") as f:
+            f.write(json.dumps(summary) + "\n")
+    except OSError as e:
+        logging.error(f"No se pudo guardar el resumen de la ejecución: {str(e)}")
+    # Registrar también la ejecución en el histórico consultable, junto a las de las tareas
+    try:
+        run_history.record({
+            "id": run_history.CRON_JOB_ID,
+            "id_ejecucion": uuid.uuid4().hex,
+            "inicio": trace.started_at,
+            "duracion": summary["duracion"],
+            "codigo_salida": 0 if summary.get("resultado") == "ok" else 1,
+            "nodo": summary.get("nodo"),
+        })
+    except (sqlite3.Error, OSError) as e:
+        logging.error(f"No se pudo guardar la ejecución en el histórico: {str(e)}")
+    metrics.dump("cron_job")
+    etapas = ", ".join(f"{span['etapa']}={span['duracion']:.2f}s" for span in summary["etapas"])
+    logging.info(f"Ejecución completada en {summary['duracion']:.2f}s ({etapas}). Llamadas a las APIs de Google: {summary['google_api']}")
+    return summary
+
+def main(dry_run=False):
     # Configuración inicial del logger
     configure_logger()
-    send_notification("cron_job.py", "Starting")
+    trace = metrics.Trace("cron_job")
+    resumen = {"resultado": "error", "dry_run": dry_run}
+    send_notification("cron_job.py", "Starting", dry_run=dry_run)
+
+    # En el modo multinodo, publicar el latido y renovar las concesiones de este nodo antes de nada más
+    # Así, si falla la lectura de la hoja o el reparto, sus tareas siguen ejecutándose hasta la siguiente ejecución
+    if cluster.enabled() and not dry_run:
+        try:
+            with trace.span("latido"):
+                cluster.heartbeat()
+                renovadas = cluster.renew_leases()
+            logging.info(f"Concesiones renovadas en {cluster.NODE_NAME}: {renovadas}.")
+        except Exception as e:
+            mensagge = f"No se pudieron renovar las concesiones de {cluster.NODE_NAME}: {str(e)}"
+            logging.error(mensagge)
+            send_notification(mensagge, "Error", dry_run=dry_run)
 
     # Verifica que el archivo de credenciales existe
-    cred_path = "/opt/admin/credentials.json"
+    cred_path = paths.CREDENTIALS_PATH
     if not os.path.exists(cred_path):
         logging.error("El archivo de credenciales no existe.")
-        send_notification("El archivo de credenciales no existe.", "Error")
+        send_notification("El archivo de credenciales no existe.", "Error", dry_run=dry_run)
         exit(1)
 
     scopes_sheets = [
@@ -127,80 +349,136 @@ def main():
 
     try:
         # Obtener cliente de Google Sheets
-        client_sheets = get_google_sheets_client(cred_path, scopes_sheets)
-        data = get_data_from_sheet(client_sheets, "AQUI_VA_TU_ID_DE_GOOGLE_SHEET")
+        with trace.span("leer_hoja"):
+            client_sheets = get_google_sheets_client(cred_path, scopes_sheets)
+            data = get_data_from_sheet(client_sheets, "AQUI_VA_TU_ID_DE_GOOGLE_SHEET")
         logging.info("Datos leídos desde Google Sheets correctamente.")
 
         # Filtrar datos activos
         filtered_data = []
         for row in data:
             if row["ACTIVA"].upper() == "TRUE":
-                if not all(row.values()):
+                if not all(value for column, value in row.items() if column not in OPTIONAL_COLUMNS):
                     identificador = row["IDENTIFICADOR"]
                     mensagge = f"El identificador {identificador} no puede ser programado por falta de información."
                     logging.error(mensagge)
-                    send_notification(mensagge, "Error")
+                    send_notification(mensagge, "Error", dry_run=dry_run)
                     continue
                 filtered_data.append(row)
         logging.info(f"Filtrado completado. Total filas activas: {len(filtered_data)}")
+        resumen["filas_activas"] = len(filtered_data)
+
+        # Programación de todas las filas activas, escalonando las que coinciden si está activado
+        # Se guarda para la previsión de carga de la API y el bot; en el modo multinodo todos los nodos calculan la misma
+        with trace.span("prevision"):
+            schedules = schedule_forecast.row_schedules(filtered_data)
+            staggered = schedule_forecast.stagger(schedules)
+            if not dry_run:
+                schedule_forecast.save_index(staggered)
+        resumen["escalonadas"] = sum(1 for identificador in schedules if staggered[identificador] != schedules[identificador])
+
+        # En el modo multinodo, programar solo las tareas de este nodo
+        alive = {}
+        if cluster.enabled():
+            with trace.span("reparto"):
+                alive = cluster.alive_nodes()
+                alive.setdefault(cluster.NODE_NAME, cluster.NODE_WEIGHT)
+                filtered_data, pendientes = filter_cluster_rows(filtered_data, alive, dry_run=dry_run)
+            resumen.update(nodo=cluster.NODE_NAME, nodos=len(alive), filas_nodo=len(filtered_data),
+                           filas_pendientes=pendientes)
 
-        # Configurar el directorio de scripts
-        directorio = "/opt/program_script_drive/"
-        prepare_directory(directorio)
+        # Configurar el directorio de scripts, descargando solo los scripts que han cambiado
+        directorio = paths.SCRIPTS_DIR
+        cache_scripts = paths.SCRIPT_CACHE_DIR
+        if not dry_run:
+            with trace.span("sincronizar_scripts"):
+                prepare_directory(directorio)
+                scripts = sorted({row["NOMBRE_SCRIPT"] for row in filtered_data})
+                cached = sync_scripts(scripts, cache_scripts, "Scrips_download")
+                install_scripts(cached, set(scripts), directorio)
+                prune_script_cache(cache_scripts, directorio)
 
-        # Backup y limpieza de crontab
-        fecha_actual = datetime.now().strftime("%Y-%m-%d")
-        backup_crontab(f"/opt/log/crontab_copia_{fecha_actual}.txt")
-        remove_all_cron_jobs()
+        # Backup del crontab antes de modificarlo
+        if not dry_run:
+            with trace.span("copia_crontab"):
+                fecha_actual = datetime.now().strftime("%Y-%m-%d")
+                backup_crontab(paths.log_path(f"crontab_copia_{fecha_actual}.txt"))
 
-        # Programar este propio script
-        cron_schedule = "0 3 * * *"
-        program = "python3 /opt/admin/cron_programmer.py"
-        create_cron_job(program, cron_schedule, comment="cron_programmer")
+        # Tareas deseadas, empezando por este propio script
+        # En el modo multinodo se ejecuta con más frecuencia para renovar las concesiones y seguir los cambios de nodos
+        programmer_schedule = cluster.CLUSTER_SCHEDULE if cluster.enabled() else "0 3 * * *"
+        desired_jobs = {"cron_programmer": (programmer_schedule, f"python3 {paths.admin_path('cron_programmer.py')}")}
 
         # Procesar cada fila de datos filtrados
         for row in filtered_data:
-            identificador = row["IDENTIFICADOR"]
+            identificador = str(row["IDENTIFICADOR"])
             script = row["NOMBRE_SCRIPT"]
-            ruta_script = f"/opt/program_script_drive/{script}"
+            ruta_script = os.path.join(paths.SCRIPTS_DIR, script)
             lenguaje = row["LENGUAJE"].lower()
             output = row["NOMBRE_SALIDA"].lower()
             periodicidad = row["PERIOCIDAD"].lower()
             hora = row["HORA"]
 
-            # Descargar y mover el script desde Google Drive
-            logging.info(f"Descargando y moviendo script: {script}")
-            subprocess.run(["python3", "/opt/admin/drive_uploader_downloader.py", "descargar", "Scrips_download", script])
-            subprocess.run(["mv", script, "/opt/program_script_drive/"])
-
             # Definir el comando del script
-            program = map_exec_to_cron(identificador, lenguaje, script, ruta_script, output)
+            program = map_exec_to_cron(identificador, lenguaje, ruta_script, output, row.get("TIMEOUT"))
 
             try:
                 cron_schedule = map_periodicity_to_cron(periodicidad, hora)
                 if cron_schedule is None:
                     raise ValueError(f"Periodicidad desconocida: {periodicidad}")
+                if staggered.get(identificador, cron_schedule) != cron_schedule:
+                    logging.info(f"Tarea {identificador} escalonada de {cron_schedule} a {staggered[identificador]}")
+                    cron_schedule = staggered[identificador]
 
-                # Añadir la tarea al crontab con el identificador como comentario
-                create_cron_job(program, cron_schedule, comment=identificador)
-                logging.info(f"Tarea añadida al crontab:\n{identificador}\n{cron_schedule} {ruta_script}")
+                # Añadir la tarea deseada con el identificador como comentario
+                if identificador in desired_jobs:
+                    logging.warning(f"Identificador duplicado en la hoja, se usa la última fila: {identificador}")
+                desired_jobs[identificador] = (cron_schedule, program)
+                logging.info(f"Tarea preparada para el crontab:\n{identificador}\n{cron_schedule} {ruta_script}")
 
             except ValueError as e:
                 mensagge = f"Error al procesar la periodicidad para el identificador {row['IDENTIFICADOR']}: {str(e)}"
                 logging.error(mensagge)
-                send_notification(mensagge, "Error")
+                send_notification(mensagge, "Error", dry_run=dry_run)
                 continue
 
+        # Aplicar solo las diferencias en el crontab
+        with trace.span("reconciliar_crontab"):
+            changes = reconcile_cron_jobs(desired_jobs, dry_run=dry_run)
+        resumen["tareas"] = len(desired_jobs)
+        resumen["cambios_crontab"] = len(changes)
+
         # Subir y limpiar los archivos de salida
-        upload_and_cleanup("/opt/output/", "Output_scrips")
+        if not dry_run:
+            with trace.span("subir_salidas"):
+                upload_and_cleanup(paths.OUTPUT_DIR, "Output_scrips")
 
+        # Limitar el tamaño de la carpeta de salidas; un fallo aquí no afecta a la programación
+        # En el modo multinodo la carpeta es común y solo la limpia un nodo
+        if cluster.is_leader(alive):
+            try:
+                with trace.span("retencion"):
+                    prune_outputs("Output_scrips", dry_run=dry_run)
+            except Exception as e:
+                logging.error(f"Error al aplicar la política de retención: {str(e)}")
+
+        resumen["resultado"] = "ok"
         logging.info("Programación en crontab completada correctamente.")
-        send_notification("cron_programmer.py", "Finished")
+        send_notification("cron_programmer.py", "Finished", dry_run=dry_run)
 
     except Exception as e:
         mensagge = f"Error al procesar la hoja de cálculo: {str(e)}"
+        resumen["error"] = str(e)
         logging.error(mensagge)
-        send_notification(mensagge, "Error")
+        send_notification(mensagge, "Error", dry_run=dry_run)
+
+    finally:
+        # Una simulación no sustituye el resumen ni las métricas de la última ejecución real
+        if not dry_run:
+            write_run_summary(trace, **resumen)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Programa en el crontab las tareas de la hoja de cálculo.")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra los cambios del crontab sin aplicarlos.")
+    args = parser.parse_args()
+    main(dry_run=args.dry_run)
@@ -0,0 +1,154 @@
+#
+# download_cache.py
+#
+# Caché en disco de archivos descargados de Google Drive para fastapi-web.py.
+#
+# Cada archivo se guarda con una clave que incluye su ID y su suma MD5 (o su
+# fecha de modificación), así que una nueva versión en Drive nunca se sirve
+# desde una copia antigua. El tamaño total está acotado: al superarlo se
+# eliminan los archivos usados hace más tiempo (LRU). Si varias peticiones
+# piden a la vez un archivo que no está en caché, solo una lo descarga y el
+# resto esperan a que termine.
+#
+# La caché entrega los archivos ya abiertos: si se expulsa uno mientras se
+# envía, el sistema conserva su contenido hasta que se cierra el descriptor.
+#
+
+import logging
+import os
+import threading
+from concurrent.futures import Future
+
+# Valores por defecto de la caché
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GiB
+
+
+def cache_key(drive_file):
+    """
+    Clave de caché de un archivo a partir de sus metadatos de Drive v3.
+
+    Argumentos:
+        drive_file (dict): Metadatos con 'id' y 'md5Checksum' o 'modifiedTime'.
+
+    Returns:
+        str: Clave que cambia cuando cambia el contenido del archivo.
+    """
+    version = drive_file.get('md5Checksum') or drive_file.get('modifiedTime', '').replace(':', '')
+    return f"{drive_file['id']}-{version}"
+
+
+class DiskCache:
+    """
+    Caché de archivos en disco con expulsión LRU por tamaño total.
+
+    Argumentos:
+        directory (str): Directorio donde se guardan los archivos.
+        max_bytes (int): Tamaño total máximo de la caché.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._inflight = {}  # clave -> Future de la descarga en curso
+        os.makedirs(directory, exist_ok=True)
+        # Restos de descargas interrumpidas en una ejecución anterior
+        for entry in os.listdir(directory):
+            if entry.endswith(".tmp"):
+                os.remove(os.path.join(directory, entry))
+        self._total = sum(size for _, size, _ in self._entries())
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        """
+        Abre el archivo en modo binario si está en caché, marcándolo como usado; si no, None.
+
+        El archivo abierto se puede leer entero aunque después se expulse de la caché.
+        """
+        path = self.path_for(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)  # la fecha de modificación hace de marca de último uso
+        except FileNotFoundError:
+            pass  # expulsado justo después de abrirlo; el descriptor sigue siendo válido
+        return f
+
+    def fetch(self, key, fill):
+        """
+        Abre el archivo, descargándolo con `fill` si no está en caché.
+
+        Las peticiones simultáneas de la misma clave comparten una única descarga.
+
+        Argumentos:
+            key (str): Clave del archivo.
+            fill (callable): Función que recibe una ruta temporal y escribe en ella el contenido.
+
+        Returns:
+            file: Archivo de la caché abierto en modo binario; quien lo recibe debe cerrarlo.
+        """
+        while True:
+            f = self.open(key)
+            if f is not None:
+                return f
+            with self._lock:
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = Future()
+                    self._inflight[key] = future
+            if owner:
+                return self._fill(key, fill, future)
+            future.result()  # otra petición ya lo está descargando; si se expulsa antes de abrirlo, se vuelve a pedir
+
+    def _fill(self, key, fill, future):
+        tmp_path = f"{self.path_for(key)}.{threading.get_ident()}.tmp"
+        try:
+            fill(tmp_path)
+            size = os.path.getsize(tmp_path)
+            f = open(tmp_path, 'rb')  # abierto antes de publicarlo, así que ninguna expulsión lo puede quitar
+            os.replace(tmp_path, self.path_for(key))
+            with self._lock:
+                self._total += size
+            self._evict(keep=key)
+            future.set_result(self.path_for(key))
+        except BaseException as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return f
+
+    def _entries(self):
+        for entry in os.listdir(self.directory):
+            if entry.endswith(".tmp"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, entry))
+            except FileNotFoundError:
+                continue
+            yield entry, stat.st_size, stat.st_mtime
+
+    def _evict(self, keep=None):
+        # Elimina los archivos usados hace más tiempo hasta volver a estar por debajo del límite
+        with self._lock:
+            if self._total <= self.max_bytes:
+                return
+            for entry, size, _ in sorted(self._entries(), key=lambda item: item[2]):
+                if self._total <= self.max_bytes:
+                    break
+                if entry == keep:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, entry))
+                    self._total -= size
+                    logging.info(f"Archivo expulsado de la caché de descargas: {entry}")
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,142 @@
+#
+# drive_cache.py
+#
+# Caché de resolución nombre -> ID para carpetas y archivos de Google Drive.
+#
+# La comparten drive_uploader_downloader.py y fastapi-web.py para no repetir
+# una consulta "list" cada vez que se busca una carpeta o un archivo por nombre.
+# Las entradas caducan tras un TTL, se expulsan por LRU al superar el tamaño
+# máximo y, opcionalmente, se guardan en un pequeño fichero JSON para que las
+# ejecuciones cortas de la línea de comandos también se beneficien.
+#
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Valores por defecto de la caché
+DEFAULT_TTL = 600  # segundos
+DEFAULT_MAX_ENTRIES = 1024
+
+
+def folder_key(folder_name):
+    """
+    Clave de caché para una carpeta buscada por nombre.
+    """
+    return f"folder:{folder_name}"
+
+
+def file_key(folder_id, file_name):
+    """
+    Clave de caché para un archivo buscado por nombre dentro de una carpeta.
+    """
+    return f"file:{folder_id}:{file_name}"
+
+
+class DriveIdCache:
+    """
+    Caché LRU con caducidad por TTL que asocia claves de nombre con IDs de Drive.
+
+    Argumentos:
+        ttl (float): Segundos que una entrada se considera válida.
+        max_entries (int): Número máximo de entradas antes de expulsar las más antiguas.
+        path (str): Fichero JSON donde persistir la caché, o None para mantenerla solo en memoria.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()  # clave -> (id, instante de alta)
+        self._lock = threading.Lock()
+        self._dirty = False
+        if path:
+            self._load()
+
+    def get(self, key):
+        """
+        Devuelve el ID asociado a la clave, o None si no existe o ha caducado.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, stored_at = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Guarda el ID asociado a la clave, expulsando la entrada menos usada si hace falta.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def invalidate(self, key):
+        """
+        Elimina una entrada de la caché si existe.
+        """
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def clear(self):
+        """
+        Vacía la caché por completo.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def save(self):
+        """
+        Escribe la caché en disco de forma atómica si tiene ruta y ha cambiado.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            data = {
+                key: [value, stored_at]
+                for key, (value, stored_at) in self._entries.items()
+                if now - stored_at <= self.ttl
+            }
+            self._dirty = False
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # La persistencia es opcional: si no se puede escribir seguimos en memoria
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        try:
+            for key, (value, stored_at) in sorted(data.items(), key=lambda item: item[1][1]):
+                if now - stored_at <= self.ttl:
+                    self._entries[key] = (value, stored_at)
+        except (AttributeError, TypeError, ValueError):
+            # Fichero con un formato inesperado: se descarta y se reconstruye
+            self._entries.clear()
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
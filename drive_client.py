@@ -0,0 +1,163 @@
+#
+# drive_client.py
+#
+# Cliente ligero de drive_gateway.py con la misma línea de comandos que
+# drive_uploader_downloader.py:
+#
+#     python3 drive_client.py subir Output_scrips salida.txt --comprimir gzip
+#     python3 drive_client.py descargar Scrips_download tarea.py --destino /tmp
+#     python3 drive_client.py listar Output_scrips
+#
+# Solo usa la biblioteca estándar, así que arranca en milisegundos: la
+# pasarela, que ya tiene cargadas las credenciales, el token de acceso y las
+# conexiones abiertas, hace el trabajo. Si la pasarela no está en marcha o no
+# responde a tiempo, la petición se ejecuta en este mismo proceso con
+# drive_uploader_downloader.py, como antes.
+#
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+import compression
+import paths
+
+# Socket Unix de drive_gateway.py
+GATEWAY_SOCKET = os.environ.get("DRIVE_GATEWAY_SOCKET", paths.admin_path("drive_gateway.sock"))
+
+# Segundos de espera a la pasarela: para conectar y para recibir la respuesta
+# Si se agotan, la pasarela se da por colgada y la petición se ejecuta en este proceso
+GATEWAY_CONNECT_TIMEOUT = float(os.environ.get("DRIVE_GATEWAY_CONNECT_TIMEOUT", 5))
+GATEWAY_TIMEOUT = float(os.environ.get("DRIVE_GATEWAY_TIMEOUT", 900))
+
+ACTIONS = ("subir", "descargar", "listar")
+
+
+def read_manifest(manifest_path):
+    """
+    Lee un manifiesto con un archivo por línea, ignorando líneas vacías y comentarios.
+
+    Argumentos:
+        manifest_path (str): Ruta al manifiesto.
+
+    Returns:
+        list: Archivos listados en el manifiesto.
+    """
+    with open(manifest_path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def send_request(request, socket_path=GATEWAY_SOCKET):
+    """
+    Envía una petición a drive_gateway.py y espera su respuesta.
+
+    Argumentos:
+        request (dict): Petición con el formato de drive_uploader_downloader.execute.
+        socket_path (str): Ruta del socket de la pasarela.
+
+    Returns:
+        list: Resultados de la petición, o None si la pasarela no está en marcha o no responde a tiempo.
+
+    Raises:
+        RuntimeError: Si la pasarela no ha podido ejecutar la petición.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(GATEWAY_CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None  # sin pasarela (o colgada); la petición todavía no se ha enviado
+        sock.settimeout(GATEWAY_TIMEOUT)
+        try:
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        except socket.timeout:
+            print(f"La pasarela de Google Drive no ha respondido en {GATEWAY_TIMEOUT:g} s; "
+                  "se ejecuta la petición en este proceso.", file=sys.stderr)
+            return None
+    finally:
+        sock.close()
+    if not line:
+        raise RuntimeError("La pasarela de Google Drive ha cerrado la conexión sin responder")
+    response = json.loads(line)
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error") or "Error desconocido en la pasarela de Google Drive")
+    return response["resultados"]
+
+
+def run(request, use_gateway=True):
+    """
+    Ejecuta una petición en la pasarela o, si no está en marcha, en este proceso.
+    """
+    if use_gateway:
+        results = send_request(request)
+        if results is not None:
+            return results
+    import drive_uploader_downloader  # solo se carga PyDrive si hace falta
+    return drive_uploader_downloader.execute(request)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Sube, descarga o lista archivos de Google Drive.")
+    parser.add_argument("accion", type=str, help='La acción a realizar: "subir", "descargar" o "listar".')
+    parser.add_argument("carpeta", type=str, help="El nombre de la carpeta.")
+    parser.add_argument("fichero", type=str, nargs="*", help="El nombre de uno o varios ficheros.")
+    parser.add_argument("--manifest", type=str, help="Fichero con un nombre de fichero por línea.")
+    parser.add_argument("--destino", type=str, default=None, help="Directorio donde guardar las descargas.")
+    parser.add_argument("--workers", type=int, default=None, help="Transferencias simultáneas.")
+    parser.add_argument("--comprimir", choices=list(compression.SUFFIXES), default=None,
+                        help="Comprime los ficheros antes de subirlos.")
+    parser.add_argument("--upsert", action="store_true",
+                        help="Sustituye el contenido de los ficheros que ya existen en lugar de duplicarlos.")
+    return parser
+
+
+def main(argv=None, use_gateway=True):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.accion not in ACTIONS:
+        print('Acción no reconocida. Por favor, especifica "subir", "descargar" o "listar".')
+        return
+
+    ficheros = list(args.fichero)
+    if args.manifest:
+        ficheros.extend(read_manifest(args.manifest))
+    if not ficheros and args.accion != "listar":
+        parser.error("Indica al menos un fichero o un manifiesto.")
+
+    # La pasarela es otro proceso: las rutas locales se envían absolutas
+    if args.accion == "subir":
+        ficheros = [os.path.abspath(f) for f in ficheros]
+    request = {
+        "accion": args.accion,
+        "carpeta": args.carpeta,
+        "ficheros": ficheros,
+        "destino": os.path.abspath(args.destino or os.getcwd()),
+        "workers": args.workers,
+        "comprimir": args.comprimir,
+        "upsert": args.upsert,
+    }
+    try:
+        results = run(request, use_gateway)
+    except (RuntimeError, ValueError) as e:
+        print(str(e))
+        sys.exit(1)
+
+    if args.accion == "listar":
+        for r in results:
+            print(f"{r['fichero']}\t{r['tamano'] if r['tamano'] is not None else '-'}\t{r['modificado'] or '-'}")
+        return
+    failed = [r for r in results if not r["ok"]]
+    for r in failed:
+        print(f"{r['fichero']}: {r['error']}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#
+# drive_gateway.py
+#
+# Pasarela local de Google Drive.
+#
+# Proceso residente que mantiene cargadas las credenciales de la cuenta de
+# servicio, el token de acceso y un conjunto de conexiones abiertas a la API,
+# y atiende por un socket Unix las peticiones de subida, descarga y listado
+# de drive_client.py. Así cada llamada cuesta milisegundos en lugar de los
+# segundos de arrancar Python, importar PyDrive y pedir un token nuevo.
+#
+# Protocolo: una petición por conexión, en una línea JSON con el formato de
+# drive_uploader_downloader.execute, y una respuesta en otra línea:
+#     {"ok": true, "resultados": [...]}  o  {"ok": false, "error": "..."}
+#
+# La pasarela lee y escribe los archivos con sus propios permisos, por lo que
+# el socket solo es accesible para su usuario y su grupo.
+#
+
+import argparse
+import json
+import logging
+import os
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+import drive_client
+import drive_uploader_downloader
+import google_api
+import metrics
+
+GATEWAY_SOCKET = drive_client.GATEWAY_SOCKET
+GATEWAY_WORKERS = int(os.environ.get("DRIVE_GATEWAY_WORKERS", 8))  # transferencias simultáneas en total
+MAX_REQUEST_SIZE = 4 * 1024 * 1024  # bytes de una petición (manifiestos largos incluidos)
+
+
+class GatewayHandler(socketserver.StreamRequestHandler):
+    """
+    Atiende una petición de drive_client.py.
+    """
+
+    def handle(self):
+        action = None
+        try:
+            request = json.loads(self.rfile.readline(MAX_REQUEST_SIZE))
+            action = request.get("accion")
+            with metrics.timer("drive_gateway_request_seconds", accion=str(action)):
+                results = drive_uploader_downloader.execute(
+                    request, pool=self.server.pool, executor=self.server.executor
+                )
+            response = {"ok": True, "resultados": results}
+        except Exception as e:
+            logging.error(f"Error al atender la petición {action}: {str(e)}")
+            response = {"ok": False, "error": str(e)}
+        try:
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        except OSError:
+            pass  # el cliente ya no espera la respuesta
+
+
+class DriveGateway(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Servidor de la pasarela: un hilo por conexión y un conjunto común de
+    hilos y conexiones a Google Drive para las transferencias.
+
+    Argumentos:
+        socket_path (str): Ruta del socket Unix.
+        workers (int): Transferencias simultáneas entre todas las peticiones.
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=GATEWAY_SOCKET, workers=GATEWAY_WORKERS,
+                 credentials_path=drive_uploader_downloader.CREDENTIALS_PATH):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, GatewayHandler)
+        os.chmod(socket_path, 0o660)
+        self.socket_path = socket_path
+        self.pool = drive_uploader_downloader.DrivePool(credentials_path)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+
+    def warm_up(self):
+        """
+        Carga las credenciales y pide el token de acceso antes de la primera petición.
+        """
+        credentials = self.pool.load_credentials()
+        try:
+            credentials.refresh(google_api.http())
+        except Exception as e:
+            # Se volverá a intentar en la primera petición
+            logging.warning(f"No se pudo obtener el token de acceso: {str(e)}")
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pasarela local de Google Drive.")
+    parser.add_argument("--socket", default=GATEWAY_SOCKET, help="Ruta del socket Unix.")
+    parser.add_argument("--workers", type=int, default=GATEWAY_WORKERS, help="Transferencias simultáneas.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+    metrics.start_exporter("drive_gateway")
+    with DriveGateway(socket_path=args.socket, workers=args.workers) as gateway:
+        gateway.warm_up()
+        logging.info(f"Pasarela de Google Drive escuchando en {args.socket}")
+        gateway.serve_forever()
@@ -1,8 +1,128 @@
+import hashlib
 import os
-import argparse
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive
+from pydrive.files import GoogleDriveFile
 from oauth2client.service_account import ServiceAccountCredentials
+import drive_cache
+import drive_client
+import compression
+import google_api
+import metrics
+import paths
+
+# Ruta por defecto al archivo de credenciales de la cuenta de servicio
+CREDENTIALS_PATH = paths.CREDENTIALS_PATH
+
+# Número máximo de transferencias simultáneas en modo lote
+MAX_WORKERS = 4
+
+# Archivos por página al listar una carpeta completa (máximo admitido por la API v2)
+LIST_PAGE_SIZE = 1000
+
+# Archivos por petición al enviar operaciones agrupadas (máximo admitido por la API)
+BATCH_SIZE = 100
+
+# Caché persistente de IDs de carpetas, compartida entre ejecuciones de la línea de comandos
+ID_CACHE_PATH = paths.admin_path('drive_id_cache.json')
+id_cache = drive_cache.DriveIdCache(path=ID_CACHE_PATH)
+
+def load_credentials(credentials_path):
+    """
+    Carga las credenciales de la cuenta de servicio desde el archivo JSON.
+
+    Argumentos:
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+
+    Returns:
+        ServiceAccountCredentials: Credenciales con el alcance de Google Drive.
+    """
+    scope = ['https://www.googleapis.com/auth/drive']
+    return ServiceAccountCredentials.from_json_keyfile_name(credentials_path, scope)
+
+class DriveAuth(GoogleAuth):
+    """
+    GoogleAuth cuyas conexiones HTTP se crean con google_api.http(), de modo
+    que respetan las direcciones alternativas de la API (GOOGLE_API_ROOT).
+
+    Con keep_alive, todas las llamadas a la API reutilizan la conexión con la
+    que se construyó el servicio en lugar de abrir una nueva; solo es seguro
+    si el objeto no se usa desde varios hilos a la vez, como en DrivePool.
+    """
+
+    keep_alive = False
+
+    def Get_Http_Object(self):
+        if self.keep_alive and self.service is not None:
+            return self.http  # conexión ya autorizada por Authorize()
+        # PyDrive crea una conexión nueva para cada llamada a la API
+        return self.credentials.authorize(google_api.http(self.http_timeout))
+
+def drive_from_credentials(credentials, keep_alive=False):
+    """
+    Crea un objeto GoogleDrive a partir de unas credenciales ya cargadas.
+
+    Cada objeto tiene su propia conexión HTTP, por lo que en modo lote se
+    crea uno por hilo reutilizando las mismas credenciales.
+
+    Argumentos:
+        credentials (ServiceAccountCredentials): Credenciales ya cargadas.
+        keep_alive (bool): Reutiliza la misma conexión en todas las llamadas.
+
+    Returns:
+        GoogleDrive: Objeto GoogleDrive autenticado.
+    """
+    gauth = DriveAuth()
+    gauth.credentials = credentials
+    gauth.keep_alive = keep_alive
+    gauth.http = google_api.http(gauth.http_timeout)  # conexión con la que se construye el servicio
+    return GoogleDrive(gauth)
+
+class DrivePool:
+    """
+    Conexiones a Google Drive reutilizables entre hilos y entre operaciones.
+
+    Carga las credenciales una sola vez, de modo que el token de acceso solo
+    se pide de nuevo cuando caduca, y guarda los objetos GoogleDrive libres
+    (cada uno con su conexión abierta) para la siguiente operación.
+
+    Argumentos:
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+    """
+
+    def __init__(self, credentials_path=CREDENTIALS_PATH):
+        self.credentials_path = credentials_path
+        self.credentials = None
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def load_credentials(self):
+        with self._lock:
+            if self.credentials is None:
+                self.credentials = load_credentials(self.credentials_path)
+            return self.credentials
+
+    @contextmanager
+    def connection(self):
+        """
+        Presta un objeto GoogleDrive de uso exclusivo mientras dura el bloque.
+        """
+        credentials = self.load_credentials()
+        with self._lock:
+            drive = self._idle.pop() if self._idle else None
+        if drive is None:
+            drive = drive_from_credentials(credentials, keep_alive=True)
+        try:
+            yield drive
+        finally:
+            with self._lock:
+                self._idle.append(drive)
 
 def authenticate(credentials_path):
     """
@@ -14,15 +134,23 @@ def authenticate(credentials_path):
     Returns:
         GoogleDrive: Objeto GoogleDrive autenticado.
     """
-    gauth = GoogleAuth()
-    scope = ['https://www.googleapis.com/auth/drive']
-    gauth.credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, scope)
-    return GoogleDrive(gauth)
+    return drive_from_credentials(load_credentials(credentials_path))
+
+# Margen ante la diferencia de reloj con Google Drive al buscar un archivo recién creado
+CREATE_CLOCK_SKEW = timedelta(minutes=5)
+
+def escape_query_value(value):
+    """
+    Escapa un valor para incluirlo entre comillas simples en una consulta de Google Drive.
+    """
+    return value.replace('\\', '\\\\').replace("'", "\\'")
 
 def find_folder(drive, folder_name):
     """
     Busca una carpeta por su nombre en Google Drive.
 
+    El ID se guarda en la caché de IDs para no repetir la consulta.
+
     Argumentos:
         drive (GoogleDrive): Objeto GoogleDrive autenticado.
         folder_name (str): Nombre de la carpeta a buscar.
@@ -30,13 +158,103 @@ def find_folder(drive, folder_name):
     Returns:
         dict: Carpeta encontrada, o None si no se encuentra.
     """
-    folder_list = drive.ListFile({'q': f"title='{folder_name}' and mimeType='application/vnd.google-apps.folder'"}).GetList()
+    folder_id = id_cache.get(drive_cache.folder_key(folder_name))
+    if folder_id:
+        return {'id': folder_id, 'title': folder_name}
+    folder_list = google_api.call(
+        drive.ListFile({'q': f"title='{escape_query_value(folder_name)}' and mimeType='application/vnd.google-apps.folder'"}).GetList
+    )
     if folder_list:
+        id_cache.set(drive_cache.folder_key(folder_name), folder_list[0]['id'])
         return folder_list[0]  # toma la primera carpeta que coincide
     else:
         return None
 
-def download_file(drive, folder, file_name):
+def find_file(drive, folder, file_name):
+    """
+    Busca un archivo por su nombre dentro de una carpeta.
+
+    Si hay varios archivos con el mismo nombre devuelve el modificado más recientemente.
+
+    Argumentos:
+        drive (GoogleDrive): Objeto GoogleDrive autenticado.
+        folder (dict): Carpeta donde buscar el archivo.
+        file_name (str): Nombre del archivo a buscar.
+
+    Returns:
+        GoogleDriveFile: Archivo encontrado con sus metadatos, o None si no se encuentra.
+    """
+    file_list = google_api.call(drive.ListFile({
+        'q': f"title='{escape_query_value(file_name)}' and '{escape_query_value(folder['id'])}' in parents and trashed=false",
+        'orderBy': 'modifiedDate desc',
+    }).GetList)
+    if file_list:
+        return file_list[0]  # toma el archivo más reciente que coincide
+    return None
+
+def iter_folder(drive, folder):
+    """
+    Recorre todos los archivos de una carpeta con una sola consulta paginada.
+
+    Pide las páginas de resultados (nextPageToken) a medida que se recorren,
+    del archivo modificado más recientemente al más antiguo.
+
+    Argumentos:
+        drive (GoogleDrive): Objeto GoogleDrive autenticado.
+        folder (dict): Carpeta a listar.
+
+    Yields:
+        GoogleDriveFile: Metadatos de cada archivo (id, title, md5Checksum, fileSize, modifiedDate...).
+    """
+    query = {
+        'q': f"'{escape_query_value(folder['id'])}' in parents and trashed=false",
+        'maxResults': LIST_PAGE_SIZE,
+        'orderBy': 'modifiedDate desc',
+    }
+    pages = iter(drive.ListFile(query))
+    while True:
+        page = google_api.call(next, pages, None)  # pide la página siguiente; si falla, se repite la misma
+        if page is None:
+            return
+        yield from page
+
+def list_folder(drive, folder):
+    """
+    Lista todos los archivos de una carpeta con una sola consulta paginada.
+
+    Construye un índice por nombre con los metadatos de cada archivo (id,
+    md5Checksum, fileSize, downloadUrl...). Si hay varios archivos con el
+    mismo nombre se conserva el modificado más recientemente.
+
+    Argumentos:
+        drive (GoogleDrive): Objeto GoogleDrive autenticado.
+        folder (dict): Carpeta a listar.
+
+    Returns:
+        dict: Metadatos de cada archivo indexados por su nombre.
+    """
+    index = {}
+    for file1 in iter_folder(drive, folder):
+        index.setdefault(file1['title'], dict(file1))  # conserva el más reciente, como find_file
+    return index
+
+def bind_file(drive, drive_file):
+    """
+    Crea un GoogleDriveFile asociado a la conexión indicada a partir de metadatos ya obtenidos.
+
+    Permite descargar desde otro hilo un archivo listado previamente sin
+    volver a pedir sus metadatos.
+
+    Argumentos:
+        drive (GoogleDrive): Objeto GoogleDrive autenticado del hilo actual.
+        drive_file (dict): Metadatos del archivo.
+
+    Returns:
+        GoogleDriveFile: Archivo listo para descargar.
+    """
+    return GoogleDriveFile(auth=drive.auth, metadata=drive_file, uploaded=True)
+
+def download_file(drive, folder, file_name, destination=None, drive_file=None):
     """
     Busca un archivo por su nombre en una carpeta y lo descarga.
 
@@ -44,15 +262,117 @@ def download_file(drive, folder, file_name):
         drive (GoogleDrive): Objeto GoogleDrive autenticado.
         folder (dict): Carpeta donde buscar el archivo.
         file_name (str): Nombre del archivo a descargar.
+        destination (str): Directorio donde guardar el archivo. Por defecto,
+            el directorio actual.
+        drive_file (dict): Metadatos del archivo si ya se conocen, para no buscarlo.
+
+    Returns:
+        bool: True si el archivo se ha descargado, False si no se encuentra.
     """
-    file_list = drive.ListFile({'q': f"title='{file_name}' and '{folder['id']}' in parents"}).GetList()
-    if file_list:
-        file1 = file_list[0]  # toma el primer archivo que coincide
-        file1.GetContentFile(file_name)  # descarga el archivo
-    #else:
-        #print(f'Archivo no encontrado: {file_name}')
+    file1 = bind_file(drive, drive_file) if drive_file else find_file(drive, folder, file_name)
+    if file1 is not None:
+        local_path = os.path.join(destination, file_name) if destination else file_name
+        google_api.call(file1.GetContentFile, local_path)  # descarga el archivo
+        metrics.inc('drive_bytes_total', os.path.getsize(local_path), direccion='descarga')
+        return True
+    return False
+
+def cache_key(drive_file):
+    """
+    Clave de caché de un archivo de Drive: su ID más la suma MD5 de su contenido.
+
+    Si Drive no proporciona MD5 (documentos nativos de Google) se usa la fecha
+    de modificación.
+
+    Argumentos:
+        drive_file (dict): Metadatos del archivo en Google Drive.
+
+    Returns:
+        str: Clave que cambia cuando cambia el contenido del archivo.
+    """
+    version = drive_file.get('md5Checksum') or drive_file.get('modifiedDate', '').replace(':', '')
+    return f"{drive_file['id']}-{version}"
+
+def download_to_cache(drive, drive_file, cache_directory):
+    """
+    Descarga un archivo al caché de contenido solo si su versión no está ya guardada.
+
+    Argumentos:
+        drive (GoogleDrive): Objeto GoogleDrive autenticado.
+        drive_file (dict): Metadatos del archivo obtenidos con list_folder.
+        cache_directory (str): Directorio del caché.
+
+    Returns:
+        tuple: Ruta del archivo en el caché y si ha sido necesario descargarlo.
+    """
+    cache_path = os.path.join(cache_directory, cache_key(drive_file))
+    if os.path.exists(cache_path):
+        return cache_path, False
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        google_api.call(bind_file(drive, drive_file).GetContentFile, tmp_path)  # descarga el archivo
+        metrics.inc('drive_bytes_total', os.path.getsize(tmp_path), direccion='descarga')
+        os.replace(tmp_path, cache_path)  # solo aparece en el caché una vez completo
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return cache_path, True
+
+def file_md5(f):
+    """
+    Suma MD5 del contenido de un archivo abierto en modo binario, que queda otra vez al principio.
+    """
+    f.seek(0)
+    digest = hashlib.md5()
+    for chunk in iter(lambda: f.read(1024 * 1024), b''):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+def find_created_file(drive, folder, file_name, md5, since):
+    """
+    Busca un archivo creado en la carpeta desde `since` con ese nombre y ese contenido.
+
+    Returns:
+        GoogleDriveFile: Archivo encontrado, o None.
+    """
+    file_list = google_api.call(drive.ListFile({
+        'q': f"title='{escape_query_value(file_name)}' and '{escape_query_value(folder['id'])}' in parents and trashed=false"
+             f" and createdDate >= '{(since - CREATE_CLOCK_SKEW).isoformat(timespec='seconds')}'",
+    }).GetList)
+    return next((drive_file for drive_file in file_list if drive_file.get('md5Checksum') == md5), None)
+
+def create_file(drive, folder, file1, md5, upload_param=None, since=None):
+    """
+    Crea un archivo en Google Drive reintentando solo si el intento anterior no llegó a crearlo.
+
+    Crear un archivo no es idempotente: si Drive lo crea pero la respuesta se
+    pierde, repetir la subida dejaría un duplicado. Antes de cada reintento se
+    busca un archivo con el mismo nombre y la misma suma MD5 creado desde el
+    primer intento y, si existe, se da por subido.
+
+    Argumentos:
+        drive (GoogleDrive): Objeto GoogleDrive autenticado.
+        folder (dict): Carpeta donde se crea el archivo.
+        file1 (GoogleDriveFile): Archivo nuevo con su contenido ya asignado.
+        md5 (str): Suma MD5 del contenido.
+        upload_param (dict): Parámetros adicionales de la subida.
+        since (datetime): Instante de un intento anterior del llamante; si se
+            indica, la comprobación se hace también antes del primer intento.
+    """
+    started = since or datetime.now(timezone.utc)
+    attempted = since is not None
+
+    def create():
+        nonlocal attempted
+        if attempted and find_created_file(drive, folder, file1['title'], md5, started) is not None:
+            return  # el intento anterior sí creó el archivo
+        attempted = True
+        file1.Upload(param=upload_param)
 
-def upload_file(drive, folder, file_path):
+    google_api.call(create)
+
+def upload_file(drive, folder, file_path, compression_method=None, upsert=False, created_since=None):
     """
     Sube un archivo a una carpeta en Google Drive.
 
@@ -60,36 +380,344 @@ def upload_file(drive, folder, file_path):
         drive (GoogleDrive): Objeto GoogleDrive autenticado.
         folder (dict): Carpeta donde subir el archivo.
         file_path (str): Ruta al archivo a subir.
+        compression_method (str): "gzip" o "zstd" para comprimirlo antes de
+            subirlo, añadiendo la extensión correspondiente a su nombre.
+        upsert (bool): Si ya existe un archivo con el mismo nombre, sustituye
+            su contenido en lugar de crear otro. Cada contenido subido se
+            fija como revisión permanente (pinned), así que Drive conserva
+            los anteriores en lugar de purgarlos a los 30 días o a las 100
+            revisiones. Drive admite hasta 200 revisiones fijadas por archivo.
+
+    Las creaciones de archivos nuevos se reintentan con create_file, que
+    comprueba antes de repetir la subida que el intento anterior no la
+    completó, así que un error de red no deja duplicados. created_since
+    (datetime) indica que el llamante ya intentó subir este archivo desde
+    ese instante, para hacer la comprobación también antes de empezar.
+
+    Returns:
+        str: Nombre del archivo en Google Drive.
     """
-    file_name = os.path.basename(file_path)  # Extrae solo el nombre del archivo de la ruta
-    file1 = drive.CreateFile({'title': file_name, 'parents': [{'id': folder['id']}]})  # Crea un archivo de GoogleDrive en la carpeta.
-    file1.SetContentFile(file_path)  # Establece contenido del archivo
-    file1.Upload()  # Sube el archivo.
-    #print(f'Archivo subido: {file1["title"]}')
+    compression.check_method(compression_method)
+    file_name = compression.compressed_name(os.path.basename(file_path), compression_method)  # Extrae solo el nombre del archivo de la ruta
+    existing = find_file(drive, folder, file_name) if upsert else None
+    if existing is not None:
+        file1 = bind_file(drive, dict(existing))  # Actualiza el archivo existente por su ID
+    else:
+        file1 = drive.CreateFile({'title': file_name, 'parents': [{'id': folder['id']}]})  # Crea un archivo de GoogleDrive en la carpeta.
+    upload_param = {'pinned': True} if upsert else None  # API v2 de PyDrive; equivale a keepRevisionForever en la v3
 
-def main():
-    # Parsea los argumentos de la línea de comandos
-    parser = argparse.ArgumentParser(description='Sube o descarga un archivo a Google Drive.')
-    parser.add_argument('accion', type=str, help='La acción a realizar: "subir" o "descargar".')
-    parser.add_argument('carpeta', type=str, help='El nombre de la carpeta.')
-    parser.add_argument('fichero', type=str, help='El nombre del fichero.')
-    args = parser.parse_args()
-
-    # Autenticación
-    drive = authenticate('/opt/admin/credentials.json')
-
-    # Busca la carpeta por su nombre
-    folder = find_folder(drive, args.carpeta)
-    if folder is not None:
-        #print(f'Carpeta encontrada: {folder["title"]}')
-        if args.accion == 'descargar':
-            download_file(drive, folder, args.fichero)
-        elif args.accion == 'subir':
-            upload_file(drive, folder, args.fichero)
+    def upload(content):
+        if existing is not None:
+            google_api.call(file1.Upload, param=upload_param)  # Sustituye el contenido; repetirlo no crea otro archivo
         else:
-            print('Acción no reconocida. Por favor, especifica "subir" o "descargar".')
+            create_file(drive, folder, file1, file_md5(content), upload_param, created_since)  # Crea el archivo sin duplicarlo al reintentar
+
+    if compression_method:
+        # Se comprime por trozos en un temporal en disco, que se sube de forma reanudable
+        with tempfile.TemporaryFile() as compressed:
+            compression.compress_file(file_path, compressed, compression_method)
+            uploaded_bytes = compressed.tell()
+            compressed.seek(0)
+            file1['mimeType'] = compression.MIME_TYPES[compression_method]
+            file1.content = compressed
+            upload(compressed)  # Sube el archivo.
     else:
-        print(f'Carpeta no encontrada: {args.carpeta}')
+        file1.SetContentFile(file_path)  # Establece contenido del archivo
+        upload(file1.content)  # Sube el archivo.
+        uploaded_bytes = os.path.getsize(file_path)
+    metrics.inc('drive_bytes_total', uploaded_bytes, direccion='subida')
+    id_cache.invalidate(drive_cache.file_key(folder['id'], file_name))  # El nombre puede resolver ahora a otro archivo
+    #print(f'Archivo subido: {file1["title"]}')
+    return file_name
+
+def select_expired(files, max_age_days=None, keep_versions=None, now=None):
+    """
+    Elige los archivos que sobran según una política de retención.
+
+    Argumentos:
+        files (iterable): Metadatos de los archivos (title, modifiedDate), del
+            más reciente al más antiguo, como los devuelve iter_folder.
+        max_age_days (float): Antigüedad máxima en días, o None para no limitarla.
+        keep_versions (int): Archivos con el mismo nombre que se conservan, o
+            None para no limitarlos.
+        now (datetime): Instante de referencia. Por defecto, el actual.
+
+    Returns:
+        list: Archivos a eliminar.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=max_age_days) if max_age_days is not None else None
+    seen = {}
+    expired = []
+    for file1 in files:
+        seen[file1['title']] = seen.get(file1['title'], 0) + 1
+        modified = datetime.fromisoformat(file1['modifiedDate'].replace('Z', '+00:00'))
+        if (cutoff is not None and modified < cutoff) or \
+                (keep_versions is not None and seen[file1['title']] > keep_versions):
+            expired.append(file1)
+    return expired
+
+def trash_files(drive, files, batch_size=BATCH_SIZE):
+    """
+    Mueve varios archivos a la papelera agrupando las peticiones.
+
+    Cada petición agrupada incluye hasta batch_size operaciones, de modo que
+    limpiar cientos de archivos cuesta unas pocas peticiones HTTP. Las
+    operaciones que Google rechaza por cuota se repiten en otra petición.
+
+    Argumentos:
+        drive (GoogleDrive): Objeto GoogleDrive autenticado.
+        files (list): Metadatos de los archivos a eliminar.
+        batch_size (int): Operaciones por petición agrupada.
+
+    Returns:
+        list: Un diccionario por archivo con las claves 'fichero', 'ok' y 'error'.
+    """
+    if not files:
+        return []
+    if drive.auth.service is None:
+        drive.auth.Authorize()  # PyDrive construye el servicio en la primera llamada a la API
+    service = drive.auth.service
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = exception
+
+    pending = list(range(len(files)))
+    for attempt in range(google_api.MAX_RETRIES + 1):
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch = service.new_batch_http_request(callback=callback)
+            for i in chunk:
+                batch.add(service.files().trash(fileId=files[i]['id']), request_id=str(i))
+            google_api.throttle(len(chunk) - 1)  # cada operación cuenta para la cuota
+            google_api.call(batch.execute, http=drive.auth.http)
+        pending = [i for i in pending if results.get(str(i)) is not None and google_api.is_retryable(results[str(i)])]
+        if not pending or attempt == google_api.MAX_RETRIES:
+            break
+        time.sleep(google_api.backoff_delay(attempt))
+    return [
+        {'fichero': file1['title'], 'ok': results.get(str(i)) is None,
+         'error': str(results[str(i)]) if results.get(str(i)) is not None else None}
+        for i, file1 in enumerate(files)
+    ]
+
+def prune_folder(folder_name, max_age_days=None, keep_versions=None, dry_run=False,
+                 credentials_path=CREDENTIALS_PATH):
+    """
+    Aplica una política de retención a una carpeta de Google Drive.
+
+    Lista la carpeta una sola vez y mueve a la papelera, en peticiones
+    agrupadas, los archivos más antiguos que max_age_days y las versiones de
+    un mismo nombre que excedan keep_versions.
+
+    Argumentos:
+        folder_name (str): Nombre de la carpeta de Google Drive.
+        max_age_days (float): Antigüedad máxima en días, o None.
+        keep_versions (int): Archivos con el mismo nombre que se conservan, o None.
+        dry_run (bool): Si es True, solo devuelve los archivos que se eliminarían.
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+
+    Returns:
+        list: Un diccionario por archivo eliminado con las claves 'fichero', 'ok' y 'error'.
+    """
+    drive = authenticate(credentials_path)
+    folder = find_folder(drive, folder_name)
+    if folder is None:
+        raise ValueError(f'Carpeta no encontrada: {folder_name}')
+    expired = select_expired(iter_folder(drive, folder), max_age_days, keep_versions)
+    if dry_run:
+        return [{'fichero': file1['title'], 'ok': True, 'error': None} for file1 in expired]
+    results = trash_files(drive, expired)
+    for file1 in expired:
+        id_cache.invalidate(drive_cache.file_key(folder['id'], file1['title']))
+    id_cache.save()
+    return results
+
+def run_batch(folder_name, files, operation, credentials_path=CREDENTIALS_PATH,
+              max_workers=MAX_WORKERS, use_index=False, pool=None, executor=None):
+    """
+    Aplica una operación a varios archivos de una misma carpeta en un único proceso.
+
+    Autentica una sola vez, resuelve la carpeta una sola vez y reparte el
+    trabajo entre un número limitado de hilos, cada uno con su propia
+    conexión a Google Drive.
+
+    Argumentos:
+        folder_name (str): Nombre de la carpeta de Google Drive.
+        files (list): Archivos sobre los que aplicar la operación.
+        operation (callable): Función (drive, folder, fichero, metadatos) que
+            devuelve un diccionario con el resultado; si lanza una excepción el
+            archivo se marca como fallido.
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+        max_workers (int): Número máximo de operaciones simultáneas.
+        use_index (bool): Si es True, lista la carpeta una sola vez antes de
+            empezar, marca como no encontrados los archivos que no están y pasa
+            a la operación los metadatos de cada archivo. Si es False, los
+            metadatos son None.
+        pool (DrivePool): Conexiones a reutilizar. Por defecto, unas nuevas
+            para esta llamada.
+        executor (Executor): Hilos a reutilizar, por ejemplo los de
+            drive_gateway.py. Por defecto, max_workers hilos nuevos.
+
+    Returns:
+        list: Un diccionario por archivo con al menos las claves 'fichero', 'ok' y 'error'.
+    """
+    pool = pool or DrivePool(credentials_path)
+    with pool.connection() as drive:
+        folder = find_folder(drive, folder_name)
+        if folder is None:
+            return [{'fichero': f, 'ok': False, 'error': f'Carpeta no encontrada: {folder_name}'} for f in files]
+        index = list_folder(drive, folder) if use_index else None
+
+    def run(file):
+        if index is not None and file not in index:
+            return {'fichero': file, 'ok': False, 'error': f'Archivo no encontrado: {file}'}
+        try:
+            result = {'fichero': file, 'ok': True, 'error': None}
+            with pool.connection() as drive:
+                result.update(operation(drive, folder, file, index[file] if index is not None else None))
+            return result
+        except Exception as e:
+            return {'fichero': file, 'ok': False, 'error': str(e)}
+
+    if executor is not None:
+        results = list(executor.map(run, files))
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            results = list(executor.map(run, files))
+    if any(not r['ok'] for r in results):
+        # Si algo ha fallado, el ID de carpeta cacheado puede estar obsoleto
+        id_cache.invalidate(drive_cache.folder_key(folder_name))
+    id_cache.save()
+    return results
+
+def transfer_batch(action, folder_name, files, destination=None,
+                   credentials_path=CREDENTIALS_PATH, max_workers=MAX_WORKERS, compression_method=None,
+                   upsert=False, pool=None, executor=None):
+    """
+    Sube o descarga varios archivos de una misma carpeta en un único proceso.
+
+    Argumentos:
+        action (str): "subir" o "descargar".
+        folder_name (str): Nombre de la carpeta de Google Drive.
+        files (list): Rutas a subir o nombres de archivo a descargar.
+        destination (str): Directorio donde guardar las descargas.
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+        max_workers (int): Número máximo de transferencias simultáneas.
+        compression_method (str): "gzip" o "zstd" para comprimir las subidas.
+        upsert (bool): Sustituye el contenido de los archivos que ya existen en lugar de duplicarlos.
+        pool (DrivePool): Conexiones a reutilizar.
+        executor (Executor): Hilos a reutilizar.
+
+    Returns:
+        list: Un diccionario por archivo con las claves 'fichero', 'ok' y 'error'.
+    """
+    if action not in ('subir', 'descargar'):
+        raise ValueError(f'Acción no reconocida: {action}')
+
+    def transfer(drive, folder, file, drive_file):
+        if action == 'descargar':
+            if not download_file(drive, folder, file, destination, drive_file):
+                return {'ok': False, 'error': f'Archivo no encontrado: {file}'}
+        else:
+            upload_file(drive, folder, file, compression_method, upsert)
+        return {}
+
+    # Con varias descargas sale más barato listar la carpeta una vez que buscar cada archivo
+    use_index = action == 'descargar' and len(files) > 1
+    return run_batch(folder_name, files, transfer, credentials_path, max_workers, use_index, pool, executor)
+
+def sync_to_cache(folder_name, files, cache_directory,
+                  credentials_path=CREDENTIALS_PATH, max_workers=MAX_WORKERS, pool=None, executor=None):
+    """
+    Sincroniza varios archivos de una carpeta con un caché local direccionado por contenido.
+
+    La carpeta se lista una sola vez y cada archivo se guarda en el caché con
+    el nombre "<id>-<md5>", de modo que solo se descargan los archivos cuyo
+    contenido ha cambiado en Drive.
+
+    Argumentos:
+        folder_name (str): Nombre de la carpeta de Google Drive.
+        files (list): Nombres de los archivos a sincronizar.
+        cache_directory (str): Directorio del caché.
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+        max_workers (int): Número máximo de descargas simultáneas.
+        pool (DrivePool): Conexiones a reutilizar.
+        executor (Executor): Hilos a reutilizar.
+
+    Returns:
+        list: Un diccionario por archivo con las claves 'fichero', 'ok', 'error',
+            'ruta' (ruta en el caché) y 'descargado'.
+    """
+    os.makedirs(cache_directory, exist_ok=True)
+
+    def sync(drive, folder, file, drive_file):
+        cache_path, downloaded = download_to_cache(drive, drive_file, cache_directory)
+        return {'ruta': cache_path, 'descargado': downloaded}
+
+    return run_batch(folder_name, files, sync, credentials_path, max_workers, use_index=True,
+                     pool=pool, executor=executor)
+
+def list_remote(folder_name, credentials_path=CREDENTIALS_PATH, pool=None):
+    """
+    Lista los archivos de una carpeta de Google Drive.
+
+    Argumentos:
+        folder_name (str): Nombre de la carpeta de Google Drive.
+        credentials_path (str): Ruta al archivo JSON de las credenciales.
+        pool (DrivePool): Conexiones a reutilizar.
+
+    Returns:
+        list: Un diccionario por archivo, del más reciente al más antiguo, con
+            las claves 'fichero', 'ok', 'error', 'id', 'tamano' y 'modificado'.
+    """
+    pool = pool or DrivePool(credentials_path)
+    with pool.connection() as drive:
+        folder = find_folder(drive, folder_name)
+        if folder is None:
+            raise ValueError(f'Carpeta no encontrada: {folder_name}')
+        return [
+            {
+                'fichero': file1['title'], 'ok': True, 'error': None, 'id': file1['id'],
+                'tamano': int(file1['fileSize']) if file1.get('fileSize') else None,
+                'modificado': file1.get('modifiedDate'),
+            }
+            for file1 in iter_folder(drive, folder)
+        ]
+
+def execute(request, pool=None, executor=None):
+    """
+    Ejecuta una petición de la línea de comandos o de drive_gateway.py.
+
+    Argumentos:
+        request (dict): Claves 'accion' ("subir", "descargar" o "listar"),
+            'carpeta', 'ficheros' y, opcionalmente, 'destino', 'workers',
+            'comprimir' y 'upsert'. Las rutas deben ser absolutas si la
+            petición la ejecuta otro proceso.
+        pool (DrivePool): Conexiones a reutilizar.
+        executor (Executor): Hilos a reutilizar.
+
+    Returns:
+        list: Un diccionario por archivo con al menos las claves 'fichero', 'ok' y 'error'.
+
+    Raises:
+        ValueError: Si la acción no existe o la petición no es válida.
+    """
+    action = request.get('accion')
+    if action == 'listar':
+        return list_remote(request['carpeta'], pool=pool)
+    if action not in ('subir', 'descargar'):
+        raise ValueError(f'Acción no reconocida: {action}')
+    compression.check_method(request.get('comprimir'))
+    return transfer_batch(action, request['carpeta'], list(request.get('ficheros') or []), request.get('destino'),
+                          max_workers=request.get('workers') or MAX_WORKERS,
+                          compression_method=request.get('comprimir'), upsert=bool(request.get('upsert')),
+                          pool=pool, executor=executor)
+
+def main():
+    # La línea de comandos es la de drive_client.py, ejecutada en este mismo proceso
+    drive_client.main(use_gateway=False)
 
 if __name__ == '__main__':
     main()
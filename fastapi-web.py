@@ -1,109 +1,1045 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException  # Importa clases y funciones necesarias de FastAPI
-from fastapi.responses import Response  # Importa la clase Response de FastAPI para manejar respuestas HTTP
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Query  # Importa clases y funciones necesarias de FastAPI
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse  # Importa las clases de respuesta para enviar archivos por trozos o como texto
 from google.oauth2 import service_account  # Importa el módulo para gestionar las credenciales de servicio de Google
+from google.auth.transport.requests import AuthorizedSession  # Importa la sesión HTTP autenticada para descargas en streaming
+from google_auth_httplib2 import AuthorizedHttp  # Importa el cliente httplib2 autenticado para el servicio de Google Drive
 from googleapiclient.discovery import build  # Importa la función para construir un cliente de servicio de Google API
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload  # Importa clases para cargar y descargar archivos desde Google Drive
-import io  # Importa el módulo de operaciones de entrada/salida en memoria
+from googleapiclient.errors import HttpError  # Importa la excepción de errores HTTP de la API de Google
+from googleapiclient.http import MediaIoBaseUpload  # Importa la clase para cargar archivos en Google Drive
+from requests.adapters import HTTPAdapter  # Importa el adaptador HTTP para configurar el pool de conexiones
+from concurrent.futures import ThreadPoolExecutor  # Importa el pool de hilos donde se ejecutan las llamadas bloqueantes a Drive
+from datetime import datetime, timedelta  # Importa datetime para el filtro por fecha de modificación y timedelta para la previsión
+from typing import List, Optional  # Importa List y Optional para los parámetros de los endpoints
+import asyncio  # Importa asyncio para esperar las llamadas a Drive sin bloquear el bucle de eventos
+import functools  # Importa functools para preparar las llamadas que se envían al pool de hilos
+import json  # Importa json para generar la salida NDJSON
+import os  # Importa el módulo para leer la configuración del entorno
+import re  # Importa el módulo de expresiones regulares para validar cabeceras Range
+import tempfile  # Importa tempfile para almacenar los trozos recibidos sin cargarlos enteros en memoria
+import threading  # Importa threading para mantener un servicio de Google Drive por hilo
+import time  # Importa time para caducar las sesiones de subida abandonadas
+import uuid  # Importa uuid para generar identificadores de subidas reanudables
+import zipfile  # Importa zipfile para generar las exportaciones en ZIP a medida que se envían
+import requests  # Importa requests para reconocer los errores HTTP de las descargas y subidas directas
+import google_api  # Importa la capa común de reintentos y límite de cuota de las APIs de Google
+import metrics  # Importa el registro de métricas publicado en /metrics
+import paths  # Importa las rutas del sistema, configurables con OPT_ROOT
+import drive_cache  # Importa la caché de resolución nombre -> ID compartida con drive_uploader_downloader.py
+import download_cache  # Importa la caché en disco de archivos descargados
+import compression  # Importa la descompresión de las salidas subidas comprimidas por output_uploader.py
+import schedule_forecast  # Importa el índice de ejecuciones previstas que guarda cron_job.py
+import run_history  # Importa el histórico de ejecuciones de las tareas en SQLite
+from email.utils import format_datetime  # Importa la función para formatear fechas HTTP (Last-Modified)
 
 app = FastAPI()  # Crea una instancia de la aplicación FastAPI
 
 # Configuración de las credenciales de la API de Google Drive
 SCOPES = ['https://www.googleapis.com/auth/drive']  # Define los permisos necesarios para acceder a Google Drive
-SERVICE_ACCOUNT_FILE = '/opt/admin/credentials.json'  # Ruta al archivo JSON que contiene las credenciales de servicio
+SERVICE_ACCOUNT_FILE = paths.CREDENTIALS_PATH  # Ruta al archivo JSON que contiene las credenciales de servicio
 credentials = service_account.Credentials.from_service_account_file(
     SERVICE_ACCOUNT_FILE, scopes=SCOPES)  # Carga las credenciales desde el archivo JSON
-drive_service = build('drive', 'v3', credentials=credentials)  # Crea una instancia del servicio de Google Drive
+id_cache = drive_cache.DriveIdCache()  # Caché en memoria de IDs de carpetas y archivos
+
+# Configuración de la concurrencia del acceso a Google Drive
+DRIVE_MAX_WORKERS = int(os.environ.get('DRIVE_MAX_WORKERS', 8))  # Número máximo de llamadas simultáneas a Google Drive
+drive_executor = ThreadPoolExecutor(max_workers=DRIVE_MAX_WORKERS, thread_name_prefix='drive')  # Pool de hilos para las llamadas bloqueantes
+drive_local = threading.local()  # Almacena el servicio de Google Drive de cada hilo
+
+authed_session = google_api.redirect_session(AuthorizedSession(credentials))  # Sesión HTTP autenticada para descargar contenido en streaming
+authed_session.mount('https://', HTTPAdapter(pool_connections=DRIVE_MAX_WORKERS, pool_maxsize=DRIVE_MAX_WORKERS))  # Reutiliza una conexión por hilo
+
+# Función que devuelve el servicio de Google Drive del hilo actual
+def get_drive_service():
+    # httplib2 no es seguro entre hilos, así que cada hilo del pool construye su propio servicio
+    if not hasattr(drive_local, 'service'):
+        http = AuthorizedHttp(credentials, http=google_api.http())
+        drive_local.service = build('drive', 'v3', http=http, cache_discovery=False)
+    return drive_local.service
+
+# Función para ejecutar una llamada bloqueante a Google Drive en el pool sin bloquear el bucle de eventos
+async def run_in_drive_executor(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(drive_executor, functools.partial(func, *args))
+
+# Configuración de las descargas en streaming
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files'  # URL base de la API de archivos de Google Drive
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get('DOWNLOAD_CHUNK_SIZE', 1024 * 1024))  # Tamaño de cada trozo enviado al cliente
+RANGE_HEADER_RE = re.compile(r'^bytes=\d*-\d*$')  # Solo se admite un único rango de bytes
+FILE_METADATA_FIELDS = 'id, name, size, md5Checksum, modifiedTime'  # Metadatos necesarios para la caché y las cabeceras
+
+# Configuración de la caché en disco de descargas
+DOWNLOAD_CACHE_DIR = os.environ.get('DOWNLOAD_CACHE_DIR', paths.DOWNLOAD_CACHE_DIR)  # Directorio de la caché
+DOWNLOAD_CACHE_MAX_BYTES = int(os.environ.get('DOWNLOAD_CACHE_MAX_BYTES', 1024 * 1024 * 1024))  # Tamaño total máximo
+DOWNLOAD_CACHE_MAX_FILE = int(os.environ.get('DOWNLOAD_CACHE_MAX_FILE', 100 * 1024 * 1024))  # Archivos mayores se envían sin cachear
+disk_cache = download_cache.DiskCache(DOWNLOAD_CACHE_DIR, DOWNLOAD_CACHE_MAX_BYTES)  # Caché LRU en disco
+
+# Configuración de las subidas reanudables
+DRIVE_UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files'  # URL de subida de la API de Google Drive
+UPLOAD_CHUNK_GRANULARITY = 256 * 1024  # Google Drive exige trozos múltiplos de 256 KiB salvo el último
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))  # Tamaño de cada trozo enviado a Google Drive
+UPLOAD_SPOOL_SIZE = 1024 * 1024  # Bytes de cada trozo recibido que se mantienen en memoria antes de pasar a disco
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')  # Formato de la cabecera Content-Range de cada trozo
+UPLOAD_SESSION_TTL = 7 * 24 * 3600  # Google Drive invalida las URIs de sesión tras una semana
+upload_sessions = {}  # Sesiones de subida reanudable activas: upload_id -> datos de la sesión
+upload_sessions_lock = threading.Lock()  # Protege el acceso concurrente a las sesiones
+
+# Configuración de los listados paginados
+LIST_PAGE_SIZE = 100  # Tamaño de página por defecto, el mismo que usa Google Drive
+LIST_MAX_PAGE_SIZE = 1000  # Tamaño de página máximo admitido por Google Drive
+LIST_FIELDS = "nextPageToken, files(id, name, size, modifiedTime)"  # Campos devueltos de cada archivo
+
+# Configuración de las exportaciones en ZIP
+EXPORT_PREFETCH = int(os.environ.get('EXPORT_PREFETCH', 4))  # Archivos que se empiezan a descargar antes de llegar a su turno
+EXPORT_DEFLATE = os.environ.get('EXPORT_DEFLATE', '1') == '1'  # Comprime en el ZIP los archivos que no están ya comprimidos
+EXPORT_NAMES_PER_QUERY = 30  # Nombres pedidos en cada consulta a Google Drive (cada uno con sus versiones comprimidas)
+EXPORT_MAX_FILES = int(os.environ.get('EXPORT_MAX_FILES', 5000))  # Archivos como máximo en una exportación
+EXPORT_ERRORS_NAME = '_errores.txt'  # Miembro del ZIP con los archivos que no se han podido incluir
+
+# Configuración de la previsión de carga de las tareas programadas
+FORECAST_WINDOW = timedelta(hours=24)  # Intervalo consultado si no se indica el final
+FORECAST_MAX_RESULTS = 5000  # Ejecuciones devueltas como máximo en una consulta
+
+# Configuración de las consultas del histórico de ejecuciones
+HISTORY_DAYS = 7  # Días consultados si no se indican
+HISTORY_MAX_RESULTS = 500  # Ejecuciones devueltas como máximo en una consulta
+
+# Función para escapar un valor dentro de una consulta de Google Drive
+def escape_query_value(value):
+    return value.replace('\\', '\\\\').replace("'", "\\'")
 
 # Función para encontrar una carpeta por su nombre en Google Drive
 def find_folder_by_name(folder_name):
+    folder_id = id_cache.get(drive_cache.folder_key(folder_name))  # Consulta primero la caché de IDs
+    if folder_id:
+        return {'id': folder_id, 'name': folder_name}
     try:
-        results = drive_service.files().list(
-            q=f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false",
+        results = google_api.execute(get_drive_service().files().list(
+            q=f"name='{escape_query_value(folder_name)}' and mimeType='application/vnd.google-apps.folder' and trashed=false",
             fields="files(id, name)"
-        ).execute()  # Realiza una búsqueda de la carpeta en Google Drive
+        ))  # Realiza una búsqueda de la carpeta en Google Drive
         folders = results.get('files', [])  # Obtiene la lista de carpetas que coinciden
         if folders:
+            id_cache.set(drive_cache.folder_key(folder_name), folders[0]['id'])  # Guarda el ID en la caché
             return folders[0]  # Devuelve la primera carpeta que coincida
         else:
             return None
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching for folder: {str(e)}")  # Maneja errores HTTP
 
+# Función para encontrar el ID de un archivo por su nombre dentro de una carpeta
+def find_file_id_in_folder(folder_id, file_name):
+    key = drive_cache.file_key(folder_id, file_name)
+    file_id = id_cache.get(key)  # Consulta primero la caché de IDs
+    if file_id:
+        return file_id
+    file_list = google_api.execute(get_drive_service().files().list(
+        q=f"name='{escape_query_value(file_name)}' and '{escape_query_value(folder_id)}' in parents and trashed=false",
+        fields="files(id, name)",
+        orderBy='modifiedTime desc'
+    )).get('files', [])  # Busca el archivo dentro de la carpeta; si hay duplicados, el más reciente
+    if file_list:
+        id_cache.set(key, file_list[0]['id'])  # Guarda el ID en la caché
+        return file_list[0]['id']
+    return None
+
 # Función para subir un archivo a una carpeta específica en Google Drive
-def upload_file_to_drive(folder_name, file):
+# Con upsert, si ya existe un archivo con el mismo nombre se sustituye su contenido; cada contenido se sube como revisión
+# permanente (keepRevisionForever) para que Drive no purgue las anteriores a los 30 días o a las 100 revisiones
+def upload_file_to_drive(folder_name, file, upsert=False):
     folder = find_folder_by_name(folder_name)  # Encuentra la carpeta destino en Google Drive
     if folder:
-        file_metadata = {
-            'name': file.filename,
-            'parents': [folder['id']]
-        }
-        media = MediaIoBaseUpload(file.file, mimetype=file.content_type)  # Crea un objeto para cargar el archivo
         try:
-            uploaded_file = drive_service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id'
-            ).execute()  # Sube el archivo al servicio de Google Drive
-            return {"file_id": uploaded_file.get('id')}  # Devuelve el ID del archivo subido
+            existing_id = find_file_id_in_folder(folder['id'], file.filename) if upsert else None
+            if existing_id:
+                try:
+                    return {"file_id": send_upload(existing_id, None, file, keep_revision=True), "updated": True}
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        raise
+                    file.file.seek(0)  # El ID cacheado ya no existe: se crea un archivo nuevo
+            uploaded_id = send_upload(None, {'name': file.filename, 'parents': [folder['id']]}, file, keep_revision=upsert)
+            id_cache.invalidate(drive_cache.file_key(folder['id'], file.filename))  # El nombre puede resolver ahora a otro archivo
+            return {"file_id": uploaded_id}  # Devuelve el ID del archivo subido
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")  # Maneja errores HTTP
     else:
         raise HTTPException(status_code=404, detail=f"Folder '{folder_name}' not found")  # Maneja errores HTTP
 
-# Función para descargar un archivo desde una carpeta específica en Google Drive
-def download_file_from_drive(folder_name, file_name):
+# Función que sube el contenido de un archivo trozo a trozo, creando uno nuevo o actualizando uno existente por su ID
+def send_upload(file_id, file_metadata, file, keep_revision=False):
+    media = MediaIoBaseUpload(
+        file.file, mimetype=file.content_type, chunksize=UPLOAD_CHUNK_SIZE, resumable=True
+    )  # Crea un objeto para cargar el archivo por trozos
+    if file_id:
+        request = get_drive_service().files().update(
+            fileId=file_id, media_body=media, fields='id', keepRevisionForever=keep_revision
+        )  # Sustituye el contenido; con keep_revision, Drive conserva la nueva revisión para siempre
+    else:
+        request = get_drive_service().files().create(
+            body=file_metadata, media_body=media, fields='id', keepRevisionForever=keep_revision
+        )
+    uploaded_file = None
+    while uploaded_file is None:
+        status, uploaded_file = google_api.call(request.next_chunk)  # Sube el archivo al servicio de Google Drive trozo a trozo
+    metrics.inc('drive_bytes_total', media.size(), direccion='subida')
+    return uploaded_file.get('id')
+
+# Función para iniciar una sesión de subida reanudable en Google Drive
+def create_resumable_upload(folder_name, file_name, size, content_type, upsert=False):
+    folder = find_folder_by_name(folder_name)  # Encuentra la carpeta destino en Google Drive
+    if not folder:
+        raise HTTPException(status_code=404, detail=f"Folder '{folder_name}' not found")  # Maneja errores HTTP
+    upload_headers = {'X-Upload-Content-Type': content_type, 'X-Upload-Content-Length': str(size)}
+    try:
+        existing_id = find_file_id_in_folder(folder['id'], file_name) if upsert else None
+        response = None
+        if existing_id:
+            response = drive_request(
+                'PATCH', f"{DRIVE_UPLOAD_URL}/{existing_id}",
+                params={'uploadType': 'resumable', 'fields': 'id', 'keepRevisionForever': 'true'},
+                json={},
+                headers=upload_headers
+            )  # Sesión para sustituir el contenido del archivo existente
+            if response.status_code == 404:
+                id_cache.invalidate(drive_cache.file_key(folder['id'], file_name))  # El ID cacheado ya no existe
+                response = None
+        if response is None:
+            response = drive_request(
+                'POST', DRIVE_UPLOAD_URL,
+                params={'uploadType': 'resumable', 'fields': 'id', 'keepRevisionForever': str(upsert).lower()},
+                json={'name': file_name, 'parents': [folder['id']]},
+                headers=upload_headers
+            )  # Pide a Google Drive una URI de sesión para subir el archivo
+        response.raise_for_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting upload: {str(e)}")  # Maneja errores HTTP
+    upload_id = uuid.uuid4().hex
+    now = time.time()
+    with upload_sessions_lock:
+        for expired in [k for k, v in upload_sessions.items() if now - v['created'] > UPLOAD_SESSION_TTL]:
+            del upload_sessions[expired]  # Descarta las sesiones abandonadas que Google Drive ya no acepta
+        upload_sessions[upload_id] = {
+            'created': now,
+            'session_uri': response.headers['Location'],
+            'folder_id': folder['id'],
+            'file_name': file_name,
+            'size': size,
+            'offset': 0,
+            'file_id': None,
+            'busy': False,  # Hay una petición en curso que lee o actualiza el desplazamiento
+        }
+    return {"upload_id": upload_id, "offset": 0, "chunk_granularity": UPLOAD_CHUNK_GRANULARITY}
+
+# Función que devuelve la sesión de subida reanudable o un error 404 si no existe
+def get_upload_session(upload_id):
+    with upload_sessions_lock:
+        session = upload_sessions.get(upload_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Upload '{upload_id}' not found")  # Maneja errores HTTP
+    return session
+
+# Función que marca la sesión como ocupada y devuelve un error 409 si ya lo está
+# Así dos peticiones de la misma subida no pueden comprobar el mismo desplazamiento y enviar trozos a la vez
+def claim_upload_session(session):
+    with upload_sessions_lock:
+        if session['busy']:
+            raise HTTPException(status_code=409, detail={"offset": session['offset'], "busy": True})  # Otra petición de esta subida está en curso
+        session['busy'] = True
+
+# Función que libera la sesión marcada por claim_upload_session
+def release_upload_session(session):
+    with upload_sessions_lock:
+        session['busy'] = False
+
+# Función que interpreta la respuesta de Google Drive a un trozo y actualiza el desplazamiento confirmado
+def update_upload_session(session, response):
+    if response.status_code in (200, 201):
+        session['offset'] = session['size']
+        session['file_id'] = response.json().get('id')
+        id_cache.invalidate(drive_cache.file_key(session['folder_id'], session['file_name']))  # El nombre puede resolver ahora a otro archivo
+    elif response.status_code == 308:
+        # La cabecera Range indica el último byte guardado por Google Drive ("bytes=0-N")
+        committed = response.headers.get('Range')
+        session['offset'] = int(committed.rsplit('-', 1)[1]) + 1 if committed else 0
+    else:
+        response.raise_for_status()
+        raise HTTPException(status_code=502, detail=f"Unexpected status from Drive: {response.status_code}")
+    return {"offset": session['offset'], "complete": session['file_id'] is not None, "file_id": session['file_id']}
+
+# Función para enviar a Google Drive un trozo de una subida reanudable
+def put_resumable_chunk(session, chunk, start, length):
+    end = start + length - 1
+    try:
+        google_api.throttle()  # El trozo no se reintenta aquí: el cliente reanuda desde el desplazamiento confirmado
+        with metrics.timer('google_api_request_seconds', api='drive'):
+            response = authed_session.put(
+                session['session_uri'],
+                data=chunk,
+                headers={'Content-Range': f"bytes {start}-{end}/{session['size']}", 'Content-Length': str(length)},
+                allow_redirects=False
+            )  # Envía el trozo desde el fichero temporal sin cargarlo entero en memoria
+        metrics.inc('drive_bytes_total', length, direccion='subida')
+        return update_upload_session(session, response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error uploading chunk: {str(e)}")  # Maneja errores HTTP
+    finally:
+        chunk.close()
+
+# Función para consultar a Google Drive cuántos bytes de una subida reanudable se han guardado
+def query_resumable_upload(session):
+    if session['file_id'] is not None:
+        return {"offset": session['offset'], "complete": True, "file_id": session['file_id']}
+    try:
+        response = drive_request(
+            'PUT', session['session_uri'],
+            headers={'Content-Range': f"bytes */{session['size']}", 'Content-Length': '0'},
+            allow_redirects=False
+        )  # Petición vacía que solo pide el estado de la subida
+        return update_upload_session(session, response)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error querying upload: {str(e)}")  # Maneja errores HTTP
+
+# Función que hace una petición HTTP directa a Google Drive respetando el límite de cuota
+# Los errores transitorios (cuota, 5xx, red) se reintentan; el resto de respuestas se devuelven tal cual
+def drive_request(method, url, **kwargs):
+    def send():
+        response = authed_session.request(method, url, **kwargs)
+        if response.status_code in google_api.RETRYABLE_STATUS or response.status_code == 403:
+            error = requests.HTTPError(f"{response.status_code} from Drive", response=response)
+            if google_api.is_retryable(error):
+                response.close()
+                raise error
+        return response
+    return google_api.call(send)
+
+# Función para abrir una descarga en streaming de un archivo de Google Drive por su ID
+def open_drive_stream(file_id, range_header=None):
+    headers = {'Accept-Encoding': 'identity'}  # Sin compresión, para que Content-Length coincida con los bytes enviados
+    if range_header and RANGE_HEADER_RE.match(range_header) and range_header != 'bytes=-':
+        headers['Range'] = range_header  # Reenvía el rango solicitado por el cliente a Google Drive
+    response = drive_request(
+        'GET', f"{DRIVE_FILES_URL}/{file_id}",
+        params={'alt': 'media'},
+        headers=headers,
+        stream=True
+    )  # Abre la descarga sin leer todavía el contenido
+    if response.status_code in (200, 206, 404, 416):
+        return response
+    response.close()
+    response.raise_for_status()  # Cualquier otro error se propaga como excepción
+    return response
+
+# Función para obtener los metadatos de un archivo de salida buscado por nombre, incluidas sus versiones comprimidas
+# Devuelve la versión modificada más recientemente y el método con el que está comprimida (None si no lo está)
+def find_output_file(folder_name, file_name):
     folder = find_folder_by_name(folder_name)  # Encuentra la carpeta destino en Google Drive
     if folder:
+        names = {file_name: None}
+        names.update({compression.compressed_name(file_name, method): method for method in compression.SUFFIXES})
+        name_filter = " or ".join(f"name='{escape_query_value(name)}'" for name in names)
         try:
-            file_list = drive_service.files().list(
-                q=f"name='{file_name}' and '{folder['id']}' in parents and trashed=false",
-                fields="files(id, name)"
-            ).execute().get('files', [])  # Busca el archivo dentro de la carpeta
-            if file_list:
-                file_id = file_list[0]['id']
-                request = drive_service.files().get_media(fileId=file_id)
-                fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
-                done = False
-                while not done:
-                    status, done = downloader.next_chunk()  # Descarga el archivo desde Google Drive
-                fh.seek(0)
-                return fh.read()  # Devuelve el contenido del archivo descargado
-            else:
-                raise HTTPException(status_code=404, detail=f"File '{file_name}' not found in folder '{folder_name}'")
+            results = google_api.execute(get_drive_service().files().list(
+                q=f"'{escape_query_value(folder['id'])}' in parents and trashed=false and ({name_filter})",
+                fields=f"files({FILE_METADATA_FIELDS})",
+                orderBy='modifiedTime desc',
+                pageSize=len(names)
+            ))  # Una sola consulta para el archivo y sus versiones comprimidas
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")  # Maneja errores HTTP
+        files = results.get('files', [])
+        if not files:
+            raise HTTPException(status_code=404, detail=f"File '{file_name}' not found in folder '{folder_name}'")
+        return files[0], names[files[0]['name']]
     else:
         raise HTTPException(status_code=404, detail=f"Folder '{folder_name}' not found")  # Maneja errores HTTP
 
-# Función para listar archivos dentro de una carpeta específica en Google Drive
-def list_files_in_folder(folder_name):
+# Función para abrir la descarga en streaming de un archivo de Google Drive, con un rango opcional
+def download_file_from_drive(file_id, range_header=None):
+    try:
+        response = open_drive_stream(file_id, range_header)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")  # Maneja errores HTTP
+    if response.status_code in (404, 416):
+        response.close()
+        if response.status_code == 404:
+            raise HTTPException(status_code=404, detail=f"File '{file_id}' not found")
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable")
+    return response  # Devuelve la respuesta de Google Drive lista para leer por trozos
+
+# Función que cuenta los bytes descargados de Google Drive a medida que pasan los trozos
+def count_drive_bytes(chunks):
+    for chunk in chunks:
+        metrics.inc('drive_bytes_total', len(chunk), direccion='descarga')
+        yield chunk
+
+# Función que descarga un archivo completo de Google Drive en una ruta local, usada para llenar la caché en disco
+def fill_from_drive(file_id, path):
+    response = open_drive_stream(file_id)
+    try:
+        response.raise_for_status()
+        with open(path, 'wb') as f:
+            for chunk in count_drive_bytes(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)):
+                f.write(chunk)
+    finally:
+        response.close()
+
+# Función que construye las cabeceras de validación de caché HTTP de un archivo
+# variant distingue las representaciones de un mismo archivo (por ejemplo, la descomprimida)
+def validation_headers(drive_file, variant=''):
+    etag = drive_file.get('md5Checksum') or download_cache.cache_key(drive_file)
+    headers = {'ETag': f'"{etag}{variant}"', 'Accept-Ranges': 'bytes'}
+    if 'modifiedTime' in drive_file:
+        modified = datetime.fromisoformat(drive_file['modifiedTime'].replace('Z', '+00:00'))
+        headers['Last-Modified'] = format_datetime(modified, usegmt=True)
+    return headers
+
+# Función que comprueba si alguna de las ETag de If-None-Match coincide con la del archivo
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates
+
+# Función que comprueba si el cliente admite una codificación según su cabecera Accept-Encoding
+def accepts_encoding(accept_encoding, encoding):
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() in (encoding, '*'):
+            quality = params.strip().removeprefix('q=')
+            try:
+                return not params or float(quality) > 0
+            except ValueError:
+                return True
+    return False
+
+# Función que interpreta una cabecera Range sobre un archivo local de tamaño conocido
+def parse_range(range_header, size):
+    if not range_header or not RANGE_HEADER_RE.match(range_header) or range_header == 'bytes=-':
+        return None  # Sin rango válido se envía el archivo completo
+    first, last = range_header[len('bytes='):].split('-')
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1  # Rango final: los últimos N bytes
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={'Content-Range': f'bytes */{size}'})
+    return start, end
+
+# Función que lee un fragmento de un archivo ya abierto trozo a trozo y lo cierra al terminar
+# Se lee del descriptor abierto, así que la caché puede expulsar el archivo mientras se envía
+def iter_file_range(f, start, end, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+# Respuesta que envía un fragmento de un archivo ya abierto de la caché en disco
+# Si el servidor ASGI admite la extensión http.response.zerocopysend, el propio servidor lo envía con sendfile
+# desde el descriptor, sin copiarlo a memoria; si no, se lee con pread en el pool de hilos, igual que FileResponse.
+# No se usa FileResponse porque abre el archivo por su ruta y la caché puede haberlo expulsado ya
+class OpenFileResponse(StreamingResponse):
+    def __init__(self, f, start, end, status_code=200, headers=None):
+        self.file = f  # Descriptor abierto por la caché; se cierra al terminar la respuesta
+        self.start = start
+        self.length = end - start + 1
+        self.zerocopy = False
+        super().__init__(iter(()), status_code=status_code, headers=headers, media_type='application/octet-stream')
+
+    async def __call__(self, scope, receive, send):
+        self.zerocopy = 'http.response.zerocopysend' in scope.get('extensions', {})
+        try:
+            await super().__call__(scope, receive, send)  # Gestiona además la desconexión del cliente
+        finally:
+            self.file.close()
+
+    async def stream_response(self, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if self.zerocopy:
+            await send({"type": "http.response.zerocopysend", "file": self.file, "offset": self.start,
+                        "count": self.length, "more_body": False})  # Envío directo desde disco (sendfile)
+            return
+        loop = asyncio.get_running_loop()
+        offset, remaining = self.start, self.length
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, os.pread, self.file.fileno(), min(DOWNLOAD_CHUNK_SIZE, remaining), offset)
+            if not chunk:
+                break
+            offset += len(chunk)
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+# Función que envía un archivo abierto de la caché en disco, completo o solo el rango pedido
+def cached_file_response(f, range_header, headers):
+    size = os.fstat(f.fileno()).st_size
+    try:
+        byte_range = parse_range(range_header, size)
+    except HTTPException:
+        f.close()
+        raise
+    if byte_range is None:
+        return OpenFileResponse(f, 0, size - 1, headers=dict(headers, **{'Content-Length': str(size)}))
+    start, end = byte_range
+    headers = dict(headers, **{'Content-Range': f'bytes {start}-{end}/{size}', 'Content-Length': str(end - start + 1)})
+    return OpenFileResponse(f, start, end, status_code=206, headers=headers)
+
+# Función que recorre la descarga de Google Drive trozo a trozo y la cierra al terminar
+async def iter_drive_stream(response, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    chunks = count_drive_bytes(response.iter_content(chunk_size=chunk_size))
+    try:
+        while True:
+            chunk = await run_in_drive_executor(next, chunks, None)  # Lee el siguiente trozo en el pool de hilos
+            if chunk is None:
+                break
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+# Función que descomprime al vuelo una descarga de Google Drive y la cierra al terminar
+def iter_drive_decompressed(response, method):
+    try:
+        yield from compression.iter_decompressed(
+            count_drive_bytes(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)), method
+        )
+    finally:
+        response.close()
+
+# Función para construir la consulta de Google Drive con los filtros de un listado
+def build_list_query(folder_id, name_prefix=None, modified_since=None):
+    query = f"'{escape_query_value(folder_id)}' in parents and trashed=false"
+    if name_prefix:
+        # En Drive, "contains" sobre el nombre compara prefijos de palabras; el prefijo exacto se comprueba después
+        query += f" and name contains '{escape_query_value(name_prefix)}'"
+    if modified_since:
+        query += f" and modifiedTime > '{modified_since.isoformat()}'"
+    return query
+
+# Función que comprueba los filtros que Google Drive no puede aplicar en la consulta
+def matches_list_filters(file, name_prefix=None, min_size=None, max_size=None):
+    if name_prefix and not file['name'].startswith(name_prefix):
+        return False
+    size = int(file['size']) if 'size' in file else None  # Los documentos nativos de Google no tienen tamaño
+    if min_size is not None and (size is None or size < min_size):
+        return False
+    if max_size is not None and (size is None or size > max_size):
+        return False
+    return True
+
+# Función para listar una página de archivos dentro de una carpeta específica en Google Drive
+def list_files_in_folder(folder_name, page_size=LIST_PAGE_SIZE, cursor=None, name_prefix=None,
+                         modified_since=None, min_size=None, max_size=None):
     folder = find_folder_by_name(folder_name)  # Encuentra la carpeta destino en Google Drive
     if folder:
         try:
-            results = drive_service.files().list(
-                q=f"'{folder['id']}' in parents and trashed=false",
-                fields="files(id, name)"
-            ).execute()  # Obtiene la lista de archivos dentro de la carpeta
-            files = results.get('files', [])
-            return {"files": files}  # Devuelve la lista de archivos
+            results = google_api.execute(get_drive_service().files().list(
+                q=build_list_query(folder['id'], name_prefix, modified_since),
+                fields=LIST_FIELDS,
+                pageSize=page_size,
+                pageToken=cursor,
+                orderBy='name'
+            ))  # Obtiene una página de archivos dentro de la carpeta
+            files = [
+                file for file in results.get('files', [])
+                if matches_list_filters(file, name_prefix, min_size, max_size)
+            ]
+            return {"files": files, "next_cursor": results.get('nextPageToken')}  # Devuelve la página y el cursor de la siguiente
+        except HttpError as e:
+            if cursor and e.resp.status == 400:
+                raise HTTPException(status_code=400, detail="Invalid cursor")  # Cursor caducado o manipulado
+            raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")  # Maneja errores HTTP
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")  # Maneja errores HTTP
     else:
         raise HTTPException(status_code=404, detail=f"Folder '{folder_name}' not found")  # Maneja errores HTTP
 
+# Función que recorre todas las páginas de un listado y emite un archivo por línea en formato NDJSON
+async def iter_files_ndjson(folder_name, page, **filters):
+    while True:
+        for file in page['files']:
+            yield json.dumps(file) + "\n"
+        if not page['next_cursor']:
+            break
+        page = await run_in_drive_executor(
+            functools.partial(list_files_in_folder, folder_name, LIST_MAX_PAGE_SIZE, page['next_cursor'], **filters)
+        )  # Pide la siguiente página sin bloquear el bucle de eventos
+
+# Función que elige los archivos de una exportación: por nombre, por prefijo y/o modificados desde una fecha
+# Devuelve los metadatos del archivo más reciente de cada nombre y los nombres pedidos que no existen
+def select_export_files(folder_name, file_names=None, name_prefix=None, modified_since=None):
+    folder = find_folder_by_name(folder_name)  # Encuentra la carpeta en Google Drive
+    if not folder:
+        raise HTTPException(status_code=404, detail=f"Folder '{folder_name}' not found")  # Maneja errores HTTP
+    base_query = build_list_query(folder['id'], name_prefix, modified_since)
+    if file_names:
+        # Cada nombre pedido puede estar en Drive tal cual o comprimido por output_uploader.py
+        requested = {}
+        for name in file_names:
+            requested[name] = name
+            requested.update({compression.compressed_name(name, method): name for method in compression.SUFFIXES})
+        candidates = list(requested)
+        queries = []
+        for start in range(0, len(candidates), EXPORT_NAMES_PER_QUERY * (len(compression.SUFFIXES) + 1)):
+            names = candidates[start:start + EXPORT_NAMES_PER_QUERY * (len(compression.SUFFIXES) + 1)]
+            queries.append(base_query + " and (" + " or ".join(f"name='{escape_query_value(n)}'" for n in names) + ")")
+    else:
+        requested = None
+        queries = [base_query]
+
+    selected = {}
+    try:
+        for query in queries:
+            cursor = None
+            while True:
+                results = google_api.execute(get_drive_service().files().list(
+                    q=query,
+                    fields=f"nextPageToken, files({FILE_METADATA_FIELDS})",
+                    pageSize=LIST_MAX_PAGE_SIZE,
+                    pageToken=cursor,
+                    orderBy='modifiedTime desc'
+                ))  # Del más reciente al más antiguo: el primero de cada nombre es el que se exporta
+                for file in results.get('files', []):
+                    if not matches_list_filters(file, name_prefix):
+                        continue
+                    key = requested[file['name']] if requested is not None else file['name']
+                    selected.setdefault(key, file)
+                if len(selected) > EXPORT_MAX_FILES:
+                    raise HTTPException(status_code=413, detail=f"Export is limited to {EXPORT_MAX_FILES} files")
+                cursor = results.get('nextPageToken')
+                if not cursor:
+                    break
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing files: {str(e)}")  # Maneja errores HTTP
+    missing = sorted(set(file_names) - set(selected)) if file_names else []
+    return [selected[key] for key in sorted(selected)], missing
+
+# Destino de escritura de zipfile que guarda los bytes generados hasta que se envían al cliente
+# Como no admite seek, zipfile escribe cada miembro seguido de su descriptor de datos, sin volver atrás
+class ZipStreamBuffer:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+# Función que recorre el contenido de un miembro de la exportación, desde la caché en disco si está o desde Google Drive
+def iter_export_member(drive_file):
+    f = disk_cache.open(download_cache.cache_key(drive_file))
+    if f is not None:
+        yield from iter_file_range(f, 0, os.fstat(f.fileno()).st_size - 1)
+        return
+    response = download_file_from_drive(drive_file['id'])  # Abre la descarga en streaming
+    try:
+        yield from count_drive_bytes(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
+    finally:
+        response.close()
+
+# Función que abre un miembro de la exportación y lee su primer trozo, ejecutada por adelantado en el pool de hilos
+def open_export_member(drive_file):
+    chunks = iter_export_member(drive_file)
+    first = next(chunks, None)
+    return first, chunks
+
+# Función que copia el siguiente trozo de un miembro al ZIP; devuelve False al terminar el miembro
+def copy_export_chunk(chunks, member):
+    chunk = next(chunks, None)
+    if chunk is None:
+        return False
+    member.write(chunk)  # Comprime el trozo en el mismo hilo que lo ha leído
+    return True
+
+# Función que construye la entrada del ZIP de un archivo de Google Drive
+def export_zip_info(drive_file):
+    name = drive_file['name'].replace('/', '_').replace('\\', '_')  # Sin directorios dentro del ZIP
+    modified = datetime.fromisoformat(drive_file['modifiedTime'].replace('Z', '+00:00'))
+    info = zipfile.ZipInfo(name, date_time=max(modified.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+    already_compressed = any(name.endswith(suffix) for suffix in compression.SUFFIXES.values())
+    info.compress_type = zipfile.ZIP_DEFLATED if EXPORT_DEFLATE and not already_compressed else zipfile.ZIP_STORED
+    info.file_size = int(drive_file.get('size', 0))  # Tamaño previsto, para decidir si hace falta ZIP64
+    info.external_attr = 0o644 << 16  # Permisos del archivo al extraerlo
+    return info
+
+# Función que cierra la descarga de un miembro, esperando si un hilo del pool todavía está leyendo de ella
+def close_export_member(chunks, step=None):
+    if step is not None and not step.done():
+        step.add_done_callback(lambda _: chunks.close())
+    else:
+        chunks.close()
+
+# Función que cierra una descarga adelantada que ya no se va a usar
+def discard_export_member(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[1].close()
+
+# Función que genera el ZIP de una exportación a medida que se envía
+# Mientras se escribe un miembro, los EXPORT_PREFETCH siguientes ya se están descargando en el pool de hilos,
+# así que en memoria solo hay un trozo por archivo adelantado más el que se está comprimiendo
+async def iter_zip_export(files, missing):
+    loop = asyncio.get_running_loop()
+    buffer = ZipStreamBuffer()
+    archive = zipfile.ZipFile(buffer, 'w', allowZip64=True)
+    pending = []  # (metadatos, descarga adelantada) en el orden del ZIP
+    remaining = iter(files)
+    errors = [f"{name}: no encontrado" for name in missing]
+
+    def prefetch():
+        while len(pending) < max(1, EXPORT_PREFETCH):
+            drive_file = next(remaining, None)
+            if drive_file is None:
+                break
+            pending.append((drive_file, loop.run_in_executor(drive_executor, open_export_member, drive_file)))
+
+    try:
+        prefetch()
+        while pending:
+            drive_file, future = pending.pop(0)
+            prefetch()
+            try:
+                first, chunks = await future
+            except Exception as e:
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                errors.append(f"{drive_file['name']}: {detail}")
+                metrics.inc('export_files_total', resultado='error')
+                continue
+            member = archive.open(export_zip_info(drive_file), 'w')
+            step = None
+            try:
+                if first is not None:
+                    step = loop.run_in_executor(drive_executor, member.write, first)
+                    await step
+                    yield buffer.drain()
+                    while True:
+                        step = loop.run_in_executor(drive_executor, copy_export_chunk, chunks, member)
+                        if not await step:
+                            break
+                        yield buffer.drain()  # Envía lo generado antes de leer el siguiente trozo
+                member.close()  # Escribe el descriptor de datos con el CRC y los tamaños
+            finally:
+                close_export_member(chunks, step)
+            metrics.inc('export_files_total', resultado='ok')
+            yield buffer.drain()
+        if errors:
+            archive.writestr(EXPORT_ERRORS_NAME, "\n".join(errors) + "\n")
+        archive.close()  # Escribe el directorio central
+        yield buffer.drain()
+    finally:
+        # Si el cliente se desconecta, se cierran las descargas que ya estaban adelantadas
+        for _, future in pending:
+            future.add_done_callback(discard_export_member)
+
+# Función común de los endpoints de exportación
+async def export_Output_scrips(file_names, name_prefix, modified_since):
+    file_names = [name for name in (file_names or []) if name]
+    if not (file_names or name_prefix or modified_since):
+        raise HTTPException(status_code=400, detail="Specify file_name, name_prefix or modified_since")
+    files, missing = await run_in_drive_executor(
+        select_export_files, "Output_scrips", file_names, name_prefix, modified_since
+    )  # Resuelve la carpeta y los archivos con una consulta por cada grupo de nombres
+    if not files and file_names:
+        raise HTTPException(status_code=404, detail="None of the requested files exist in folder 'Output_scrips'")
+    archive_name = f"Output_scrips-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    headers = {
+        'Content-Disposition': f'attachment; filename="{archive_name}"',
+        'X-Export-Files': str(len(files)),  # Archivos incluidos
+        'X-Export-Missing': str(len(missing)),  # Nombres pedidos que no existen, listados en _errores.txt
+    }
+    return StreamingResponse(iter_zip_export(files, missing), headers=headers, media_type='application/zip')
+
+# Endpoint para descargar en un único ZIP varios archivos de la carpeta Output_scrips
+# Acepta una lista de nombres (file_name repetido), un prefijo y/o una fecha mínima de modificación
+@app.get("/export_Output_scrips/")
+async def export_Output_scrips_get(file_name: Optional[List[str]] = Query(None), name_prefix: Optional[str] = None,
+                                   modified_since: Optional[datetime] = None):
+    return await export_Output_scrips(file_name, name_prefix, modified_since)
+
+# Endpoint equivalente para listas de nombres demasiado largas para la URL: {"file_names": [...]} en el cuerpo
+@app.post("/export_Output_scrips/")
+async def export_Output_scrips_post(request: Request, name_prefix: Optional[str] = None,
+                                    modified_since: Optional[datetime] = None):
+    try:
+        body = await request.json() if await request.body() else {}
+        file_names = body.get('file_names') or []
+        if not isinstance(file_names, list) or not all(isinstance(name, str) for name in file_names):
+            raise ValueError
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail='Body must be {"file_names": ["..."]}')
+    return await export_Output_scrips(file_names, name_prefix, modified_since)
+
 # Endpoint para subir archivos a la carpeta Scrips_download
 @app.post("/upload_to_Scrips_download/")
-async def upload_to_Scrips_download(file: UploadFile = File(...)):
-    return upload_file_to_drive("Scrips_download", file)  # Llama a la función para subir archivo a Google Drive
+async def upload_to_Scrips_download(file: UploadFile = File(...), upsert: bool = False):
+    return await run_in_drive_executor(upload_file_to_drive, "Scrips_download", file, upsert)  # Llama a la función para subir archivo a Google Drive
+
+# Endpoint para iniciar una subida reanudable a la carpeta Scrips_download
+@app.post("/upload_to_Scrips_download/resumable/")
+async def start_resumable_upload(file_name: str, size: int, content_type: str = 'application/octet-stream',
+                                 upsert: bool = False):
+    return await run_in_drive_executor(create_resumable_upload, "Scrips_download", file_name, size, content_type, upsert)
+
+# Endpoint para enviar un trozo de una subida reanudable, indicado con la cabecera Content-Range
+@app.put("/upload_to_Scrips_download/resumable/{upload_id}")
+async def upload_resumable_chunk(upload_id: str, request: Request):
+    session = get_upload_session(upload_id)
+    match = CONTENT_RANGE_RE.match(request.headers.get('content-range', ''))
+    if not match:
+        raise HTTPException(status_code=400, detail="Missing or invalid Content-Range header")
+    start, end, total = map(int, match.groups())
+    length = end - start + 1
+    if total != session['size'] or end < start or end >= total:
+        raise HTTPException(status_code=400, detail="Content-Range does not match the upload size")
+    if end + 1 < total and length % UPLOAD_CHUNK_GRANULARITY:
+        raise HTTPException(status_code=400, detail=f"Chunk size must be a multiple of {UPLOAD_CHUNK_GRANULARITY} bytes")
+
+    claim_upload_session(session)  # La comprobación del desplazamiento, el envío y la actualización se hacen sin otras peticiones de la subida
+    try:
+        if start != session['offset']:
+            # El cliente debe continuar desde el último desplazamiento confirmado
+            raise HTTPException(status_code=409, detail={"offset": session['offset']})
+        chunk = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)  # Guarda el trozo en memoria o en disco según su tamaño
+        received = 0
+        async for data in request.stream():
+            received += len(data)
+            if received > length:
+                chunk.close()
+                raise HTTPException(status_code=400, detail="Body larger than Content-Range")
+            chunk.write(data)
+        if received != length:
+            chunk.close()
+            raise HTTPException(status_code=400, detail="Body shorter than Content-Range")
+        chunk.seek(0)
+        return await run_in_drive_executor(put_resumable_chunk, session, chunk, start, length)
+    finally:
+        release_upload_session(session)  # Libera la sesión aunque el trozo haya fallado
+
+# Endpoint para consultar el desplazamiento confirmado de una subida reanudable
+@app.get("/upload_to_Scrips_download/resumable/{upload_id}")
+async def resumable_upload_status(upload_id: str):
+    session = get_upload_session(upload_id)
+    claim_upload_session(session)  # La consulta también actualiza el desplazamiento
+    try:
+        return await run_in_drive_executor(query_resumable_upload, session)
+    finally:
+        release_upload_session(session)
+
+# Endpoint para finalizar una subida reanudable y obtener el ID del archivo subido
+@app.post("/upload_to_Scrips_download/resumable/{upload_id}/finalize")
+async def finalize_resumable_upload(upload_id: str):
+    session = get_upload_session(upload_id)
+    claim_upload_session(session)  # No se finaliza mientras se envía un trozo
+    try:
+        status = await run_in_drive_executor(query_resumable_upload, session)
+    finally:
+        release_upload_session(session)
+    if not status['complete']:
+        raise HTTPException(status_code=409, detail={"offset": status['offset']})
+    with upload_sessions_lock:
+        upload_sessions.pop(upload_id, None)
+    return {"file_id": status['file_id']}
 
 # Endpoint para descargar archivos de la carpeta Output_scrips
 @app.get("/download_from_Output_scrips/")
-async def download_from_Output_scrips(file_name: str):
-    file_content = download_file_from_drive("Output_scrips", file_name)  # Llama a la función para descargar archivo de Google Drive
-    return Response(content=file_content, media_type='application/octet-stream')  # Devuelve el contenido del archivo como respuesta
+async def download_from_Output_scrips(file_name: str, request: Request):
+    drive_file, encoding = await run_in_drive_executor(find_output_file, "Output_scrips", file_name)  # Obtiene los metadatos actuales del archivo
+    # Las salidas comprimidas se envían tal cual si el cliente admite su codificación y, si no, descomprimidas
+    decompress = encoding is not None and not accepts_encoding(request.headers.get('accept-encoding'), encoding)
+    headers = validation_headers(drive_file, '-identity' if decompress else '')
+    if encoding:
+        headers['Vary'] = 'Accept-Encoding'
+        if decompress:
+            headers['Accept-Ranges'] = 'none'  # El tamaño descomprimido no se conoce de antemano
+        else:
+            headers['Content-Encoding'] = encoding
+    if etag_matches(request.headers.get('if-none-match'), headers['ETag']):
+        return Response(status_code=304, headers=headers)  # El cliente ya tiene esta versión
+
+    range_header = None if decompress else request.headers.get('range')
+    size = int(drive_file.get('size', -1))
+    if 0 <= size <= DOWNLOAD_CACHE_MAX_FILE:
+        try:
+            f = await run_in_drive_executor(
+                disk_cache.fetch, download_cache.cache_key(drive_file), functools.partial(fill_from_drive, drive_file['id'])
+            )  # Descarga el archivo a la caché en disco si no estaba y lo abre; las peticiones simultáneas comparten la descarga
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")  # Maneja errores HTTP
+        if decompress:
+            return StreamingResponse(
+                compression.iter_decompressed(iter_file_range(f, 0, size - 1), encoding),
+                headers=headers,
+                media_type='application/octet-stream'
+            )
+        return cached_file_response(f, range_header, headers)
+
+    # Archivos grandes: se envían en streaming desde Google Drive sin pasar por la caché
+    drive_response = await run_in_drive_executor(
+        download_file_from_drive, drive_file['id'], range_header
+    )  # Llama a la función para descargar archivo de Google Drive
+    if decompress:
+        return StreamingResponse(
+            iter_drive_decompressed(drive_response, encoding),
+            headers=headers,
+            media_type='application/octet-stream'
+        )
+    for header in ('Content-Length', 'Content-Range'):
+        if header in drive_response.headers:
+            headers[header] = drive_response.headers[header]  # Propaga el tamaño y el rango devueltos por Google Drive
+    return StreamingResponse(
+        iter_drive_stream(drive_response),
+        status_code=drive_response.status_code,
+        headers=headers,
+        media_type='application/octet-stream'
+    )  # Envía el contenido del archivo al cliente a medida que llega
 
 # Endpoint para listar archivos en la carpeta Output_scrips
 @app.get("/list_Output_scrips/")
-async def list_Output_scrips_files():
-    return list_files_in_folder("Output_scrips")  # Llama a la función para listar archivos en Google Drive
+async def list_Output_scrips_files(page_size: int = LIST_PAGE_SIZE, cursor: Optional[str] = None,
+                                   name_prefix: Optional[str] = None, modified_since: Optional[datetime] = None,
+                                   min_size: Optional[int] = None, max_size: Optional[int] = None,
+                                   format: str = 'json'):
+    page_size = max(1, min(page_size, LIST_MAX_PAGE_SIZE))
+    filters = dict(name_prefix=name_prefix, modified_since=modified_since, min_size=min_size, max_size=max_size)
+    if format == 'ndjson':
+        page_size = LIST_MAX_PAGE_SIZE  # Para recorrer la carpeta entera se usan las páginas más grandes posibles
+    page = await run_in_drive_executor(
+        functools.partial(list_files_in_folder, "Output_scrips", page_size, cursor, **filters)
+    )  # Llama a la función para listar archivos en Google Drive
+    if format == 'ndjson':
+        # Recorre la carpeta entera enviando cada archivo según llega, sin acumular el listado
+        return StreamingResponse(iter_files_ndjson("Output_scrips", page, **filters), media_type='application/x-ndjson')
+    return page
+
+# Función que pasa una fecha con zona horaria a la hora local sin zona, la misma que usan las programaciones de cron
+# Las fechas sin zona se consideran ya en hora local
+def local_naive(value):
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo is not None else value
+
+# Obtener la previsión y el intervalo consultado, por defecto desde ahora y durante FORECAST_WINDOW
+def get_forecast_range(start, end):
+    forecast = schedule_forecast.load_forecast()  # Reutiliza el índice mientras no cambie el fichero de cron_job.py
+    if forecast is None:
+        raise HTTPException(status_code=503, detail="Schedule forecast not available yet; cron_job.py has not run")
+    start = local_naive(start) if start else datetime.now()  # Las programaciones de cron están en hora local
+    end = local_naive(end) if end else start + FORECAST_WINDOW
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be later than start")
+    if start < forecast.start or end > forecast.end:
+        raise HTTPException(status_code=400, detail=f"Forecast covers {forecast.start.isoformat()} to {forecast.end.isoformat()}")
+    return forecast, start, end
+
+# Endpoint con las ejecuciones previstas entre start y end
+@app.get("/schedule_forecast/")
+async def get_schedule_forecast(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                limit: int = FORECAST_MAX_RESULTS):
+    forecast, start, end = get_forecast_range(start, end)
+    limit = max(1, min(limit, FORECAST_MAX_RESULTS))
+    runs = forecast.between(start, end, limit=limit)  # Dos búsquedas binarias en el índice ordenado
+    total = forecast.count(start, end)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total": total,
+        "truncated": total > len(runs),
+        "runs": [{"time": moment.isoformat(), "id": job_id} for moment, job_id in runs],
+    }
+
+# Endpoint con el histograma de ejecuciones por intervalo de bucket minutos entre start y end
+# Con top, solo los intervalos con más carga, de mayor a menor
+@app.get("/schedule_forecast/histogram/")
+async def get_schedule_forecast_histogram(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                          bucket: int = 1, top: Optional[int] = None):
+    forecast, start, end = get_forecast_range(start, end)
+    bucket = max(1, bucket)
+    if top:
+        buckets = forecast.peaks(start, end, top, bucket)
+    else:
+        buckets = forecast.histogram(start, end, bucket)
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "bucket_minutes": bucket,
+        "max_per_minute": schedule_forecast.STAGGER_MAX,  # Límite a partir del cual cron_job.py escalona las tareas
+        "buckets": [{"time": moment.isoformat(), "runs": runs} for moment, runs in buckets],
+    }
+
+# Los endpoints del histórico no son async: FastAPI ejecuta cada consulta a SQLite en su pool de hilos
+# Endpoint con las ejecuciones, fallos y duraciones p50 y p95 de cada tarea en los últimos days días
+@app.get("/run_history/")
+def get_run_history(days: float = HISTORY_DAYS):
+    since = time.time() - max(0, days) * 86400
+    return {"since": run_history.format_time(since), "jobs": run_history.summary(since)}
+
+# Endpoint con las últimas ejecuciones fallidas de cualquier tarea
+@app.get("/run_history/failures/")
+def get_run_history_failures(days: float = HISTORY_DAYS, limit: int = 50):
+    since = time.time() - max(0, days) * 86400
+    return {"since": run_history.format_time(since),
+            "runs": run_history.recent_failures(since, max(1, min(limit, HISTORY_MAX_RESULTS)))}
+
+# Endpoint con las tareas cuya duración p50 de los últimos days días ha crecido respecto a los days anteriores
+@app.get("/run_history/slower/")
+def get_slower_jobs(days: float = HISTORY_DAYS, min_ratio: float = 1.2, min_runs: int = 3):
+    return {"days": days, "jobs": run_history.slower_jobs(max(0.01, days), min_ratio, max(1, min_runs))}
+
+# Endpoint con las estadísticas y las últimas ejecuciones de una tarea
+@app.get("/run_history/{job_id}")
+def get_job_run_history(job_id: str, days: float = HISTORY_DAYS, recent: int = 10):
+    stats = run_history.job_stats(job_id, time.time() - max(0, days) * 86400, max(1, min(recent, HISTORY_MAX_RESULTS)))
+    if not stats['ejecuciones']:
+        raise HTTPException(status_code=404, detail=f"No runs recorded for job '{job_id}' in the last {days:g} days")
+    return stats
+
+# Middleware que mide la latencia de cada petición, agrupada por ruta para no multiplicar las series
+@app.middleware("http")
+async def measure_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get('route')
+        metrics.observe(
+            'http_request_seconds', time.perf_counter() - start,
+            metodo=request.method, ruta=getattr(route, 'path', 'desconocida'), estado=status
+        )
+
+# Endpoint con las métricas de la API y de los demás procesos en formato Prometheus
+@app.get("/metrics")
+async def prometheus_metrics():
+    snapshots = [("fastapi", metrics.registry.snapshot())] + metrics.load_dumps(exclude=("fastapi",))
+    return PlainTextResponse(metrics.render_prometheus(snapshots), media_type='text/plain; version=0.0.4')
+
+# Monta el webhook del bot de Telegram junto a la API si está activado
+if os.environ.get('TELEGRAM_WEBHOOK') == '1':
+    import config_telebot  # Importa el bot solo cuando se sirve su webhook desde esta aplicación
+    app.mount('/telegram', config_telebot.webhook_app)  # Recibe las actualizaciones en /telegram/webhook
+
+    @app.on_event("startup")
+    def start_telegram_bot():
+        config_telebot.start_bot_services()
+
+# Cierra el pool de hilos de Google Drive al detener la aplicación
+@app.on_event("shutdown")
+def shutdown_drive_executor():
+    drive_executor.shutdown(wait=False)
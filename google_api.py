@@ -0,0 +1,341 @@
+#
+# google_api.py
+#
+# Capa común para todas las llamadas a las APIs de Google (Drive y Sheets).
+#
+# La usan drive_uploader_downloader.py, fastapi-web.py y sheet_snapshot.py
+# (y, a través de ellos, cron_job.py y config_telebot.py). Cada llamada:
+#
+#   - espera su turno en un limitador de tasa (token bucket) compartido por
+#     todos los procesos de la máquina mediante un pequeño fichero con
+#     bloqueo, de modo que las transferencias en paralelo y el resto del
+#     tráfico no superan juntos la cuota;
+#   - se reintenta con espera exponencial y jitter si Google responde con un
+#     error de cuota (429, 403 userRateLimitExceeded/rateLimitExceeded), un
+#     error 5xx o un fallo de red.
+#
+# Los reintentos y las esperas del limitador se cuentan en counters() y, junto
+# con la latencia de cada llamada, en las métricas de metrics.py.
+#
+# GOOGLE_API_ROOT y GOOGLE_SHEETS_API_ROOT permiten enviar todas las peticiones
+# a otros servidores (los falsos de bench/, por ejemplo) sin cambiar el código
+# de los clientes: las conexiones creadas con http() y redirect_session()
+# reescriben la URL de cada petición.
+#
+
+import fcntl
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+
+import metrics
+import paths
+
+try:
+    import httplib2
+except ImportError:  # solo hace falta para las conexiones de googleapiclient y PyDrive
+    httplib2 = None
+
+try:
+    import requests
+except ImportError:  # solo hace falta para reconocer los errores de red de requests
+    requests = None
+
+# Límite compartido de llamadas; se puede ajustar con variables de entorno
+RATE = float(os.environ.get("GOOGLE_API_RATE", 10))  # llamadas por segundo entre todos los procesos
+BURST = float(os.environ.get("GOOGLE_API_BURST", 20))  # llamadas seguidas permitidas antes de esperar
+QUOTA_FILE = os.environ.get("GOOGLE_API_QUOTA_FILE", paths.admin_path("google_api_quota"))  # estado del limitador
+
+# Reintentos
+MAX_RETRIES = int(os.environ.get("GOOGLE_API_MAX_RETRIES", 5))
+BASE_DELAY = 1.0  # segundos antes del primer reintento
+MAX_DELAY = 64.0  # espera máxima entre reintentos
+
+# Direcciones alternativas de las APIs; vacías para usar las de Google
+API_ROOT = os.environ.get("GOOGLE_API_ROOT")  # sustituye a https://www.googleapis.com/ (Drive)
+SHEETS_API_ROOT = os.environ.get("GOOGLE_SHEETS_API_ROOT")  # sustituye a https://sheets.googleapis.com/
+REDIRECTS = {
+    prefix: root.rstrip("/") + "/"
+    for prefix, root in (("https://www.googleapis.com/", API_ROOT), ("https://sheets.googleapis.com/", SHEETS_API_ROOT))
+    if root
+}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"userRateLimitExceeded", "rateLimitExceeded", "RESOURCE_EXHAUSTED"}
+
+_counters = {"llamadas": 0, "reintentos": 0, "fallos": 0, "esperas": 0, "segundos_espera": 0.0}
+_counters_lock = threading.Lock()
+
+# Nombre de cada contador en /metrics
+METRIC_NAMES = {
+    "llamadas": "google_api_calls_total",
+    "reintentos": "google_api_retries_total",
+    "fallos": "google_api_failures_total",
+    "esperas": "google_api_throttle_waits_total",
+    "segundos_espera": "google_api_throttle_seconds_total",
+}
+
+
+def _count(name, value=1):
+    with _counters_lock:
+        _counters[name] += value
+    metrics.inc(METRIC_NAMES[name], value)
+
+
+def counters():
+    """
+    Copia de los contadores de este proceso: llamadas, reintentos, fallos,
+    esperas del limitador y segundos esperados en él.
+    """
+    with _counters_lock:
+        return dict(_counters)
+
+
+class RateLimiter:
+    """
+    Token bucket compartido entre procesos a través de un fichero con bloqueo.
+
+    Si el fichero no se puede usar, el límite se aplica solo dentro del proceso.
+
+    Argumentos:
+        rate (float): Llamadas por segundo.
+        capacity (float): Llamadas seguidas permitidas.
+        path (str): Fichero donde se guarda el estado del bucket.
+    """
+
+    def __init__(self, rate=RATE, capacity=BURST, path=QUOTA_FILE):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self._fd = None
+        self._state = {"tokens": capacity, "updated": time.time()}  # estado si no hay fichero
+        self._lock = threading.Lock()  # flock no distingue entre hilos del mismo proceso
+
+    def acquire(self):
+        """
+        Espera hasta que haya un token disponible y lo consume.
+
+        Returns:
+            float: Segundos esperados.
+        """
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait = self._try_acquire()
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def _try_acquire(self):
+        # Devuelve 0 si se ha consumido un token, o los segundos que faltan para el siguiente
+        fd = self._open()
+        if fd is None:
+            return self._take(self._state)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            os.lseek(fd, 0, os.SEEK_SET)
+            try:
+                state = json.loads(os.read(fd, 256) or b"null") or {}
+                state = {"tokens": float(state["tokens"]), "updated": float(state["updated"])}
+            except (ValueError, KeyError, TypeError):
+                state = {"tokens": self.capacity, "updated": time.time()}
+            wait = self._take(state)
+            data = json.dumps(state).encode()
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, data)
+            os.ftruncate(fd, len(data))
+            return wait
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _take(self, state):
+        now = time.time()
+        state["tokens"] = min(self.capacity, state["tokens"] + max(0.0, now - state["updated"]) * self.rate)
+        state["updated"] = now
+        if state["tokens"] >= 1:
+            state["tokens"] -= 1
+            return 0.0
+        return (1 - state["tokens"]) / self.rate
+
+    def _open(self):
+        if self._fd is None and self.path:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+            except OSError as e:
+                logging.warning(f"Limitador de la API de Google solo en este proceso ({self.path}: {str(e)})")
+                self.path = None
+        return self._fd
+
+
+limiter = RateLimiter()
+
+
+def redirect_url(url):
+    """
+    URL a la que se envía realmente una petición, según GOOGLE_API_ROOT y GOOGLE_SHEETS_API_ROOT.
+    """
+    for prefix, root in REDIRECTS.items():
+        if url.startswith(prefix):
+            return root + url[len(prefix):]
+    return url
+
+
+def http(timeout=None):
+    """
+    Conexión httplib2 para googleapiclient y PyDrive, redirigida si se han
+    configurado otras direcciones para las APIs.
+    """
+    connection = httplib2.Http(timeout=timeout)
+    if REDIRECTS:
+        request = connection.request
+
+        def redirected_request(uri, *args, **kwargs):
+            return request(redirect_url(uri), *args, **kwargs)
+
+        connection.request = redirected_request
+    return connection
+
+
+def redirect_session(session):
+    """
+    Redirige las peticiones de una sesión de requests si se han configurado
+    otras direcciones para las APIs.
+
+    Returns:
+        requests.Session: La misma sesión.
+    """
+    if REDIRECTS:
+        send = session.send
+
+        def redirected_send(request, **kwargs):
+            request.url = redirect_url(request.url)
+            return send(request, **kwargs)
+
+        session.send = redirected_send
+    return session
+
+
+def redirect_client(client):
+    """
+    Redirige las peticiones de un cliente de gspread, igual que redirect_session().
+
+    Returns:
+        gspread.Client: El mismo cliente.
+    """
+    if REDIRECTS:
+        redirect_session(getattr(client, "http_client", client).session)  # gspread 6 o gspread 5
+    return client
+
+
+def error_status(exc):
+    """
+    Código HTTP y motivo de un error de las bibliotecas de Google, si los tiene.
+
+    Reconoce HttpError de googleapiclient (también envuelto en ApiRequestError
+    de PyDrive), APIError de gspread y HTTPError de requests.
+
+    Returns:
+        tuple: (código, motivo); cualquiera de los dos puede ser None.
+    """
+    if exc.args and isinstance(exc.args[0], Exception):
+        exc = exc.args[0]  # PyDrive envuelve el error original
+    status, content = None, None
+    resp = getattr(exc, "resp", None)  # googleapiclient
+    response = getattr(exc, "response", None)  # gspread y requests
+    if resp is not None and hasattr(resp, "status"):
+        status, content = resp.status, getattr(exc, "content", None)
+    elif response is not None and hasattr(response, "status_code"):
+        status, content = response.status_code, getattr(response, "content", None)
+    reason = None
+    try:
+        error = json.loads(content)["error"]
+        reason = (error.get("errors") or [{}])[0].get("reason") or error.get("status")
+    except (TypeError, ValueError, KeyError, AttributeError, IndexError):
+        pass
+    return (int(status) if status is not None else None), reason
+
+
+def is_retryable(exc):
+    """
+    Indica si un error es transitorio: cuota superada, error del servidor o fallo de red.
+    """
+    network_errors = (ConnectionError, TimeoutError, socket.timeout)
+    if requests is not None:
+        network_errors += (requests.ConnectionError, requests.Timeout)
+    if isinstance(exc, network_errors):
+        return True
+    status, reason = error_status(exc)
+    return status in RETRYABLE_STATUS or (status == 403 and reason in RATE_LIMIT_REASONS)
+
+
+def backoff_delay(attempt):
+    """
+    Espera antes del reintento número `attempt` (desde 0): exponencial con jitter completo.
+    """
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+
+
+def throttle(cost=1):
+    """
+    Consume `cost` llamadas del límite compartido, esperando si hace falta.
+
+    call() ya lo hace por cada llamada; sirve para descontar las operaciones
+    adicionales de una petición agrupada (batch).
+    """
+    for _ in range(int(cost)):
+        waited = limiter.acquire()
+        if waited:
+            _count("esperas")
+            _count("segundos_espera", waited)
+
+
+def api_name(func):
+    """
+    API a la que pertenece una llamada ("sheets" para gspread, "drive" para el resto), para etiquetar su latencia.
+    """
+    owner = getattr(func, "__self__", None)
+    module = type(owner).__module__ if owner is not None else getattr(func, "__module__", "") or ""
+    return "sheets" if module.startswith("gspread") else "drive"
+
+
+def call(func, *args, **kwargs):
+    """
+    Ejecuta una llamada a una API de Google respetando el límite compartido y
+    reintentando los errores transitorios.
+
+    Argumentos:
+        func (callable): Función que hace la llamada, por ejemplo request.execute.
+        *args, **kwargs: Argumentos de la función.
+
+    Returns:
+        El resultado de la función.
+    """
+    api = api_name(func)
+    for attempt in range(MAX_RETRIES + 1):
+        throttle()
+        _count("llamadas")
+        try:
+            with metrics.timer("google_api_request_seconds", api=api):
+                return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                _count("fallos")
+                raise
+            delay = backoff_delay(attempt)
+            _count("reintentos")
+            logging.warning(f"Error transitorio de la API de Google, reintento en {delay:.1f} s: {str(e)}")
+            time.sleep(delay)
+
+
+def execute(request):
+    """
+    Ejecuta una petición de googleapiclient (request.execute()) a través de call().
+    """
+    return call(request.execute)
@@ -0,0 +1,222 @@
+#
+# job_runner.py
+#
+# Ejecutor de las tareas programadas por cron_job.py.
+#
+# Cada línea del crontab llama a este script en lugar de lanzar el script de
+# la hoja directamente. Como muchas filas comparten la misma HORA, el
+# ejecutor limita cuántas tareas corren a la vez en toda la máquina (con
+# ficheros de bloqueo compartidos por todos los procesos), puede retrasar el
+# arranque unos segundos al azar para repartir los picos, corta las tareas que
+# superan su tiempo máximo (columna TIMEOUT de la hoja o JOB_TIMEOUT; sin
+# ninguno de los dos no hay límite) y registra el código de salida, la duración y el
+# pico de memoria (RSS) de cada ejecución en el histórico de run_history.py
+# y en RUN_LOG. Al terminar, encola la salida para
+# que output_uploader.py la suba a Google Drive inmediatamente.
+#
+# En el modo multinodo (ver cluster.py) solo ejecuta la tarea si este nodo
+# tiene su concesión, así que nunca corre en dos máquinas a la vez.
+#
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import cluster
+import output_uploader
+import paths
+import run_history
+import telegram_notifications
+
+# Configuración del ejecutor; se puede ajustar con variables de entorno
+MAX_PARALLEL = int(os.environ.get("JOB_MAX_PARALLEL", os.cpu_count() or 1))  # tareas simultáneas en la máquina
+DEFAULT_TIMEOUT = int(os.environ.get("JOB_TIMEOUT") or 0)  # segundos; 0 (por defecto) para no limitar
+DEFAULT_JITTER = int(os.environ.get("JOB_JITTER", 0))  # segundos máximos de retraso aleatorio al arrancar
+SLOTS_DIR = os.environ.get("JOB_SLOTS_DIR", paths.admin_path("job_slots"))  # ficheros de bloqueo de cada hueco
+OUTPUT_DIR = paths.OUTPUT_DIR
+RUN_LOG = paths.log_path("job_runner.log")  # una línea JSON por ejecución
+
+SLOT_POLL_INTERVAL = 1.0  # segundos entre intentos de conseguir un hueco libre
+KILL_GRACE = 10  # segundos entre SIGTERM y SIGKILL al superar el tiempo máximo
+
+
+# Construir el comando que ejecuta el script según su lenguaje
+def build_command(language, route_script):
+    if language == "python":
+        return ["python3", route_script]
+    return [route_script]
+
+
+# Ocupar uno de los huecos de ejecución, esperando a que quede alguno libre
+# Devuelve el fichero bloqueado, que se libera al cerrarlo (también si el proceso muere)
+def acquire_slot(max_parallel=MAX_PARALLEL, slots_dir=SLOTS_DIR):
+    os.makedirs(slots_dir, exist_ok=True)
+    while True:
+        for slot in random.sample(range(max_parallel), max_parallel):
+            f = open(os.path.join(slots_dir, f"slot-{slot}"), "a")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return f
+            except BlockingIOError:
+                f.close()
+        time.sleep(SLOT_POLL_INTERVAL)
+
+
+# Ejecutar el comando con su salida redirigida, cortándolo si supera el tiempo máximo
+# Devuelve (código de salida, duración en segundos, pico de RSS en KiB, si se ha cortado)
+def run_command(command, output_path, timeout=DEFAULT_TIMEOUT):
+    start = time.monotonic()
+    deadline = start + timeout if timeout else None
+    timed_out = False
+    with open(output_path, "w") as output:
+        # Nuevo grupo de procesos para poder terminar también los procesos hijos del script
+        process = subprocess.Popen(command, stdout=output, start_new_session=True)
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            now = time.monotonic()
+            if deadline and now > deadline:
+                sig = signal.SIGTERM if not timed_out else signal.SIGKILL
+                timed_out = True
+                os.killpg(process.pid, sig)
+                deadline = now + KILL_GRACE
+            time.sleep(0.2)
+    process.returncode = os.waitstatus_to_exitcode(status)  # evita que Popen intente recoger el proceso otra vez
+    return process.returncode, time.monotonic() - start, rusage.ru_maxrss, timed_out
+
+
+# Registrar el resultado de una ejecución como una línea JSON y en el histórico consultable
+def record_run(result, run_log=RUN_LOG):
+    try:
+        os.makedirs(os.path.dirname(run_log), exist_ok=True)
+        with open(run_log, "a") as f:
+            f.write(json.dumps(result) + "\n")
+    except OSError as e:
+        logging.error(f"No se pudo registrar la ejecución de {result['id']}: {str(e)}")
+    try:
+        run_history.record(result)
+    except (sqlite3.Error, OSError) as e:
+        logging.error(f"No se pudo guardar la ejecución de {result['id']} en el histórico: {str(e)}")
+
+
+# Enviar una notificación; un fallo de Telegram no impide ejecutar ni registrar la tarea
+def send_notification(message, status):
+    try:
+        telegram_notifications.notify(message, status)
+    except Exception as e:
+        logging.error(f"Error al enviar la notificación: {str(e)}")
+
+
+# Instante actual en formato ISO con milisegundos, para distinguir ejecuciones que empiezan en el mismo segundo
+def timestamp():
+    return datetime.now().isoformat(timespec="milliseconds")
+
+
+# Ejecutar una tarea completa: retraso, hueco de ejecución, notificaciones y registro
+def run_job(job_id, language, route_script, output, timeout=DEFAULT_TIMEOUT, jitter=DEFAULT_JITTER,
+            max_parallel=MAX_PARALLEL):
+    name = f"{job_id}({route_script})"
+    run_id = uuid.uuid4().hex  # identifica esta ejecución en RUN_LOG y en el histórico
+    if jitter:
+        time.sleep(random.uniform(0, jitter))
+
+    # La tarea está también en el crontab de otro nodo mientras se traspasa; solo la ejecuta el que tiene la concesión
+    # Si las concesiones no se pueden leer o la de la tarea ha caducado (cron_job.py no las renueva), no se sabe
+    # si le toca a este nodo: es un fallo, no una omisión
+    if cluster.enabled():
+        try:
+            state = cluster.lease_state(job_id)
+            error = "concesión caducada o inexistente" if state == "caducada" else None
+        except (OSError, ValueError) as e:
+            state, error = None, f"concesiones ilegibles ({str(e)})"
+        if error:
+            logging.error(f"{name} no ejecutada en {cluster.NODE_NAME}: {error}")
+            result = {"id": job_id, "id_ejecucion": run_id, "script": route_script, "inicio": timestamp(),
+                      "codigo_salida": 1, "nodo": cluster.NODE_NAME}
+            record_run(result)
+            send_notification(f"{name} no ejecutada en {cluster.NODE_NAME}: {error}", "Error")
+            return result
+        if state == "ajena":
+            logging.info(f"{name} omitida: su concesión no es de {cluster.NODE_NAME}.")
+            result = {"id": job_id, "id_ejecucion": run_id, "script": route_script, "inicio": timestamp(),
+                      "codigo_salida": 0, "omitida": True, "nodo": cluster.NODE_NAME}
+            record_run(result)
+            return result
+
+    queued_at = time.monotonic()
+    slot = acquire_slot(max_parallel)
+    try:
+        waited = time.monotonic() - queued_at
+        started_at = timestamp()
+        send_notification(name, "Starting")
+        try:
+            exit_code, duration, max_rss, timed_out = run_command(
+                build_command(language, route_script), os.path.join(OUTPUT_DIR, output), timeout
+            )
+        except OSError as e:
+            # El script no existe o no se puede ejecutar
+            logging.error(f"No se pudo ejecutar {name}: {str(e)}")
+            exit_code, duration, max_rss, timed_out = 127, 0.0, 0, False
+    finally:
+        slot.close()
+
+    output_path = os.path.join(OUTPUT_DIR, output)
+    result = {
+        "id": job_id,
+        "id_ejecucion": run_id,
+        "script": route_script,
+        "inicio": started_at,
+        "fin": timestamp(),
+        "codigo_salida": exit_code,
+        "duracion": round(duration, 3),
+        "espera": round(waited, 3),
+        "rss_max_kib": max_rss,
+        "tiempo_agotado": timed_out,
+        "bytes_salida": os.path.getsize(output_path) if os.path.exists(output_path) else None,
+    }
+    if cluster.enabled():
+        result["nodo"] = cluster.NODE_NAME
+    record_run(result)
+
+    # Subir la salida ya, en lugar de esperar a la ejecución nocturna de cron_job.py
+    if os.path.exists(output_path) and not output_uploader.enqueue_upload(output_path):
+        logging.info(f"Demonio de subidas no disponible; {output_path} se subirá en la ejecución nocturna.")
+    summary = f"{name} código {exit_code}, {duration:.1f} s, {max_rss // 1024} MiB"
+    if exit_code == 0:
+        send_notification(summary, "Finished")
+    elif timed_out:
+        send_notification(f"{summary} (tiempo máximo de {timeout} s superado)", "Error")
+    else:
+        send_notification(summary, "Error")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ejecuta una tarea programada con límites de concurrencia y tiempo.")
+    parser.add_argument("--id", required=True, help="Identificador de la tarea en la hoja de cálculo.")
+    parser.add_argument("--language", default="python", help="Lenguaje del script (python u otro ejecutable).")
+    parser.add_argument("--output", required=True, help=f"Nombre del archivo de salida en {OUTPUT_DIR}.")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="Segundos máximos de ejecución (0 sin límite).")
+    parser.add_argument("--jitter", type=int, default=DEFAULT_JITTER, help="Segundos máximos de retraso aleatorio al arrancar.")
+    parser.add_argument("--max-parallel", type=int, default=MAX_PARALLEL, help="Tareas simultáneas como máximo en la máquina.")
+    parser.add_argument("script", help="Ruta del script a ejecutar.")
+    args = parser.parse_args()
+    logging.basicConfig(
+        filename=paths.log_path("job_runner_errors.log") if os.path.isdir(paths.LOG_DIR) else None,
+        level=logging.INFO,
+        format="%(asctime)s:%(levelname)s:%(message)s",
+    )
+    result = run_job(args.id, args.language, args.script, args.output, args.timeout, args.jitter, args.max_parallel)
+    exit_code = result["codigo_salida"]
+    sys.exit(exit_code if exit_code >= 0 else 128 - exit_code)  # terminado por señal: 128 + número de señal
@@ -0,0 +1,266 @@
+#
+# metrics.py
+#
+# Métricas de rendimiento compartidas por todos los procesos del sistema.
+#
+# Cada proceso acumula en memoria contadores e histogramas de latencia
+# (llamadas a Drive, Sheets y Telegram, bytes transferidos, etapas de
+# cron_job.py...). Los procesos de larga duración y cron_job.py vuelcan
+# periódicamente sus métricas en un fichero JSON de METRICS_DIR, y
+# fastapi-web.py las publica todas juntas en /metrics con el formato de texto
+# de Prometheus, añadiendo la etiqueta "proceso".
+#
+# Trace mide las etapas de una ejecución y genera un resumen JSON de la misma.
+#
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import paths
+
+# Directorio donde cada proceso vuelca sus métricas
+METRICS_DIR = os.environ.get("METRICS_DIR", paths.admin_path("metrics"))
+EXPORT_INTERVAL = 15  # segundos entre volcados de los procesos de larga duración
+
+# Límites superiores (segundos) de los intervalos de los histogramas de latencia
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Registry:
+    """
+    Contadores e histogramas de un proceso, identificados por nombre y etiquetas.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}  # (nombre, etiquetas) -> valor
+        self._histograms = {}  # (nombre, etiquetas) -> [cuentas por intervalo, suma, total]
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        Suma `value` al contador indicado.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Añade una observación (normalmente una duración en segundos) al histograma indicado.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name, **labels):
+        """
+        Valor actual de un contador (0 si no existe).
+        """
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def snapshot(self):
+        """
+        Copia serializable en JSON de todas las métricas.
+        """
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "counters": [[name, dict(labels), value] for (name, labels), value in self._counters.items()],
+                "histograms": [
+                    [name, dict(labels), list(counts), total, count]
+                    for (name, labels), (counts, total, count) in self._histograms.items()
+                ],
+            }
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Mide la duración del bloque y la añade al histograma `name` con la
+    etiqueta resultado="ok" o resultado="error".
+    """
+    start = time.perf_counter()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        observe(name, time.perf_counter() - start, resultado=result, **labels)
+
+
+class Trace:
+    """
+    Etapas de una ejecución (por ejemplo, de cron_job.py) con su duración.
+
+    Argumentos:
+        name (str): Nombre de la ejecución; las etapas se registran también en
+            el histograma "<name>_stage_seconds".
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+
+    @contextmanager
+    def span(self, stage):
+        """
+        Mide una etapa de la ejecución.
+        """
+        started_at = time.time()
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            duration = time.perf_counter() - start
+            self.spans.append({
+                "etapa": stage,
+                "inicio": started_at,
+                "duracion": round(duration, 4),
+                "ok": ok,
+            })
+            observe(f"{self.name}_stage_seconds", duration, etapa=stage, resultado="ok" if ok else "error")
+
+    def summary(self, **extra):
+        """
+        Resumen de la ejecución: inicio, duración total, etapas y los datos adicionales indicados.
+        """
+        data = {
+            "ejecucion": self.name,
+            "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "duracion": round(time.perf_counter() - self._start, 4),
+            "etapas": self.spans,
+        }
+        data.update(extra)
+        return data
+
+
+def write_json(path, data):
+    """
+    Escribe un fichero JSON de forma atómica.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def dump(process_name, directory=METRICS_DIR):
+    """
+    Vuelca las métricas de este proceso en <directory>/<process_name>.json.
+    """
+    data = registry.snapshot()
+    data["actualizado"] = time.time()
+    try:
+        write_json(os.path.join(directory, f"{process_name}.json"), data)
+    except OSError as e:
+        logging.error(f"No se pudieron volcar las métricas de {process_name}: {str(e)}")
+
+
+def start_exporter(process_name, interval=EXPORT_INTERVAL, directory=METRICS_DIR):
+    """
+    Vuelca las métricas de este proceso periódicamente y al terminar.
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            dump(process_name, directory)
+
+    threading.Thread(target=run, name="metrics-exporter", daemon=True).start()
+    atexit.register(dump, process_name, directory)
+
+
+def load_dumps(directory=METRICS_DIR, exclude=()):
+    """
+    Lee las métricas volcadas por los procesos.
+
+    Returns:
+        list: Tuplas (nombre del proceso, métricas).
+    """
+    snapshots = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return snapshots
+    for name in names:
+        process_name, ext = os.path.splitext(name)
+        if ext != ".json" or process_name in exclude:
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots.append((process_name, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    items = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        items.append(f'{key}="{value}"')
+    return "{" + ",".join(items) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(snapshots):
+    """
+    Genera el formato de texto de Prometheus a partir de las métricas de varios procesos.
+
+    Argumentos:
+        snapshots (list): Tuplas (nombre del proceso, métricas de Registry.snapshot()).
+
+    Returns:
+        str: Texto para el endpoint /metrics.
+    """
+    counters = {}
+    histograms = {}
+    for process_name, snapshot in snapshots:
+        for name, labels, value in snapshot.get("counters", []):
+            counters.setdefault(name, []).append((dict(labels, proceso=process_name), value))
+        buckets = snapshot.get("buckets", DEFAULT_BUCKETS)
+        for name, labels, counts, total, count in snapshot.get("histograms", []):
+            histograms.setdefault(name, []).append((dict(labels, proceso=process_name), buckets, counts, total, count))
+
+    lines = []
+    for name in sorted(counters):
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in counters[name]:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    for name in sorted(histograms):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, buckets, counts, total, count in histograms[name]:
+            for bound, bucket_count in zip(buckets, counts):
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(dict(labels, le='+Inf'))} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(total))}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,373 @@
+#
+# notification_daemon.py
+#
+# Demonio local de notificaciones de Telegram.
+#
+# Recibe notificaciones por un socket Unix (clientes Python) o por un
+# directorio de spool (telegram_notifications.sh) y las envía a Telegram con
+# una única sesión HTTPS reutilizada. Respeta el límite de mensajes por chat
+# con un token bucket y agrupa las ráfagas (por ejemplo, 50 "Starting" a las
+# 03:00) en un único resumen por estado.
+#
+# Mientras está activo actualiza un fichero de latido; los clientes solo dejan
+# mensajes en el spool si el latido es reciente, y si no los envían ellos
+# mismos, así que un spool sin demonio no se traga las notificaciones.
+#
+# Formato de cada notificación (datagrama o fichero de spool), en UTF-8:
+#     primera línea: estado (starting, finished, error o vacío)
+#     resto: texto del mensaje
+#
+
+import argparse
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+
+import requests
+
+import metrics
+import paths
+
+# Token de acceso del bot de Telegram y chat donde se enviarán las notificaciones
+TOKEN = "Introduce el token de tu bot"
+CHAT_ID = "Introduce el ID de tu chat"
+
+# URL de la API de Telegram; se puede apuntar a un servidor local falso para pruebas
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+
+# Puntos de entrada del demonio
+SOCKET_PATH = paths.admin_path("notifications.sock")
+SPOOL_DIR = paths.admin_path("notifications_spool")
+HEARTBEAT_PATH = paths.admin_path("notifications.heartbeat")  # se actualiza en cada revisión del spool
+HEARTBEAT_TTL = 10  # segundos sin latido para dar el demonio por parado
+
+# Límites de Telegram: como mucho un mensaje por segundo en un mismo chat
+CHAT_RATE = 1.0  # mensajes por segundo
+CHAT_BURST = 3  # mensajes que se pueden enviar seguidos antes de esperar
+MAX_MESSAGE_LENGTH = 4096
+
+# Agrupación de ráfagas
+COALESCE_WINDOW = 2.0  # segundos que se esperan a más mensajes tras recibir el primero
+SPOOL_POLL_INTERVAL = 0.5  # segundos entre revisiones del directorio de spool
+
+# Prefijo de cada estado, igual que en telegram_notifications.sh
+STATUS_PREFIXES = {
+    "starting": "Starting",
+    "finished": "Finished",
+    "error": "Error executing",
+}
+
+
+def format_message(message, status):
+    """
+    Construye el texto de una notificación a partir del mensaje y su estado.
+
+    Argumentos:
+        message (str): Mensaje de la notificación.
+        status (str): Estado (starting, finished, error) o cadena vacía.
+
+    Returns:
+        str: Texto a enviar.
+    """
+    prefix = STATUS_PREFIXES.get(status.lower()) if status else None
+    return f"{prefix} {message}" if prefix else message
+
+
+def encode_notification(message, status=None):
+    """
+    Serializa una notificación con el formato que entiende el demonio.
+    """
+    return f"{(status or '').strip().lower()}\n{message}".encode("utf-8")
+
+
+def decode_notification(data):
+    """
+    Interpreta una notificación recibida por el socket o el spool.
+
+    Returns:
+        tuple: (estado, mensaje).
+    """
+    text = data.decode("utf-8", errors="replace")
+    status, _, message = text.partition("\n")
+    return status.strip().lower(), message.strip()
+
+
+def build_digest(notifications):
+    """
+    Agrupa varias notificaciones en el menor número de mensajes posible.
+
+    Las notificaciones con el mismo estado se resumen en un único bloque
+    ("Starting (50): ..."); las que no tienen estado se mantienen tal cual.
+    El resultado se divide para no superar el límite de longitud de Telegram.
+
+    Argumentos:
+        notifications (list): Lista de tuplas (estado, mensaje).
+
+    Returns:
+        list: Textos a enviar.
+    """
+    by_status = {}
+    plain = []
+    for status, message in notifications:
+        if status in STATUS_PREFIXES:
+            by_status.setdefault(status, []).append(message)
+        else:
+            plain.append(message)
+
+    blocks = []
+    for status, messages in by_status.items():
+        if len(messages) == 1:
+            blocks.append(format_message(messages[0], status))
+        else:
+            lines = [f"{STATUS_PREFIXES[status]} ({len(messages)}):"]
+            lines.extend(f"- {message}" for message in messages)
+            blocks.append("\n".join(lines))
+    blocks.extend(plain)
+
+    # Unir bloques en mensajes de como mucho MAX_MESSAGE_LENGTH caracteres
+    texts = []
+    current = ""
+    for block in blocks:
+        for i, line in enumerate(block.split("\n")):
+            line = line[:MAX_MESSAGE_LENGTH]
+            separator = "\n" if i else "\n\n"  # línea en blanco entre bloques
+            candidate = f"{current}{separator}{line}" if current else line
+            if len(candidate) > MAX_MESSAGE_LENGTH:
+                texts.append(current)
+                current = line
+            else:
+                current = candidate
+    if current:
+        texts.append(current)
+    return texts
+
+
+class TokenBucket:
+    """
+    Limitador de tasa: permite `capacity` envíos seguidos y repone `rate` por segundo.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        """
+        Espera hasta que haya un token disponible y lo consume.
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+
+class NotificationDaemon:
+    """
+    Recibe notificaciones por socket y spool y las envía a Telegram agrupadas.
+
+    Argumentos:
+        token (str): Token del bot de Telegram.
+        chat_id (str): Chat donde se envían las notificaciones.
+        socket_path (str): Ruta del socket Unix de datagramas.
+        spool_dir (str): Directorio de spool.
+        heartbeat_path (str): Fichero de latido.
+    """
+
+    def __init__(self, token=TOKEN, chat_id=CHAT_ID, socket_path=SOCKET_PATH, spool_dir=SPOOL_DIR,
+                 heartbeat_path=HEARTBEAT_PATH):
+        self.url = f"{TELEGRAM_API_URL}/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.socket_path = socket_path
+        self.spool_dir = spool_dir
+        self.heartbeat_path = heartbeat_path
+        self.session = requests.Session()  # una única conexión HTTPS reutilizada
+        self.buckets = {}
+        self.pending = queue.Queue()
+        self._stop = threading.Event()
+
+    def serve_forever(self):
+        """
+        Arranca la recepción y envía notificaciones hasta que se llama a stop().
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        sock = self._open_socket()
+        threads = [
+            threading.Thread(target=self._receive_socket, args=(sock,), daemon=True),
+            threading.Thread(target=self._poll_spool, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self._stop.is_set():
+                batch = self._next_batch()
+                if batch:
+                    metrics.inc("notifications_received_total", len(batch))
+                    for text in build_digest(batch):
+                        self.send(text)
+        finally:
+            self._stop.set()
+            sock.close()
+            for path in (self.socket_path, self.heartbeat_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def stop(self):
+        self._stop.set()
+
+    def send(self, text, chat_id=None):
+        """
+        Envía un mensaje respetando el límite del chat y reintentando si Telegram pide esperar.
+        """
+        chat_id = chat_id or self.chat_id
+        bucket = self.buckets.setdefault(chat_id, TokenBucket(CHAT_RATE, CHAT_BURST))
+        for _ in range(5):
+            bucket.acquire()
+            try:
+                with metrics.timer("telegram_request_seconds", metodo="sendMessage"):
+                    response = self.session.post(self.url, json={"chat_id": chat_id, "text": text}, timeout=30)
+            except requests.RequestException as e:
+                logging.error(f"Error al enviar la notificación: {str(e)}")
+                time.sleep(1)
+                continue
+            if response.status_code == 429:
+                metrics.inc("telegram_throttled_total")
+                # Telegram indica cuántos segundos hay que esperar
+                retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+                time.sleep(retry_after)
+                continue
+            if not response.ok:
+                logging.error(f"Error al enviar la notificación: {response.text}")
+            metrics.inc("telegram_messages_total", resultado="ok" if response.ok else "error")
+            return response.ok
+        return False
+
+    def _next_batch(self):
+        # Espera la primera notificación y recoge las que lleguen durante la ventana de agrupación
+        try:
+            batch = [self.pending.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + COALESCE_WINDOW
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _open_socket(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o666)
+        sock.settimeout(1)
+        return sock
+
+    def _receive_socket(self, sock):
+        while not self._stop.is_set():
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            self.pending.put(decode_notification(data))
+
+    def _beat(self):
+        # Latido: los clientes solo usan el spool mientras este fichero es reciente
+        try:
+            with open(self.heartbeat_path, "a"):
+                pass
+            os.utime(self.heartbeat_path)
+        except OSError as e:
+            logging.error(f"No se pudo actualizar el latido {self.heartbeat_path}: {str(e)}")
+
+    def _poll_spool(self):
+        while not self._stop.is_set():
+            self._beat()
+            try:
+                entries = sorted(os.listdir(self.spool_dir))
+            except OSError:
+                entries = []
+            for entry in entries:
+                if entry.startswith("."):
+                    continue  # ficheros que el cliente todavía está escribiendo
+                path = os.path.join(self.spool_dir, entry)
+                try:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    os.remove(path)
+                except OSError:
+                    continue
+                self.pending.put(decode_notification(data))
+            self._stop.wait(SPOOL_POLL_INTERVAL)
+
+
+def daemon_alive(heartbeat_path=HEARTBEAT_PATH, ttl=HEARTBEAT_TTL):
+    """
+    Indica si el demonio ha actualizado su latido en los últimos ttl segundos.
+    """
+    try:
+        return time.time() - os.path.getmtime(heartbeat_path) <= ttl
+    except OSError:
+        return False
+
+
+def enqueue_notification(message, status=None, socket_path=SOCKET_PATH, spool_dir=SPOOL_DIR,
+                         heartbeat_path=HEARTBEAT_PATH):
+    """
+    Entrega una notificación al demonio sin esperar a que se envíe.
+
+    Prueba primero el socket y, si no está disponible, el directorio de spool,
+    pero solo si el latido del demonio es reciente: un spool que nadie lee no
+    cuenta como entrega.
+
+    Argumentos:
+        message (str): Mensaje de la notificación.
+        status (str): Estado (starting, finished, error) o None.
+
+    Returns:
+        bool: True si el demonio ha recibido la notificación, False si no está disponible.
+    """
+    data = encode_notification(message, status)
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(data, socket_path)
+        return True
+    except OSError:
+        pass
+    if os.path.isdir(spool_dir) and daemon_alive(heartbeat_path):
+        tmp_path = os.path.join(spool_dir, f".{time.time_ns()}.{os.getpid()}")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(spool_dir, f"{time.time_ns()}.{os.getpid()}"))
+            return True
+        except OSError:
+            pass
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Demonio de notificaciones de Telegram.")
+    parser.add_argument("--socket", default=SOCKET_PATH, help="Ruta del socket Unix.")
+    parser.add_argument("--spool", default=SPOOL_DIR, help="Directorio de spool.")
+    parser.add_argument("--heartbeat", default=HEARTBEAT_PATH, help="Fichero de latido.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+    metrics.start_exporter("notificaciones")
+    NotificationDaemon(socket_path=args.socket, spool_dir=args.spool,
+                       heartbeat_path=args.heartbeat).serve_forever()
@@ -0,0 +1,218 @@
+#
+# output_uploader.py
+#
+# Demonio que sube a Google Drive las salidas de las tareas en cuanto terminan.
+#
+# job_runner.py deja una entrada en el directorio de spool al acabar cada
+# tarea y este demonio la sube a la carpeta Output_scrips, comprimida por
+# trozos con gzip o zstd, y borra la copia local. Si la subida falla se
+# reintenta más tarde con espera exponencial; tras agotar los intentos el
+# archivo se queda en /opt/output y lo sube la ejecución nocturna de
+# cron_job.py, como antes.
+#
+# Formato de cada entrada del spool (JSON):
+#     {"ruta": "/opt/output/salida.txt", "intentos": 0, "siguiente": 0, "primer_intento": 1700000000.0}
+#
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import compression
+import drive_uploader_downloader
+import metrics
+import paths
+
+# Directorio de spool y carpeta de destino en Google Drive
+UPLOAD_SPOOL_DIR = paths.admin_path("upload_spool")
+OUTPUT_FOLDER = "Output_scrips"
+
+# Compresión de las salidas: "gzip", "zstd" o vacío para subirlas tal cual
+OUTPUT_COMPRESSION = os.environ.get("OUTPUT_COMPRESSION", "gzip") or None
+
+# Las salidas con un nombre que ya existe en Drive sustituyen su contenido (Drive guarda
+# el anterior como revisión) en lugar de crear otro archivo con el mismo nombre
+OUTPUT_UPSERT = os.environ.get("OUTPUT_UPSERT", "1") == "1"
+
+# Política de retención de la carpeta de salidas, aplicada por cron_job.py cada noche
+# Desactivada por defecto: solo se eliminan salidas si se configura alguno de los dos límites
+OUTPUT_RETENTION_DAYS = float(os.environ.get("OUTPUT_RETENTION_DAYS") or 0) or None  # antigüedad máxima
+OUTPUT_KEEP_VERSIONS = int(os.environ.get("OUTPUT_KEEP_VERSIONS") or 0) or None  # archivos por nombre
+
+# Subidas simultáneas y reintentos
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 2))
+MAX_ATTEMPTS = 6
+RETRY_BASE_DELAY = 30  # segundos antes del primer reintento; se duplica en cada fallo
+SPOOL_POLL_INTERVAL = 2  # segundos entre revisiones del spool
+
+
+def write_entry(entry_path, entry):
+    """
+    Escribe una entrada del spool de forma atómica.
+    """
+    directory, name = os.path.split(entry_path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp_path, entry_path)
+
+
+def enqueue_upload(path, spool_dir=UPLOAD_SPOOL_DIR):
+    """
+    Pide al demonio que suba un archivo de salida, sin esperar a la subida.
+
+    Argumentos:
+        path (str): Ruta del archivo de salida.
+
+    Returns:
+        bool: True si se ha encolado, False si el demonio no está instalado.
+    """
+    if not os.path.isdir(spool_dir):
+        return False
+    entry_path = os.path.join(spool_dir, f"{time.time_ns()}.{os.getpid()}.json")
+    try:
+        write_entry(entry_path, {"ruta": os.path.abspath(path), "intentos": 0, "siguiente": 0})
+        return True
+    except OSError as e:
+        logging.error(f"No se pudo encolar la subida de {path}: {str(e)}")
+        return False
+
+
+class OutputUploader:
+    """
+    Sube los archivos encolados en el spool, con reintentos y espera exponencial.
+
+    Argumentos:
+        spool_dir (str): Directorio de spool.
+        folder_name (str): Carpeta de Google Drive de destino.
+        compression_method (str): "gzip", "zstd" o None.
+        workers (int): Subidas simultáneas.
+    """
+
+    def __init__(self, spool_dir=UPLOAD_SPOOL_DIR, folder_name=OUTPUT_FOLDER,
+                 compression_method=OUTPUT_COMPRESSION, workers=UPLOAD_WORKERS,
+                 credentials_path=drive_uploader_downloader.CREDENTIALS_PATH):
+        compression.check_method(compression_method)
+        self.spool_dir = spool_dir
+        self.folder_name = folder_name
+        self.compression_method = compression_method
+        self.workers = max(1, workers)
+        self.credentials_path = credentials_path
+        self.credentials = None
+        self.in_progress = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def serve_forever(self):
+        """
+        Revisa el spool y sube las entradas pendientes hasta que se llama a stop().
+        """
+        os.makedirs(self.spool_dir, exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stop.is_set():
+                for entry_path in self.due_entries():
+                    with self._lock:
+                        self.in_progress.add(entry_path)
+                    executor.submit(self.process, entry_path)
+                self._stop.wait(SPOOL_POLL_INTERVAL)
+
+    def stop(self):
+        self._stop.set()
+
+    def due_entries(self):
+        """
+        Entradas del spool cuyo siguiente intento ya ha llegado, de la más antigua a la más reciente.
+        """
+        now = time.time()
+        due = []
+        try:
+            names = sorted(os.listdir(self.spool_dir))
+        except OSError:
+            return due
+        for name in names:
+            entry_path = os.path.join(self.spool_dir, name)
+            if name.startswith(".") or entry_path in self.in_progress:
+                continue  # entradas a medio escribir o ya en curso
+            try:
+                with open(entry_path) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if entry.get("siguiente", 0) <= now:
+                due.append(entry_path)
+        return due
+
+    def process(self, entry_path):
+        """
+        Sube el archivo de una entrada del spool y la elimina, o programa un reintento.
+        """
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+            path = entry["ruta"]
+            if not os.path.exists(path):
+                # Ya lo ha subido otra ejecución (por ejemplo, la nocturna de cron_job.py)
+                os.remove(entry_path)
+                return
+            started = time.time()
+            try:
+                with metrics.timer("output_upload_seconds"):
+                    name = self.upload(path, entry.get("primer_intento") if entry.get("intentos") else None)
+                os.remove(path)
+                os.remove(entry_path)
+                logging.info(f"Salida subida a {self.folder_name}: {name}")
+            except Exception as e:
+                self.retry_later(entry_path, entry, e, started)
+        except Exception as e:
+            logging.error(f"Error al procesar la entrada {entry_path}: {str(e)}")
+        finally:
+            with self._lock:
+                self.in_progress.discard(entry_path)
+
+    def upload(self, path, first_attempt=None):
+        # Cada hilo reutiliza su propia conexión a Google Drive
+        if self.credentials is None:
+            self.credentials = drive_uploader_downloader.load_credentials(self.credentials_path)
+        if not hasattr(self._local, "drive"):
+            self._local.drive = drive_uploader_downloader.drive_from_credentials(self.credentials)
+        folder = drive_uploader_downloader.find_folder(self._local.drive, self.folder_name)
+        if folder is None:
+            raise RuntimeError(f"Carpeta no encontrada: {self.folder_name}")
+        # En los reintentos se comprueba antes si un intento anterior llegó a crear el archivo
+        created_since = datetime.fromtimestamp(first_attempt, timezone.utc) if first_attempt else None
+        return drive_uploader_downloader.upload_file(
+            self._local.drive, folder, path, self.compression_method, upsert=OUTPUT_UPSERT,
+            created_since=created_since
+        )
+
+    def retry_later(self, entry_path, entry, error, started=None):
+        entry["intentos"] = entry.get("intentos", 0) + 1
+        entry.setdefault("primer_intento", started)
+        if entry["intentos"] >= MAX_ATTEMPTS:
+            # Se deja el archivo en su sitio para la subida nocturna de cron_job.py
+            logging.error(f"Subida de {entry['ruta']} abandonada tras {entry['intentos']} intentos: {str(error)}")
+            os.remove(entry_path)
+            return
+        delay = RETRY_BASE_DELAY * 2 ** (entry["intentos"] - 1)
+        entry["siguiente"] = time.time() + delay
+        logging.warning(f"Error al subir {entry['ruta']} (intento {entry['intentos']}), reintento en {delay} s: {str(error)}")
+        # El ID de carpeta cacheado puede estar obsoleto
+        drive_uploader_downloader.id_cache.invalidate(drive_uploader_downloader.drive_cache.folder_key(self.folder_name))
+        write_entry(entry_path, entry)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Demonio de subida de las salidas de las tareas a Google Drive.")
+    parser.add_argument("--spool", default=UPLOAD_SPOOL_DIR, help="Directorio de spool.")
+    parser.add_argument("--carpeta", default=OUTPUT_FOLDER, help="Carpeta de Google Drive de destino.")
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS, help="Subidas simultáneas.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+    metrics.start_exporter("subidas")
+    OutputUploader(spool_dir=args.spool, folder_name=args.carpeta, workers=args.workers).serve_forever()
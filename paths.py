@@ -0,0 +1,37 @@
+#
+# paths.py
+#
+# Rutas de los directorios y ficheros del sistema.
+#
+# Todo cuelga de /opt por defecto. La variable de entorno OPT_ROOT cambia la
+# raíz, de modo que una instalación de pruebas (por ejemplo, la de la suite
+# de benchmarks de bench/) puede ejecutar los mismos scripts sobre un
+# directorio temporal sin tocar /opt.
+#
+
+import os
+
+OPT_ROOT = os.environ.get("OPT_ROOT", "/opt")
+
+ADMIN_DIR = os.path.join(OPT_ROOT, "admin")  # scripts del sistema, credenciales y estado compartido
+LOG_DIR = os.path.join(OPT_ROOT, "log")  # registros y resúmenes de ejecución
+OUTPUT_DIR = os.path.join(OPT_ROOT, "output")  # salidas de las tareas pendientes de subir
+SCRIPTS_DIR = os.path.join(OPT_ROOT, "program_script_drive")  # scripts instalados que ejecuta el crontab
+SCRIPT_CACHE_DIR = os.path.join(OPT_ROOT, "script_cache")  # versiones descargadas de los scripts
+DOWNLOAD_CACHE_DIR = os.path.join(OPT_ROOT, "download_cache")  # caché de descargas de fastapi-web.py
+
+CREDENTIALS_PATH = os.path.join(ADMIN_DIR, "credentials.json")  # cuenta de servicio de Google
+
+
+def admin_path(name):
+    """
+    Ruta de un fichero dentro de ADMIN_DIR.
+    """
+    return os.path.join(ADMIN_DIR, name)
+
+
+def log_path(name):
+    """
+    Ruta de un fichero dentro de LOG_DIR.
+    """
+    return os.path.join(LOG_DIR, name)
@@ -0,0 +1,306 @@
+#
+# run_history.py
+#
+# Histórico de ejecuciones de las tareas programadas en SQLite.
+#
+# job_runner.py añade una fila por ejecución (identificador, inicio, fin,
+# código de salida, tamaño de la salida...) y cron_job.py otra por cada
+# reprogramación, con el identificador "cron_programmer". La base de datos
+# usa el modo WAL, así que las escrituras de las tareas que terminan a la vez
+# no bloquean las consultas de la API y del bot, y está indexada por
+# identificador y por instante de inicio: las estadísticas de una tarea o de
+# un periodo se calculan sin recorrer los registros de texto.
+#
+# Los registros anteriores de job_runner.log se pueden importar con:
+#     python3 run_history.py --importar
+#
+
+import argparse
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+from contextlib import closing
+from datetime import datetime
+
+import paths
+
+RUN_HISTORY_DB = os.environ.get("RUN_HISTORY_DB", paths.log_path("run_history.db"))
+DB_TIMEOUT = 30  # segundos esperando a que otro proceso termine de escribir
+CRON_JOB_ID = "cron_programmer"  # identificador de las ejecuciones de cron_job.py
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    inicio REAL NOT NULL,
+    fin REAL,
+    duracion REAL,
+    codigo_salida INTEGER,
+    tiempo_agotado INTEGER NOT NULL DEFAULT 0,
+    omitida INTEGER NOT NULL DEFAULT 0,
+    espera REAL,
+    rss_max_kib INTEGER,
+    bytes_salida INTEGER,
+    nodo TEXT,
+    id_ejecucion TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_job_inicio ON runs (job_id, inicio);
+CREATE INDEX IF NOT EXISTS runs_inicio ON runs (inicio);
+CREATE INDEX IF NOT EXISTS runs_fallos ON runs (inicio) WHERE codigo_salida != 0;
+"""
+
+# Cada ejecución tiene un identificador único (id_ejecucion, generado por job_runner.py): importar
+# otra vez un registro que ya está en la base de datos no la duplica
+UNIQUE_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS runs_ejecucion ON runs (id_ejecucion)"
+
+# Identificador de las ejecuciones registradas antes de que existiera id_ejecucion: tarea, inicio y nodo
+LEGACY_RUN_ID_SQL = "job_id || '|' || printf('%.6f', inicio) || '|' || IFNULL(nodo, '')"
+
+COLUMNS = ("job_id", "inicio", "fin", "duracion", "codigo_salida", "tiempo_agotado", "omitida",
+           "espera", "rss_max_kib", "bytes_salida", "nodo", "id_ejecucion")
+
+
+def connect(path=RUN_HISTORY_DB):
+    """
+    Abre la base de datos en modo WAL, creando las tablas si no existen.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path, timeout=DB_TIMEOUT)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")  # con WAL, una caída del sistema solo puede perder las últimas filas
+    db.executescript(SCHEMA)
+    if "id_ejecucion" not in {row["name"] for row in db.execute("PRAGMA table_info(runs)")}:
+        migrate(db)
+    db.execute(UNIQUE_INDEX)
+    return db
+
+
+def migrate(db):
+    """
+    Añade id_ejecucion a una base de datos anterior sin eliminar ninguna fila.
+
+    Las filas existentes reciben el identificador heredado (tarea, inicio y
+    nodo), el mismo que to_row calcula para las líneas de job_runner.log sin
+    id_ejecucion, así que importar un registro antiguo no las duplica. Si
+    varias filas comparten ese identificador, las demás reciben uno propio.
+    """
+    with db:
+        db.execute("ALTER TABLE runs ADD COLUMN id_ejecucion TEXT")
+        db.execute("DROP INDEX IF EXISTS runs_unica")
+        db.execute(f"UPDATE runs SET id_ejecucion = {LEGACY_RUN_ID_SQL} WHERE id IN "
+                   f"(SELECT MIN(id) FROM runs GROUP BY {LEGACY_RUN_ID_SQL})")
+        db.execute("UPDATE runs SET id_ejecucion = 'fila|' || id WHERE id_ejecucion IS NULL")
+
+
+def legacy_run_id(job_id, start, node):
+    """
+    Identificador de una ejecución registrada sin id_ejecucion (igual que LEGACY_RUN_ID_SQL).
+    """
+    return f"{job_id}|{start:.6f}|{node or ''}"
+
+
+def parse_time(value):
+    """
+    Convierte un instante ISO ("%Y-%m-%dT%H:%M:%S") o epoch en segundos epoch.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    return datetime.fromisoformat(value).timestamp()
+
+
+def format_time(value):
+    return datetime.fromtimestamp(value).isoformat(timespec="seconds") if value is not None else None
+
+
+def to_row(result):
+    """
+    Fila de la tabla runs a partir de un resultado de job_runner.run_job.
+    """
+    start = parse_time(result["inicio"])
+    duration = result.get("duracion")
+    end = parse_time(result.get("fin")) or (start + duration if duration is not None else None)
+    run_id = result.get("id_ejecucion") or legacy_run_id(result["id"], start, result.get("nodo"))
+    return (
+        str(result["id"]), start, end, duration, result.get("codigo_salida"),
+        int(bool(result.get("tiempo_agotado"))), int(bool(result.get("omitida"))),
+        result.get("espera"), result.get("rss_max_kib"), result.get("bytes_salida"), result.get("nodo"),
+        run_id,
+    )
+
+
+def record(results, path=RUN_HISTORY_DB):
+    """
+    Añade una o varias ejecuciones en una única transacción, omitiendo las que ya están guardadas
+    (mismo id_ejecucion).
+
+    Argumentos:
+        results (list): Resultados con el formato de job_runner.run_job.
+    """
+    if isinstance(results, dict):
+        results = [results]
+    with closing(connect(path)) as db, db:
+        db.executemany(
+            f"INSERT OR IGNORE INTO runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [to_row(result) for result in results],
+        )
+
+
+def percentile(db, where, params, count, fraction):
+    """
+    Duración en el percentil indicado (método del rango más cercano) de las ejecuciones que cumplen where.
+    """
+    if not count:
+        return None
+    offset = max(0, math.ceil(fraction * count) - 1)
+    row = db.execute(f"SELECT duracion FROM runs WHERE {where} AND duracion IS NOT NULL "
+                     f"ORDER BY duracion LIMIT 1 OFFSET ?", (*params, offset)).fetchone()
+    return row["duracion"] if row else None
+
+
+def run_dict(row):
+    run = dict(row)
+    run["inicio"] = format_time(run["inicio"])
+    run["fin"] = format_time(run["fin"])
+    run["tiempo_agotado"] = bool(run["tiempo_agotado"])
+    run["omitida"] = bool(run["omitida"])
+    return run
+
+
+def job_stats(job_id, since=None, recent=10, path=RUN_HISTORY_DB):
+    """
+    Estadísticas de una tarea desde un instante.
+
+    Argumentos:
+        job_id (str): IDENTIFICADOR de la tarea.
+        since (float): Segundos epoch; por defecto, todo el histórico.
+        recent (int): Últimas ejecuciones incluidas.
+
+    Returns:
+        dict: Ejecuciones, fallos, duraciones p50 y p95 y últimas ejecuciones y fallos.
+    """
+    where, params = "job_id = ? AND inicio >= ? AND omitida = 0", (str(job_id), since or 0)
+    with closing(connect(path)) as db:
+        totals = db.execute(
+            f"SELECT COUNT(duracion) AS con_duracion, COUNT(*) AS ejecuciones, "
+            f"SUM(codigo_salida != 0) AS fallos, MAX(duracion) AS duracion_max "
+            f"FROM runs WHERE {where}", params
+        ).fetchone()
+        count = totals["con_duracion"]
+        return {
+            "id": str(job_id),
+            "desde": format_time(since),
+            "ejecuciones": totals["ejecuciones"],
+            "fallos": totals["fallos"] or 0,
+            "p50": percentile(db, where, params, count, 0.5),
+            "p95": percentile(db, where, params, count, 0.95),
+            "duracion_max": totals["duracion_max"],
+            "ultimas": [run_dict(row) for row in db.execute(
+                f"SELECT * FROM runs WHERE {where} ORDER BY inicio DESC LIMIT ?", (*params, recent))],
+            "ultimos_fallos": [run_dict(row) for row in db.execute(
+                f"SELECT * FROM runs WHERE {where} AND codigo_salida != 0 ORDER BY inicio DESC LIMIT ?",
+                (*params, recent))],
+        }
+
+
+def summary(since=None, until=None, path=RUN_HISTORY_DB):
+    """
+    Ejecuciones, fallos y duraciones p50 y p95 de cada tarea en [since, until).
+
+    Returns:
+        dict: Estadísticas indexadas por identificador.
+    """
+    jobs = {}
+    with closing(connect(path)) as db:
+        rows = db.execute(
+            "SELECT job_id, duracion, codigo_salida FROM runs INDEXED BY runs_inicio "
+            "WHERE inicio >= ? AND inicio < ? AND omitida = 0 ORDER BY job_id",
+            (since or 0, until or time.time() + 1),
+        )
+        for row in rows:
+            job = jobs.setdefault(row["job_id"], {"ejecuciones": 0, "fallos": 0, "duraciones": []})
+            job["ejecuciones"] += 1
+            job["fallos"] += row["codigo_salida"] != 0
+            if row["duracion"] is not None:
+                job["duraciones"].append(row["duracion"])
+    for job in jobs.values():
+        durations = sorted(job.pop("duraciones"))
+        job["p50"] = durations[max(0, math.ceil(0.5 * len(durations)) - 1)] if durations else None
+        job["p95"] = durations[max(0, math.ceil(0.95 * len(durations)) - 1)] if durations else None
+    return jobs
+
+
+def slower_jobs(days=7, min_ratio=1.2, min_runs=3, now=None, path=RUN_HISTORY_DB):
+    """
+    Tareas cuya duración p50 de los últimos días ha crecido respecto al periodo anterior de la misma longitud.
+
+    Returns:
+        list: Un diccionario por tarea con sus p50 y su cociente, de mayor a menor cociente.
+    """
+    now = now or time.time()
+    period = days * 86400
+    current = summary(now - period, now, path)
+    previous = summary(now - 2 * period, now - period, path)
+    slower = []
+    for job_id, stats in current.items():
+        before = previous.get(job_id)
+        if not before or stats["ejecuciones"] < min_runs or before["ejecuciones"] < min_runs:
+            continue
+        if not before["p50"] or stats["p50"] is None:
+            continue
+        ratio = stats["p50"] / before["p50"]
+        if ratio >= min_ratio:
+            slower.append({"id": job_id, "p50": stats["p50"], "p50_anterior": before["p50"], "cociente": round(ratio, 2)})
+    return sorted(slower, key=lambda job: -job["cociente"])
+
+
+def recent_failures(since=None, limit=50, path=RUN_HISTORY_DB):
+    """
+    Últimas ejecuciones fallidas de cualquier tarea.
+    """
+    with closing(connect(path)) as db:
+        return [run_dict(row) for row in db.execute(
+            "SELECT * FROM runs INDEXED BY runs_fallos WHERE codigo_salida != 0 AND inicio >= ? "
+            "ORDER BY inicio DESC LIMIT ?", (since or 0, limit))]
+
+
+def import_log(log_path, path=RUN_HISTORY_DB):
+    """
+    Importa las ejecuciones registradas por job_runner.py en su fichero JSON por líneas.
+
+    Las ejecuciones que job_runner.py ya ha guardado en la base de datos se
+    omiten, así que se puede importar el mismo registro varias veces.
+
+    Returns:
+        int: Ejecuciones leídas del registro.
+    """
+    results = []
+    with open(log_path) as f:
+        for line in f:
+            try:
+                results.append(json.loads(line))
+            except ValueError:
+                logging.warning(f"Línea no válida en {log_path}: {line.strip()}")
+    if results:
+        record(results, path)
+    return len(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Histórico de ejecuciones de las tareas programadas.")
+    parser.add_argument("--importar", nargs="?", const=paths.log_path("job_runner.log"), default=None,
+                        help="Importa un registro de job_runner.py (por defecto, el de esta instalación).")
+    parser.add_argument("--id", help="Muestra las estadísticas de una tarea.")
+    parser.add_argument("--dias", type=int, default=7, help="Días consultados.")
+    args = parser.parse_args()
+    if args.importar:
+        print(f"Ejecuciones leídas: {import_log(args.importar)}")
+    elif args.id:
+        print(json.dumps(job_stats(args.id, time.time() - args.dias * 86400), indent=2, ensure_ascii=False))
+    else:
+        for job_id, stats in sorted(summary(time.time() - args.dias * 86400).items()):
+            print(f"{job_id}\t{stats['ejecuciones']} ejecuciones\t{stats['fallos']} fallos\t"
+                  f"p50 {stats['p50']}\tp95 {stats['p95']}")
@@ -0,0 +1,362 @@
+#
+# schedule_forecast.py
+#
+# Previsión de la carga de las tareas programadas.
+#
+# cron_job.py guarda en cada ejecución la programación crontab de cada tarea
+# activa (FORECAST_INDEX_PATH). A partir de ella, ScheduleForecast construye
+# un índice ordenado de las ejecuciones previstas en los próximos días que
+# responde con búsquedas binarias a "qué se ejecuta entre T1 y T2" y cuántas
+# tareas arrancan en cada minuto. La API (/schedule_forecast/) y el bot
+# (/forecast) comparten el índice, que solo se reconstruye cuando cambia el
+# fichero o el día.
+#
+# Opcionalmente (SCHEDULE_STAGGER_WINDOW), cron_job.py escalona las tareas
+# que coinciden: retrasa cada una lo mínimo, dentro de la ventana permitida,
+# para que ningún minuto supere SCHEDULE_STAGGER_MAX tareas en el peor día del
+# año. Los días 1 de mes, en los que coinciden las tareas mensuales,
+# trimestrales, semestrales y anuales con las diarias, son los que más
+# se benefician.
+#
+
+import bisect
+import json
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, time as dtime, timedelta
+
+import metrics
+import paths
+
+# Índice guardado por cron_job.py: {"generado": ..., "tareas": {IDENTIFICADOR: programación crontab}}
+FORECAST_INDEX_PATH = paths.admin_path("schedule_forecast.json")
+FORECAST_DAYS = int(os.environ.get("SCHEDULE_FORECAST_DAYS", 35))  # días de previsión (un mes completo como mínimo)
+
+# Escalonado automático; con la ventana a 0 las tareas se programan a su hora exacta
+STAGGER_WINDOW = int(os.environ.get("SCHEDULE_STAGGER_WINDOW", 0))  # minutos que se puede retrasar una tarea
+STAGGER_MAX = int(os.environ.get("SCHEDULE_STAGGER_MAX", os.cpu_count() or 1))  # tareas por minuto antes de escalonar
+STAGGER_DAYS = 366  # días examinados al escalonar, para incluir todos los inicios de mes del año
+
+MINUTES_PER_DAY = 24 * 60
+
+# Programación crontab de cada periodicidad de la hoja
+PERIODICITY_SCHEDULES = {
+    "diario": "{minute} {hour} * * *",
+    "semana laboral": "{minute} {hour} * * 1-5",
+    "semanal": "{minute} {hour} * * 0",
+    "mensual": "{minute} {hour} 1 * *",
+    "trimestral": "{minute} {hour} 1 */3 *",
+    "cuatrimestral": "{minute} {hour} 1 */4 *",
+    "semestral": "{minute} {hour} 1 */6 *",
+    "anual": "{minute} {hour} 1 1 *",
+}
+
+
+def periodicity_to_cron(periodicity, hour):
+    """
+    Programación crontab de una periodicidad y una hora "HH:MM" de la hoja.
+
+    Returns:
+        str: La programación, o None si la periodicidad no existe.
+
+    Raises:
+        ValueError: Si la hora no tiene el formato "HH:MM".
+    """
+    hour, minute = map(int, hour.split(":"))
+    template = PERIODICITY_SCHEDULES.get(periodicity)
+    return template.format(minute=minute, hour=hour) if template else None
+
+
+def row_schedules(rows):
+    """
+    Programación crontab de cada fila; las filas con periodicidad u hora no válidas se omiten.
+
+    Returns:
+        dict: Programación de cada IDENTIFICADOR.
+    """
+    schedules = {}
+    for row in rows:
+        try:
+            schedule = periodicity_to_cron(str(row["PERIOCIDAD"]).lower(), str(row["HORA"]))
+        except ValueError:
+            continue
+        if schedule is not None:
+            schedules[str(row["IDENTIFICADOR"])] = schedule
+    return schedules
+
+
+def parse_field(field, low, high):
+    """
+    Valores de un campo crontab: *, */n, a, a-b, a-b/n y listas separadas por comas.
+    """
+    values = set()
+    for part in field.split(","):
+        part, _, step = part.partition("/")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = map(int, part.split("-"))
+        else:
+            start = end = int(part)
+            if step:
+                end = high
+        if start < low or end > high or start > end:
+            raise ValueError(f"Valor fuera de rango en el campo crontab {field!r}")
+        values.update(range(start, end + 1, int(step) if step else 1))
+    return values
+
+
+class CronSchedule:
+    """
+    Programación crontab de cinco campos.
+
+    Argumentos:
+        expression (str): Minuto, hora, día del mes, mes y día de la semana.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Programación crontab no válida: {expression!r}")
+        self.expression = expression
+        self.minutes = sorted(parse_field(fields[0], 0, 59))
+        self.hours = sorted(parse_field(fields[1], 0, 23))
+        self.days = parse_field(fields[2], 1, 31)
+        self.months = parse_field(fields[3], 1, 12)
+        self.weekdays = {day % 7 for day in parse_field(fields[4], 0, 7)}  # 0 y 7 son domingo
+        self.day_fields = tuple(fields[2:])  # los días en que se ejecuta solo dependen de estos campos
+        # Como cron: si se restringen el día del mes y el de la semana, basta con que coincida uno
+        self.either_day = fields[2] != "*" and fields[4] != "*"
+
+    def runs_on(self, day):
+        """
+        Indica si la programación se ejecuta algún minuto de un día.
+        """
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = (day.weekday() + 1) % 7 in self.weekdays
+        return in_month or in_week if self.either_day else in_month and in_week
+
+    def minutes_of_day(self):
+        """
+        Minutos del día (0-1439) en que se ejecuta.
+        """
+        return [hour * 60 + minute for hour in self.hours for minute in self.minutes]
+
+    def fixed_minute(self):
+        """
+        Minuto del día de una programación con un único minuto y hora, o None.
+        """
+        if len(self.minutes) == 1 and len(self.hours) == 1:
+            return self.hours[0] * 60 + self.minutes[0]
+        return None
+
+
+def parse_schedules(schedules):
+    """
+    Agrupa las programaciones por sus campos de día, omitiendo las no válidas.
+
+    Returns:
+        dict: {campos de día: [(identificador, CronSchedule)]}
+    """
+    groups = defaultdict(list)
+    for job_id, expression in schedules.items():
+        try:
+            schedule = CronSchedule(expression)
+        except ValueError as e:
+            logging.warning(f"Programación omitida en la previsión para {job_id}: {str(e)}")
+            continue
+        groups[schedule.day_fields].append((job_id, schedule))
+    return groups
+
+
+class ScheduleForecast:
+    """
+    Índice de las ejecuciones previstas en un intervalo.
+
+    Las ejecuciones se guardan ordenadas por instante, así que las consultas
+    por intervalo son dos búsquedas binarias, y se cuentan por minuto para
+    los histogramas.
+
+    Argumentos:
+        schedules (dict): Programación crontab de cada identificador.
+        start (datetime): Inicio de la previsión; por defecto, el minuto actual.
+        days (int): Días de previsión.
+    """
+
+    def __init__(self, schedules, start=None, days=FORECAST_DAYS):
+        self.start = (start or datetime.now()).replace(second=0, microsecond=0)
+        self.end = self.start + timedelta(days=days)
+        events = []
+        groups = parse_schedules(schedules)
+        day = self.start.date()
+        while day <= self.end.date():
+            for jobs in groups.values():
+                if not jobs[0][1].runs_on(day):
+                    continue
+                for job_id, schedule in jobs:
+                    for hour in schedule.hours:
+                        for minute in schedule.minutes:
+                            moment = datetime.combine(day, dtime(hour, minute))
+                            if self.start <= moment < self.end:
+                                events.append((moment, job_id))
+            day += timedelta(days=1)
+        events.sort()
+        self.times = [moment for moment, _ in events]
+        self.ids = [job_id for _, job_id in events]
+        self.jobs = len(schedules)
+
+    def _bounds(self, start=None, end=None):
+        low = 0 if start is None else bisect.bisect_left(self.times, start)
+        high = len(self.times) if end is None else bisect.bisect_left(self.times, end)
+        return low, max(low, high)
+
+    def count(self, start=None, end=None):
+        """
+        Número de ejecuciones en [start, end).
+        """
+        low, high = self._bounds(start, end)
+        return high - low
+
+    def between(self, start=None, end=None, limit=None):
+        """
+        Ejecuciones en [start, end), en orden.
+
+        Returns:
+            list: Tuplas (instante, identificador), como mucho limit.
+        """
+        low, high = self._bounds(start, end)
+        if limit is not None:
+            high = min(high, low + limit)
+        return list(zip(self.times[low:high], self.ids[low:high]))
+
+    def histogram(self, start=None, end=None, bucket=1):
+        """
+        Ejecuciones por intervalo de bucket minutos en [start, end), solo los intervalos con alguna.
+
+        Returns:
+            list: Tuplas (inicio del intervalo, ejecuciones), en orden.
+        """
+        low, high = self._bounds(start, end)
+        width = timedelta(minutes=max(1, bucket))
+        counts = Counter(self.start + (moment - self.start) // width * width for moment in self.times[low:high])
+        return sorted(counts.items())
+
+    def peaks(self, start=None, end=None, top=10, bucket=1):
+        """
+        Intervalos de bucket minutos con más ejecuciones en [start, end).
+
+        Returns:
+            list: Tuplas (inicio del intervalo, ejecuciones), de mayor a menor carga.
+        """
+        return sorted(self.histogram(start, end, bucket), key=lambda item: (-item[1], item[0]))[:top]
+
+
+def stagger(schedules, window=STAGGER_WINDOW, max_per_minute=STAGGER_MAX, start=None, days=STAGGER_DAYS):
+    """
+    Retrasa las tareas que coinciden para que ningún minuto supere max_per_minute.
+
+    Los días del horizonte se agrupan por las programaciones que se ejecutan
+    en ellos (entre semana, domingos, días 1 de cada trimestre...), de modo
+    que la carga de cada minuto se calcula una vez por grupo en lugar de por
+    día. Las tareas se recorren por hora y después por identificador, y cada
+    una se retrasa al primer minuto de su ventana que no supera el límite en
+    ninguno de sus días o, si no lo hay, al de menor carga. Solo se mueven las
+    programaciones de un único minuto y hora, y nunca al día siguiente. El
+    resultado es el mismo en cada ejecución con las mismas tareas.
+
+    Argumentos:
+        schedules (dict): Programación crontab de cada identificador.
+        window (int): Minutos que se puede retrasar cada tarea.
+        max_per_minute (int): Tareas por minuto permitidas.
+
+    Returns:
+        dict: Programación de cada identificador, con los minutos y horas escalonados.
+    """
+    if window <= 0:
+        return dict(schedules)
+    groups = parse_schedules(schedules)
+    patterns = list(groups)
+    first_day = (start or datetime.now()).date()
+    day_classes = {
+        frozenset(pattern for pattern in patterns if groups[pattern][0][1].runs_on(first_day + timedelta(days=i)))
+        for i in range(days)
+    }
+    day_classes = [day_class for day_class in day_classes if day_class]
+    pattern_classes = {pattern: [i for i, day_class in enumerate(day_classes) if pattern in day_class]
+                       for pattern in patterns}
+
+    load = Counter()
+    movable = []
+    result = dict(schedules)
+    for pattern, jobs in groups.items():
+        for job_id, schedule in jobs:
+            minute = schedule.fixed_minute()
+            if minute is None or not pattern_classes[pattern]:
+                for day_class in pattern_classes[pattern]:
+                    for minute_of_day in schedule.minutes_of_day():
+                        load[day_class, minute_of_day] += 1
+            else:
+                movable.append((minute, job_id, pattern, schedule))
+
+    for minute, job_id, pattern, schedule in sorted(movable, key=lambda job: job[:2]):
+        classes = pattern_classes[pattern]
+        best, best_load = minute, None
+        for candidate in range(minute, min(minute + window, MINUTES_PER_DAY - 1) + 1):
+            worst = max(load[day_class, candidate] for day_class in classes)
+            if best_load is None or worst < best_load:
+                best, best_load = candidate, worst
+            if worst < max_per_minute:
+                break
+        for day_class in classes:
+            load[day_class, best] += 1
+        if best != minute:
+            result[job_id] = f"{best % 60} {best // 60} {' '.join(schedule.day_fields)}"
+    return result
+
+
+def save_index(schedules, path=FORECAST_INDEX_PATH):
+    """
+    Guarda la programación de las tareas para la previsión de la API y el bot.
+    """
+    metrics.write_json(path, {
+        "generado": datetime.now().isoformat(timespec="seconds"),
+        "escalonado": STAGGER_WINDOW,
+        "tareas": schedules,
+    })
+
+
+_forecast_lock = threading.Lock()
+_forecast_cache = {}
+
+
+def load_forecast(path=FORECAST_INDEX_PATH, days=FORECAST_DAYS):
+    """
+    Previsión desde el comienzo del día a partir del índice guardado por cron_job.py.
+
+    La previsión se reutiliza mientras no cambien el fichero ni el día.
+
+    Returns:
+        ScheduleForecast: La previsión, o None si cron_job.py todavía no ha guardado el índice.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    today = datetime.combine(datetime.now().date(), dtime())
+    with _forecast_lock:
+        cached = _forecast_cache.get((path, days))
+        if cached is not None and cached[0] == mtime and cached[1].start == today:
+            return cached[1]
+        try:
+            with open(path) as f:
+                schedules = json.load(f)["tareas"]
+        except (OSError, ValueError, KeyError) as e:
+            logging.error(f"No se pudo leer el índice de la previsión {path}: {str(e)}")
+            return None
+        forecast = ScheduleForecast(schedules, start=today, days=days)
+        _forecast_cache[path, days] = (mtime, forecast)
+        return forecast
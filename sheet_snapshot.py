@@ -0,0 +1,218 @@
+#
+# sheet_snapshot.py
+#
+# Instantánea en memoria de los registros de la hoja de cálculo de tareas.
+#
+# El bot de Telegram y cron_job.py leen la hoja a través de esta clase en
+# lugar de descargarla entera en cada consulta. La instantánea solo se vuelve
+# a descargar cuando cambia la revisión de la hoja (fecha de última
+# modificación en Drive) o cuando supera su TTL, y puede refrescarse en
+# segundo plano. Opcionalmente se guarda en un fichero JSON para que procesos
+# distintos (el bot y el cron nocturno) compartan la misma copia.
+#
+
+import json
+import logging
+import os
+import threading
+import time
+
+import google_api
+import paths
+
+# Fichero compartido entre el bot y cron_job.py
+SNAPSHOT_PATH = paths.admin_path("sheet_snapshot.json")
+
+# Valores por defecto del refresco
+DEFAULT_TTL = 300  # segundos tras los que se descarga la hoja aunque no haya cambiado
+DEFAULT_CHECK_INTERVAL = 30  # segundos entre comprobaciones de revisión en segundo plano
+
+
+class SheetSnapshot:
+    """
+    Copia en memoria de get_all_records() de la primera hoja de una hoja de cálculo.
+
+    Argumentos:
+        client (gspread.Client): Cliente de Google Sheets autorizado.
+        spreadsheet_id (str): ID de la hoja de cálculo.
+        ttl (float): Segundos tras los que se descarga la hoja aunque su revisión no cambie.
+        check_interval (float): Segundos entre comprobaciones en segundo plano.
+        path (str): Fichero JSON donde persistir la instantánea, o None.
+    """
+
+    def __init__(self, client, spreadsheet_id, ttl=DEFAULT_TTL,
+                 check_interval=DEFAULT_CHECK_INTERVAL, path=None):
+        self.client = client
+        self.spreadsheet_id = spreadsheet_id
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.path = path
+        self.records = None
+        self.revision = None
+        self.loaded_at = None  # instante de la última descarga de la hoja
+        self.checked_at = None  # instante de la última comprobación correcta de la revisión
+        self.last_error = None
+        self._spreadsheet = None
+        self._worksheet = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+        if path:
+            self._load()
+
+    def get_records(self, strict=False):
+        """
+        Devuelve los registros de la hoja.
+
+        Con el refresco en segundo plano activo devuelve directamente la copia
+        en memoria; si no, comprueba antes la revisión y descarga la hoja solo
+        si ha cambiado.
+
+        Argumentos:
+            strict (bool): Comprueba siempre la revisión y propaga cualquier
+                error en lugar de devolver una copia que no se ha podido
+                confirmar (para cron_job.py, que reescribe el crontab con ella).
+
+        Returns:
+            list: Un diccionario por fila, como get_all_records().
+        """
+        if strict or self._thread is None or self.records is None:
+            self.refresh(strict=strict)
+        return self.records
+
+    def age(self):
+        """
+        Segundos desde la última vez que se confirmó que la copia estaba al día.
+
+        Returns:
+            float: Antigüedad de la copia, o None si nunca se ha cargado.
+        """
+        if self.checked_at is None:
+            return None
+        return time.time() - self.checked_at
+
+    def refresh(self, force=False, strict=False):
+        """
+        Descarga la hoja si su revisión ha cambiado, si ha caducado el TTL o si se fuerza.
+
+        Si la comprobación falla se conserva la copia anterior y, si no existe
+        o se pide strict, se propaga el error.
+
+        Argumentos:
+            force (bool): Descarga la hoja sin comprobar la revisión.
+            strict (bool): Propaga el error aunque haya una copia anterior.
+
+        Returns:
+            bool: True si se ha descargado la hoja.
+        """
+        with self._lock:
+            try:
+                revision = self._get_revision()
+                now = time.time()
+                expired = self.loaded_at is None or now - self.loaded_at > self.ttl
+                reloaded = False
+                if force or expired or self.records is None or revision != self.revision:
+                    logging.info(f"Descargando la hoja de cálculo {self.spreadsheet_id} (revisión {revision}).")
+                    self.records = google_api.call(self._get_worksheet().get_all_records)
+                    self.revision = revision
+                    self.loaded_at = now
+                    reloaded = True
+                self.checked_at = now
+                self.last_error = None
+                if reloaded:
+                    self._save()
+                    self._notify()
+                return reloaded
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"Error al refrescar la hoja de cálculo: {str(e)}")
+                if strict or self.records is None:
+                    raise
+                return False
+
+    def add_listener(self, callback):
+        """
+        Registra una función a la que se llama con los registros nuevos cada vez que se descarga la hoja.
+        """
+        self._listeners.append(callback)
+
+    def start(self):
+        """
+        Arranca el refresco periódico en un hilo en segundo plano.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sheet-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Detiene el refresco en segundo plano.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                pass  # ya registrado en refresh(); se reintenta en la siguiente vuelta
+            self._stop.wait(self.check_interval)
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback(self.records)
+            except Exception as e:
+                logging.error(f"Error al procesar la nueva copia de la hoja de cálculo: {str(e)}")
+
+    def _get_spreadsheet(self):
+        if self._spreadsheet is None:
+            self._spreadsheet = google_api.call(self.client.open_by_key, self.spreadsheet_id)
+        return self._spreadsheet
+
+    def _get_worksheet(self):
+        # sheet1 consulta los metadatos de la hoja cada vez, así que se guarda la primera obtenida
+        if self._worksheet is None:
+            self._worksheet = google_api.call(self._get_spreadsheet().get_worksheet, 0)  # equivale a sheet1
+        return self._worksheet
+
+    def _get_revision(self):
+        # Fecha de última modificación en Drive: una petición de metadatos, sin descargar la hoja
+        return google_api.call(self._get_spreadsheet().get_lastUpdateTime)
+
+    def _save(self):
+        if not self.path:
+            return
+        data = {
+            "spreadsheet_id": self.spreadsheet_id,
+            "revision": self.revision,
+            "loaded_at": self.loaded_at,
+            "records": self.records,
+        }
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except (OSError, TypeError) as e:
+            logging.error(f"No se pudo guardar la instantánea de la hoja: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("spreadsheet_id") != self.spreadsheet_id:
+            return
+        self.records = data.get("records")
+        self.revision = data.get("revision")
+        self.loaded_at = data.get("loaded_at")
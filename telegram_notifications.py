@@ -11,29 +11,43 @@
 import requests
 # Importamos el módulo argparse, que nos permite manejar argumentos de línea de comandos
 import argparse
+# Importamos el cliente del demonio de notificaciones y la URL de la API de Telegram
+from notification_daemon import enqueue_notification, format_message, TELEGRAM_API_URL
+# Importamos el registro de métricas para medir la latencia de los envíos directos
+import metrics
+
+# Segundos máximos de espera a la API de Telegram en los envíos directos
+TELEGRAM_TIMEOUT = 10
 
 # Definimos una función para enviar mensajes a través de Telegram
 def send_telegram_message(api_key, chat_id, mensaje):
     # Construimos la URL de la API de Telegram
-    url = f"https://api.telegram.org/bot{api_key}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{api_key}/sendMessage"
     # Definimos los parámetros que se enviarán en la solicitud
     parametros = {
         "chat_id": chat_id,  # El ID del chat al que se enviará el mensaje
         "text": mensaje  # El mensaje que se enviará
     }
     # Enviamos una solicitud POST a la API de Telegram con los parámetros definidos
-    response = requests.post(url, json=parametros)
+    with metrics.timer("telegram_request_seconds", metodo="sendMessage"):
+        response = requests.post(url, json=parametros, timeout=TELEGRAM_TIMEOUT)
     # Devolvemos la respuesta de la API de Telegram en formato JSON
     return response.json()
 
-# Definimos la función principal que se ejecutará cuando se ejecute el script
-def main(mensaje):
-    # Definimos el token de nuestro bot de Telegram
+# Definimos una función para notificar sin bloquear, a través del demonio de notificaciones
+def notify(mensaje, estado=None):
+    # Entregamos el mensaje al demonio, que lo enviará agrupado y respetando los límites de Telegram
+    if enqueue_notification(mensaje, estado):
+        return {"ok": True, "queued": True}
+    # Si el demonio no está disponible, enviamos el mensaje directamente
     api_key = "Introduce el token de tu bot"
-    # Definimos el ID del chat al que queremos enviar mensajes
     chat_id = "Introduce el ID de tu chat"
+    return send_telegram_message(api_key, chat_id, format_message(mensaje, estado))
+
+# Definimos la función principal que se ejecutará cuando se ejecute el script
+def main(mensaje, estado=None):
     # Llamamos a la función para enviar el mensaje
-    respuesta = send_telegram_message(api_key, chat_id, mensaje)
+    respuesta = notify(mensaje, estado)
     # Verificamos si el mensaje se envió correctamente
     if respuesta['ok']:
         print("Mensaje enviado correctamente.")
@@ -46,7 +60,9 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Envía un mensaje a través de Telegram.')
     # Añadimos un argumento 'mensaje' al analizador
     parser.add_argument('mensaje', type=str, help='El mensaje que deseas enviar.')
+    # Añadimos un argumento opcional 'estado' (starting, finished o error)
+    parser.add_argument('estado', type=str, nargs='?', default=None, help='Estado del mensaje (opcional).')
     # Analizamos los argumentos de la línea de comandos
     args = parser.parse_args()
     # Llamamos a la función principal con el mensaje proporcionado como argumento
-    main(args.mensaje)
+    main(args.mensaje, args.estado)
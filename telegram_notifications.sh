@@ -14,6 +14,16 @@ TOKEN="Introduce el token de tu bot"
 # ID del chat donde se enviarán las notificaciones
 CHAT_ID="Introduce el ID de tu chat"
 
+# URL de la API de Telegram; se puede apuntar a un servidor local falso para pruebas
+TELEGRAM_API_URL="${TELEGRAM_API_URL:-https://api.telegram.org}"
+
+# Directorio de spool del demonio de notificaciones (notification_daemon.py)
+SPOOL_DIR="${OPT_ROOT:-/opt}/admin/notifications_spool"
+
+# Latido del demonio y segundos sin actualizarlo tras los que se da por parado
+HEARTBEAT_PATH="${OPT_ROOT:-/opt}/admin/notifications.heartbeat"
+HEARTBEAT_TTL=10
+
 # Mensaje que se enviará como notificación
 MESSAGE="$1"
 
@@ -23,9 +33,35 @@ STATUS="$2"
 # Función para enviar el mensaje a través de la API de Telegram
 send_telegram_message() {
     local message="$1"
-    curl -s -X POST "https://api.telegram.org/bot$TOKEN/sendMessage" -d chat_id="$CHAT_ID" -d text="$message" > /dev/null 2>&1
+    curl -s -X POST "${TELEGRAM_API_URL%/}/bot$TOKEN/sendMessage" -d chat_id="$CHAT_ID" -d text="$message" > /dev/null 2>&1
 }
 
+# Indica si el demonio ha actualizado su latido hace menos de HEARTBEAT_TTL segundos
+daemon_alive() {
+    local heartbeat
+    heartbeat=$(stat -c %Y "$HEARTBEAT_PATH" 2>/dev/null) || return 1
+    [ $(( $(date +%s) - heartbeat )) -le "$HEARTBEAT_TTL" ]
+}
+
+# Si el demonio de notificaciones está activo, dejar el mensaje en su spool y terminar
+# sin esperar a Telegram; el demonio aplica el formato según el estado y agrupa las ráfagas
+# Si el demonio está parado, el mensaje se envía directamente para no dejarlo en un spool que nadie lee
+if [ -d "$SPOOL_DIR" ] && daemon_alive; then
+    STATUS_LOWER=$(echo "$STATUS" | tr '[:upper:]' '[:lower:]')
+    case "$STATUS_LOWER" in
+        ""|"starting"|"finished"|"error")
+            ;;
+        *)
+            echo "Unknown status: $STATUS"
+            exit 1
+            ;;
+    esac
+    SPOOL_NAME="$(date +%s%N).$$"
+    printf '%s\n%s' "$STATUS_LOWER" "$MESSAGE" > "$SPOOL_DIR/.$SPOOL_NAME" \
+        && mv "$SPOOL_DIR/.$SPOOL_NAME" "$SPOOL_DIR/$SPOOL_NAME" \
+        && exit 0
+fi
+
 # Verificar si el segundo parámetro (STATUS) está vacío
 if [ -z "$STATUS" ]; then
     send_telegram_message "$MESSAGE"